@@ -11,6 +11,9 @@ class Agent:
     def get_genome(self):
         pass
 
+    def get_memory(self):
+        pass
+
     def save_model(self, name):
         pass
 
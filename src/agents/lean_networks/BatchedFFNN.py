@@ -0,0 +1,115 @@
+import numpy as np
+
+from agents.lean_networks.FFNN_multilayer import FFNN_multilayer
+
+'''
+Forward pass of a population of FFNN_multilayer networks with the same architecture, done for all of them at once
+'''
+
+
+class BatchedFFNN:
+    def __init__(self, networks):
+        """
+        Stack the weights of every network. Each layer's weight matrices become a single array with shape (P, out, in)
+        for a population of P networks, so each layer of the whole population is computed with one matrix
+        multiplication
+
+        @param networks: List of FFNN_multilayer with the same architecture, bias and activation function
+        """
+        assert len(networks) > 0, 'Must supply at least one network!'
+        assert BatchedFFNN.can_batch(networks), 'Networks must have the same architecture to be batched!'
+
+        self.N_inputs = networks[0].N_inputs
+        self.N_outputs = networks[0].N_outputs
+        self.use_bias = networks[0].use_bias
+        self.act_fn = networks[0].act_fn
+        self.w_mat_shapes = networks[0].w_mat_shapes
+        self.w_mat_lens = networks[0].w_mat_lens
+        self.N_weights = networks[0].N_weights
+
+        self.set_weights([np.stack([net.weights_matrix[i] for net in networks])
+                          for i in range(len(networks[0].weights_matrix))])
+
+    @classmethod
+    def from_genomes(cls, network, genomes):
+        """
+        Create a population of networks straight from a matrix of genomes, without creating a network for each one
+
+        @param network: FFNN_multilayer with the architecture, bias and activation function of the population. Its own
+        weights are not used
+        @param genomes: Array with shape (P, N_weights), the weights of one network per row in the order of
+        FFNN_multilayer.get_weights_as_list()
+        @return: BatchedFFNN
+        """
+        batched_network = cls([network])
+        batched_network.set_weights_by_matrix(genomes)
+        return batched_network
+
+    @staticmethod
+    def can_batch(networks):
+        """
+        @param networks: List of networks
+        @return: True if the networks are all FFNN_multilayer with the same weight shapes, bias and activation function
+        """
+        return all(isinstance(net, FFNN_multilayer) for net in networks) and \
+            len(set((tuple(net.w_mat_shapes), net.use_bias, net.act_fn_name) for net in networks)) == 1
+
+    def set_weights(self, weights):
+        """
+        @param weights: List with one array of shape (P, out, in) for each layer
+        @return:
+        """
+        self.weights_matrix = weights
+        self.N_networks = len(weights[0])
+
+        # Input of each layer: the output of the layer below and the (optional) bias column, which is always 1
+        self.layer_inputs = [np.ones((self.N_networks, w.shape[2])) for w in self.weights_matrix]
+
+    def set_weights_by_matrix(self, genomes):
+        """
+        Same as FFNN_multilayer.set_weights_by_list() for every network in the population
+
+        @param genomes: Array with shape (P, N_weights), one genome per row
+        @return:
+        """
+        genomes = np.asarray(genomes, dtype=np.float64)
+        assert genomes.ndim == 2 and genomes.shape[1] == self.N_weights, 'Genomes do not match the architecture!'
+
+        cur_idx = 0
+        w_mat_list = []
+
+        for w_len, w_shape in zip(self.w_mat_lens, self.w_mat_shapes):
+            w_mat_list.append(genomes[:, cur_idx: cur_idx + w_len].reshape((len(genomes),) + w_shape))
+            cur_idx += w_len
+
+        self.set_weights(w_mat_list)
+
+    def set_state(self, networks):
+        # Nothing to do for FFNN, but want it to be callable still.
+        pass
+
+    def reset_state(self):
+        # Nothing to do for FFNN, but want it to be callable still.
+        pass
+
+    def forward(self, input_matrix):
+        '''
+        Same as FFNN_multilayer.forward() for every network in the population.
+
+        @param input_matrix: Array with shape (P, N_inputs), one input vector for each network
+        @return: Array with shape (P, N_outputs), the output of each network
+        '''
+
+        x = input_matrix
+
+        for i, w in enumerate(self.weights_matrix):
+            if self.use_bias:
+                layer_input = self.layer_inputs[i]
+                layer_input[:, :x.shape[1]] = x
+                x = layer_input
+
+            # Multiply every network's input by its own weights and pass through activation function
+            x = np.matmul(w, x[:, :, np.newaxis])[:, :, 0]
+            x = self.act_fn(x)
+
+        return x
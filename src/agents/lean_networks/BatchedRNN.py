@@ -0,0 +1,131 @@
+import numpy as np
+
+from agents.lean_networks.RNN_multilayer import RNN_multilayer
+
+'''
+Forward pass of a population of RNN_multilayer networks with the same architecture, done for all of them at once
+'''
+
+
+class BatchedRNN:
+    def __init__(self, networks):
+        """
+        Stack the weights and recurrent state of every network. Each layer's weight matrices become a single array with
+        shape (P, out, in) for a population of P networks, so each layer of the whole population is advanced with one
+        matrix multiplication per time step
+
+        @param networks: List of RNN_multilayer with the same architecture, bias and activation function
+        """
+        assert len(networks) > 0, 'Must supply at least one network!'
+        assert BatchedRNN.can_batch(networks), 'Networks must have the same architecture to be batched!'
+
+        self.N_inputs = networks[0].N_inputs
+        self.N_outputs = networks[0].N_outputs
+        self.use_bias = networks[0].use_bias
+        self.act_fn = networks[0].act_fn
+        self.w_mat_shapes = networks[0].w_mat_shapes
+        self.w_mat_lens = networks[0].w_mat_lens
+        self.N_weights = networks[0].N_weights
+
+        self.set_weights([np.stack([net.weights_matrix[i] for net in networks])
+                          for i in range(len(networks[0].weights_matrix))])
+        self.set_state(networks)
+
+    @classmethod
+    def from_genomes(cls, network, genomes):
+        """
+        Create a population of networks straight from a matrix of genomes, without creating a network for each one.
+        Every network starts with a state of 0
+
+        @param network: RNN_multilayer with the architecture, bias and activation function of the population. Its own
+        weights and state are not used
+        @param genomes: Array with shape (P, N_weights), the weights of one network per row in the order of
+        RNN_multilayer.get_weights_as_list()
+        @return: BatchedRNN
+        """
+        batched_network = cls([network])
+        batched_network.set_weights_by_matrix(genomes)
+        return batched_network
+
+    @staticmethod
+    def can_batch(networks):
+        """
+        @param networks: List of networks
+        @return: True if the networks are all RNN_multilayer with the same weight shapes, bias and activation function
+        """
+        return all(isinstance(net, RNN_multilayer) for net in networks) and \
+            len(set((tuple(net.w_mat_shapes), net.use_bias, net.act_fn_name) for net in networks)) == 1
+
+    def set_weights(self, weights):
+        """
+        Set the weights of the population and give every network a state of 0
+        @param weights: List with one array of shape (P, out, in) for each layer
+        @return:
+        """
+        self.weights_matrix = weights
+        self.N_networks = len(weights[0])
+        self.last_output = [np.zeros((self.N_networks, w.shape[1])) for w in self.weights_matrix]
+
+        # Input of each layer: the input from the layer below, the (optional) bias and the layer's last output
+        self.layer_inputs = [np.ones((self.N_networks, w.shape[2])) for w in self.weights_matrix]
+
+    def set_weights_by_matrix(self, genomes):
+        """
+        Same as RNN_multilayer.set_weights_by_list() for every network in the population
+
+        @param genomes: Array with shape (P, N_weights), one genome per row
+        @return:
+        """
+        genomes = np.asarray(genomes, dtype=np.float64)
+        assert genomes.ndim == 2 and genomes.shape[1] == self.N_weights, 'Genomes do not match the architecture!'
+
+        cur_idx = 0
+        w_mat_list = []
+
+        for w_len, w_shape in zip(self.w_mat_lens, self.w_mat_shapes):
+            w_mat_list.append(genomes[:, cur_idx: cur_idx + w_len].reshape((len(genomes),) + w_shape))
+            cur_idx += w_len
+
+        self.set_weights(w_mat_list)
+
+    def set_state(self, networks):
+        """
+        Set the last output of each layer of every network to that of the given networks
+        @param networks: List of RNN_multilayer, one for each network in the population
+        @return:
+        """
+        self.last_output = [np.stack([net.last_output[i] for net in networks])
+                            for i in range(len(self.weights_matrix))]
+
+    def reset_state(self):
+        """
+        Sets the last output of each layer of every network to 0
+        @return:
+        """
+        for output in self.last_output:
+            output.fill(0.0)
+
+    def forward(self, input_matrix):
+        '''
+        Same as RNN_multilayer.forward() for every network in the population.
+
+        @param input_matrix: Array with shape (P, N_inputs), one input vector for each network
+        @return: Array with shape (P, N_outputs), the output of each network
+        '''
+
+        x = input_matrix
+
+        for i, w in enumerate(self.weights_matrix):
+            # Concatenate with (optional) bias and the last output of this layer. The bias column is always 1
+            layer_input = self.layer_inputs[i]
+            layer_input[:, :x.shape[1]] = x
+            layer_input[:, layer_input.shape[1] - self.last_output[i].shape[1]:] = self.last_output[i]
+
+            # Multiply every network's input by its own weights and pass through activation function
+            x = np.matmul(w, layer_input[:, :, np.newaxis])[:, :, 0]
+            x = self.act_fn(x)
+
+            # Update the last output of this layer
+            self.last_output[i] = x
+
+        return x
@@ -35,6 +35,7 @@ class FFNN_multilayer:
         }
         assert act_fn in activation_fn_d.keys(), 'Must supply valid activation function name!'
         self.act_fn = activation_fn_d[act_fn]
+        self.act_fn_name = act_fn
 
     def reset_state(self):
         # Nothing to do for FFNN, but want it to be callable still.
@@ -94,31 +95,34 @@ class FFNN_multilayer:
         self.w_mat_shapes = [w.shape for w in self.weights_matrix]
         self.w_mat_lens = [len(w.flatten()) for w in self.weights_matrix]
         self.N_weights = sum(self.w_mat_lens)
+        self.set_weights(self.weights_matrix)
 
     def set_weights(self, weights):
         # Directly set the weights matrix. In the case of the FFNN, it will
-        # be a list of np matrices.
-        self.weights_matrix = weights
+        # be a list of np matrices, which are copied into a single flat buffer.
+        self.set_weights_by_list(np.concatenate([np.ravel(w) for w in weights]))
 
     def set_weights_by_list(self, w_list):
         # Handy for setting externally, when we don't want to deal with the shapes
-        # of the matrices of different layers.
+        # of the matrices of different layers. An array genome becomes the network's
+        # flat weight buffer without being copied (so it must not be changed afterwards)
+        # and each layer's matrix is a view into it.
+        self.weights_flat = np.asarray(w_list)[:self.N_weights]
         cur_list_idx = 0
         w_mat_list = []
         for w_len, w_shape in zip(self.w_mat_lens, self.w_mat_shapes):
-            w_mat = np.array(w_list[cur_list_idx: cur_list_idx + w_len]).reshape(w_shape)
+            w_mat = self.weights_flat[cur_list_idx: cur_list_idx + w_len].reshape(w_shape)
             w_mat_list.append(w_mat)
             cur_list_idx += w_len
 
-        self.set_weights(w_mat_list)
+        self.weights_matrix = w_mat_list
 
     def get_weights_as_list(self):
-        w_mat_list = []
-        for w_mat in self.weights_matrix:
-            w_flat = w_mat.flatten().tolist()
-            w_mat_list += w_flat
-
-        return w_mat_list
+        # A read-only view of the flat weight buffer, not a copy. Changing it in place would
+        # change the network, so copy it first to get a genome that can be changed.
+        weights = self.weights_flat.view()
+        weights.flags.writeable = False
+        return weights
 
     def get_num_weights(self):
         return self.N_weights
@@ -127,6 +131,10 @@ class FFNN_multilayer:
         # Just calls init_weights, which will randomize them.
         self.init_weights()
 
+    def get_memory(self):
+        # The output only depends on the input
+        return b""
+
     def forward(self, input_vec):
 
         '''
@@ -1,21 +1,37 @@
+import copy
 import json
 import numpy as np
 import warnings
 from agents.agent import Agent
 from agents.lean_networks.FFNN_multilayer import FFNN_multilayer
 from agents.lean_networks.RNN_multilayer import RNN_multilayer
+from agents.lean_networks.BatchedFFNN import BatchedFFNN
+from agents.lean_networks.BatchedRNN import BatchedRNN
 
 
 class NNAgent(Agent):
-    def __init__(self, observation_size, action_size, parameter_filename, genome=None):
+    # Largest number of observations a network can be compiled for (see compile_action_table())
+    MAX_ACTION_TABLE_SIZE = 2 ** 16
+
+    def __init__(self, observation_size, action_size, parameter_filename, genome=None, parameter_dictionary=None,
+                 network=None):
+        """
+        @param observation_size: Size of the agent's observations
+        @param action_size: Number of actions
+        @param parameter_filename: Name of the file containing the experiment parameters
+        @param genome: Weights of the agent's network
+        @param parameter_dictionary: Parsed experiment parameters. If given, the parameter file isn't read
+        @param network: Network of the right architecture for the parameters, used instead of creating a new one. Its
+        weights are replaced by the genome (see NNAgentFactory)
+        """
         # Load parameters
         if parameter_filename is None:
             raise RuntimeError("No parameter file specified for the neural network")
 
-        self.parameter_dictionary = json.loads(open(parameter_filename).read())
+        if parameter_dictionary is None:
+            parameter_dictionary = json.loads(open(parameter_filename).read())
 
-        # Set activation
-        activation_function = self.parameter_dictionary['agent']['nn']['activation_function']
+        self.parameter_dictionary = parameter_dictionary
 
         # Set hidden layers
         self.num_hidden_layers = self.parameter_dictionary['agent']['nn']['hidden_layers']
@@ -28,18 +44,12 @@ class NNAgent(Agent):
             self.bias = False
 
         # Create neural network and random number generator
-        self.net = None
         self.random_seed = self.parameter_dictionary['general']['seed']
 
-        if self.parameter_dictionary['agent']['nn']['architecture'] == "rnn":
-            self.net = RNN_multilayer(N_inputs=observation_size, N_outputs=action_size, act_fn=activation_function,
-                                      use_bias=self.bias, N_hidden_layers=self.num_hidden_layers,
-                                      N_hidden_units=self.num_hidden_units, random_dist="normal", seed=self.random_seed)
+        if network is None:
+            network = NNAgent.create_network(observation_size, action_size, self.parameter_dictionary)
 
-        elif self.parameter_dictionary['agent']['nn']['architecture'] == "ffnn":
-            self.net = FFNN_multilayer(N_inputs=observation_size, N_outputs=action_size, act_fn=activation_function,
-                                      use_bias=self.bias, N_hidden_layers=self.num_hidden_layers,
-                                      N_hidden_units=self.num_hidden_units, random_dist="normal", seed=self.random_seed)
+        self.net = network
 
         # Set weights if possible
         if genome is None:
@@ -47,13 +57,63 @@ class NNAgent(Agent):
         else:
             self.net.set_weights_by_list(genome)
 
+        # Optionally replace the feedforward network by a table of its action for every observation
+        self.action_table = None
+        self.action_table_weights = None
+
+        if self.parameter_dictionary['agent']['nn'].get('action_table', "False") == "True" and genome is not None:
+            self.compile_action_table()
+
     def get_genome(self):
+        """
+        @return: Read-only array of the network's weights. This is a view of the network's own weight buffer, not a
+        copy, so it must be copied before being changed
+        """
         return self.net.get_weights_as_list()
 
     def get_num_weights(self):
         return self.net.get_num_weights()
 
+    def compile_action_table(self):
+        """
+        Precompute the action the feedforward network takes for every observation, so that act() is a single lookup.
+        Observations must be laid out like those of SlopeEnv: one bit for each tile in sensing range, then 4 one-hot
+        bits for the area the agent is in and a bit for carrying a resource. The table has an entry for each of the
+        2^(tiles in range) * 4 * 2 such observations (4096 with a sensor range of 1), indexed by packing the tile bits,
+        the index of the area and the carry bit into an integer. The whole table is computed with one batched forward
+        pass
+
+        @return:
+        """
+        if not isinstance(self.net, FFNN_multilayer):
+            raise RuntimeError("Only feedforward networks can be compiled into an action table")
+
+        num_tile_bits = self.net.N_inputs - 5
+        table_size = 2 ** num_tile_bits * 4 * 2
+
+        if table_size > NNAgent.MAX_ACTION_TABLE_SIZE:
+            raise RuntimeError("Observations are too large to compile the network into an action table")
+
+        # Weight of each observation bit in the index. Only one of the area bits is set, so they add up to the index of
+        # the area
+        self.action_table_weights = np.concatenate((8 * 2 ** np.arange(num_tile_bits), [0, 2, 4, 6], [1]))
+
+        # Observation of each entry of the table
+        index = np.arange(table_size)
+        observations = np.zeros((table_size, self.net.N_inputs), dtype=np.int64)
+        observations[:, :num_tile_bits] = (index[:, np.newaxis] >> (3 + np.arange(num_tile_bits))) & 1
+        observations[index, num_tile_bits + ((index >> 1) & 3)] = 1
+        observations[:, -1] = index & 1
+
+        # Every entry is run through the same weights, as if by a population of copies of the network
+        batched_net = BatchedFFNN([self.net])
+        batched_net.set_weights([np.broadcast_to(w, (table_size,) + w.shape) for w in self.net.weights_matrix])
+        self.action_table = batched_net.forward(observations).argmax(axis=1)
+
     def act(self, observation):
+        if self.action_table is not None:
+            return self.action_table[np.dot(observation, self.action_table_weights)]
+
         activation_values = self.net.forward(observation)
         action = activation_values.argmax()
         return action
@@ -61,10 +121,49 @@ class NNAgent(Agent):
     def get_all_activation_values(self, observation):
         return self.net.forward(observation)
 
+    def get_memory(self):
+        """
+        Everything besides the observation that the agent's next action depends on
+        @return: Bytes of the network's recurrent state (empty for a feedforward network)
+        """
+        return self.net.get_memory()
+
     def save_model(self, name):
         weights = self.get_genome()
         np.save(name, weights)
 
+    @staticmethod
+    def create_network(observation_size, action_size, parameter_dictionary):
+        """
+        Create a network with the architecture given by the parameters and randomly initialised weights
+
+        @param observation_size: Size of the agent's observations
+        @param action_size: Number of actions
+        @param parameter_dictionary: Parsed experiment parameters
+        @return: RNN_multilayer or FFNN_multilayer
+        """
+        nn_parameters = parameter_dictionary['agent']['nn']
+        bias = None
+
+        if nn_parameters['bias'] == "True":
+            bias = True
+        elif nn_parameters['bias'] == "False":
+            bias = False
+
+        if nn_parameters['architecture'] == "rnn":
+            return RNN_multilayer(N_inputs=observation_size, N_outputs=action_size,
+                                  act_fn=nn_parameters['activation_function'], use_bias=bias,
+                                  N_hidden_layers=nn_parameters['hidden_layers'],
+                                  N_hidden_units=nn_parameters['hidden_units_per_layer'], random_dist="normal",
+                                  seed=parameter_dictionary['general']['seed'])
+
+        elif nn_parameters['architecture'] == "ffnn":
+            return FFNN_multilayer(N_inputs=observation_size, N_outputs=action_size,
+                                   act_fn=nn_parameters['activation_function'], use_bias=bias,
+                                   N_hidden_layers=nn_parameters['hidden_layers'],
+                                   N_hidden_units=nn_parameters['hidden_units_per_layer'], random_dist="normal",
+                                   seed=parameter_dictionary['general']['seed'])
+
     @staticmethod
     def save_given_model(model, filename):
         np.save(filename, model)
@@ -79,3 +178,63 @@ class NNAgent(Agent):
     @staticmethod
     def get_model_file_extension():
         return ".npy"
+
+
+class NNAgentFactory:
+    """
+    Creates NNAgents for one parameter file. The file is parsed and a network with the right architecture is created
+    once, so creating an agent from a genome neither reads the file nor works out the shapes of the network's layers
+    again. Agents are the same as those created by NNAgent() with the same arguments
+    """
+
+    def __init__(self, observation_size, action_size, parameter_filename):
+        """
+        @param observation_size: Size of each agent's observations
+        @param action_size: Number of actions
+        @param parameter_filename: Name of the file containing the experiment parameters
+        """
+        if parameter_filename is None:
+            raise RuntimeError("No parameter file specified for the neural network")
+
+        self.observation_size = observation_size
+        self.action_size = action_size
+        self.parameter_filename = parameter_filename
+        self.parameter_dictionary = json.loads(open(parameter_filename).read())
+        self.network = NNAgent.create_network(observation_size, action_size, self.parameter_dictionary)
+
+    def create_agent(self, genome=None):
+        """
+        @param genome: Weights of the agent's network
+        @return: NNAgent
+        """
+        # The copy shares the layer shapes with self.network. It gets its own random number generator, in the state a
+        # newly created network's would be in, and its own weights and state
+        network = copy.copy(self.network)
+        network.np_random = copy.deepcopy(self.network.np_random)
+
+        if genome is None:
+            network.set_weights_by_list(self.network.get_weights_as_list().copy())
+        else:
+            network.reset_state()
+
+        return NNAgent(self.observation_size, self.action_size, self.parameter_filename, genome,
+                       parameter_dictionary=self.parameter_dictionary, network=network)
+
+    def create_batched_network(self, genomes):
+        """
+        Create the networks of a population of NNAgents together, straight from their genomes, without creating an
+        agent or network for each one
+
+        @param genomes: Array with shape (P, num_weights), the genome of one agent per row
+        @return: BatchedRNN or BatchedFFNN (depending on the architecture) holding the P networks
+        """
+        if isinstance(self.network, RNN_multilayer):
+            return BatchedRNN.from_genomes(self.network, genomes)
+        else:
+            return BatchedFFNN.from_genomes(self.network, genomes)
+
+    def get_num_weights(self):
+        return self.network.get_num_weights()
+
+    def get_parameter_dictionary(self):
+        return self.parameter_dictionary
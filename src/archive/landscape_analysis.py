@@ -9,6 +9,8 @@ from scipy.stats import multivariate_normal
 
 import pandas as pd
 
+from trajectory_recorder import TrajectoryRecorder
+
 
 def generate_genomes(team_type, selection_level, distribution, num_samples, start_sample):
     num_dimensions = 288
@@ -66,7 +68,16 @@ def generate_genomes(team_type, selection_level, distribution, num_samples, star
     f.close()
 
 
-def analyse_motion(results_file, visualise):
+def analyse_motion(results_file, visualise, trajectory_file=None, graph_file=None):
+    """
+    Print the team fitness of every genome in a results file.
+    If trajectory_file is given, instead print the team fitness of every episode in a trajectory file saved by
+    FitnessCalculator.calculate_fitness(logging=True) and plot how far each agent is up the arena at each step
+    """
+    if trajectory_file is not None:
+        analyse_recorded_motion(trajectory_file, graph_file)
+        return
+
     using_gym = False
     render = False
     time_delay = 0
@@ -100,6 +111,34 @@ def analyse_motion(results_file, visualise):
         print(team_fitness)
 
 
+def analyse_recorded_motion(trajectory_file, graph_file):
+    """
+    Print the team fitness of every episode in a trajectory file saved by FitnessCalculator.calculate_fitness(logging=True)
+    and plot how far each agent is up the arena at each step
+    """
+    trajectories = TrajectoryRecorder.load(trajectory_file)
+    positions = trajectories["positions"]
+    num_episodes, num_steps, num_agents = positions.shape[:3]
+
+    for episode, team_fitness in enumerate(trajectories["rewards"].sum(axis=(1, 2), dtype=np.float64)):
+        print(f"Episode {episode}: {team_fitness}")
+
+    fig1, axes = plt.subplots(num_episodes, 1, figsize=(12, 3 * num_episodes), squeeze=False)
+
+    for episode in range(num_episodes):
+        ax1 = axes[episode, 0]
+        ax1.set_title(f'Episode {episode}')
+        ax1.set_ylabel('y position')
+        ax1.set_xlabel('Time step')
+
+        for i in range(num_agents):
+            ax1.plot(range(num_steps), positions[episode, :, i, 1], label=f'Agent {i}')
+
+        ax1.legend()
+
+    plt.savefig(graph_file)
+
+
 def plot_fitness_distribution(results_file, graph_file):
     """
     Plot distribution of random points from the fitness landscape as violin plots
@@ -146,7 +185,12 @@ def plot_fitness_distribution(results_file, graph_file):
     plt.savefig(graph_file)
 
 
-def plot_action_distribution(genome_file, graph_file):
+def plot_action_distribution(genome_file, graph_file, trajectory_file=None):
+    """
+    Plot how many times each action is chosen by the genomes in a genome file over randomly sampled observations.
+    If trajectory_file is given, instead plot how many times each action was chosen in a trajectory file saved by
+    FitnessCalculator.calculate_fitness(logging=True)
+    """
     num_dimensions = 288
     num_observations = 500*5
     num_networks = 500
@@ -155,41 +199,45 @@ def plot_action_distribution(genome_file, graph_file):
     observation_length = 41
     action_length = 6
 
-    # Get samples
-    f = open(genome_file, "r")
-    data = f.read().strip().split("\n")
-    f.close()
+    if trajectory_file is not None:
+        actions = np.bincount(TrajectoryRecorder.load(trajectory_file)["actions"].ravel(), minlength=action_length)
 
-    # Sample num_observations observations uniformly
-    min_array = np.full((1, observation_length), 0)
-    max_array = np.full((1, observation_length), 2)
-    random_state = np.random.RandomState(seed)
-    # sampled_points = random_state.uniform(min_array, max_array, (num_samples, num_dimensions))
-    observation_sequence = []
-
-    for i in range(num_observations):
-        new_observation = random_state.randint(min_array, max_array)
-        observation_sequence += [new_observation]
-
-    actions = [0, 0, 0, 0, 0, 0]
-
-    # For all genomes
-    for row in data:
-        # Get genome
-        genome = np.array([float(element) for element in row.split(",")[0:-3]])
+    else:
+        # Get samples
+        f = open(genome_file, "r")
+        data = f.read().strip().split("\n")
+        f.close()
 
-        # Test genome on observation
-        try:
-            network = TinyAgent(observation_length, action_length, seed)
-            network.load_weights(genome)
-        except:
-            genome = np.array([float(element) for element in row.split(",")])
-            network = TinyAgent(observation_length, action_length, seed)
-            network.load_weights(genome)
-
-        for observation in observation_sequence:
-            action = network.act(observation)
-            actions[action] += 1
+        # Sample num_observations observations uniformly
+        min_array = np.full((1, observation_length), 0)
+        max_array = np.full((1, observation_length), 2)
+        random_state = np.random.RandomState(seed)
+        # sampled_points = random_state.uniform(min_array, max_array, (num_samples, num_dimensions))
+        observation_sequence = []
+
+        for i in range(num_observations):
+            new_observation = random_state.randint(min_array, max_array)
+            observation_sequence += [new_observation]
+
+        actions = [0, 0, 0, 0, 0, 0]
+
+        # For all genomes
+        for row in data:
+            # Get genome
+            genome = np.array([float(element) for element in row.split(",")[0:-3]])
+
+            # Test genome on observation
+            try:
+                network = TinyAgent(observation_length, action_length, seed)
+                network.load_weights(genome)
+            except:
+                genome = np.array([float(element) for element in row.split(",")])
+                network = TinyAgent(observation_length, action_length, seed)
+                network.load_weights(genome)
+
+            for observation in observation_sequence:
+                action = network.act(observation)
+                actions[action] += 1
 
     # Plot data
     fig1, ax1 = plt.subplots(figsize=(12, 4))
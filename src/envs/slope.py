@@ -10,27 +10,89 @@ to a battery), with the cost increasing if they are traveling up the slope and/o
 they are traveling down the slope. The environment is a 2D grid-world with a discrete action-space.
 """
 import json
+import time
+import warnings
 import numpy as np
-import copy
 
-# Put this import in a try/except because otherwise, the cluster throws an error
-try:
+# Imported on first use by import_rendering() and import_kernels(), so that environments that are never rendered don't
+# load pyglet and environments using the python backend don't load numba
+rendering = None
+slope_kernels = None
+
+
+def import_rendering():
+    """
+    Import the rendering module (and pyglet) the first time an environment is rendered
+    @return:
+    """
+    global rendering
     from helpers import rendering
 
-except:
-    pass
+
+def import_kernels():
+    """
+    Import the kernels of the numba backend (and numba, if it is installed) the first time they are needed
+    @return:
+    """
+    global slope_kernels
+    from envs import slope_kernels
+
+
+def generate_padded_walls(arena_length, arena_width, sensor_range):
+    """
+    Generate a grid that is True in a border as wide as the sensor range around the arena and False inside it. Only the
+    border is written, so the cost grows with the perimeter of the arena rather than its area
+    @param arena_length: Number of rows of the arena
+    @param arena_width: Number of columns of the arena
+    @param sensor_range: Width of the border
+    @return: Boolean array indexed by [y + sensor_range, x + sensor_range]
+    """
+    padded_walls = np.zeros((arena_length + 2 * sensor_range, arena_width + 2 * sensor_range), dtype=bool)
+    padded_walls[:sensor_range] = True
+    padded_walls[sensor_range + arena_length:] = True
+    padded_walls[:, :sensor_range] = True
+    padded_walls[:, sensor_range + arena_width:] = True
+    return padded_walls
 
 
 class SlopeEnv:
+    # Area codes. Index into self.area_names and the area bits of an observation
+    NEST = 0
+    CACHE = 1
+    SLOPE = 2
+    SOURCE = 3
+
+    # Action codes. Index into self.action_name
+    FORWARD = 0
+    BACKWARD = 1
+    PICKUP = 4
+    DROP = 5
+
     # Primary functions -----------------------------------------------------------------------------------------------
-    def __init__(self, parameter_filename=None):
+    def __init__(self, parameter_filename=None, backend="python", headless=False):
         """
         Initialises constants and variables for agents, resources and environment
-        :param
+        :param parameter_filename: Name of the file containing the experiment parameters
+        :param backend: "python" to step with the methods of this class or "numba" to step with the compiled kernels in
+        envs/slope_kernels.py. Falls back to "python" if numba is not installed
+        :param headless: If True, the environment can't be rendered and never touches the rendering module
         """
         if parameter_filename is None:
             raise RuntimeError("No parameter file specified for the environment")
 
+        if backend not in ["python", "numba"]:
+            raise RuntimeError("Backend is not set to python or numba")
+
+        if backend == "numba":
+            import_kernels()
+
+            if not slope_kernels.numba_available:
+                warnings.warn("numba is not installed. Using the python backend")
+                backend = "python"
+
+        self.backend = backend
+        self.headless = headless
+
         parameter_dictionary = json.loads(open(parameter_filename).read())
 
         # Environment dimensions
@@ -66,7 +128,6 @@ class SlopeEnv:
         self.num_agents = parameter_dictionary['environment']['slope']['num_agents']
         self.default_num_resources = parameter_dictionary['environment']['slope']['num_resources']
         self.episode_length = parameter_dictionary['environment']['slope']['episode_length']
-        self.max_resources = self.episode_length * self.num_agents  # It is impossible to collect this many resources
         self.current_num_resources = self.default_num_resources
         self.latest_resource_id = self.default_num_resources - 1
         if parameter_dictionary['environment']['slope']['incremental_rewards'] == "True":
@@ -77,6 +138,34 @@ class SlopeEnv:
             raise RuntimeError("Incremental rewards is not set to True or False")
             raise RuntimeError("Incremental rewards is not set to True or False")
 
+        if self.incremental_rewards and self.backend == "numba":
+            raise RuntimeError("Incremental rewards are not supported by the numba backend")
+
+        # How new resources are placed at the source (see README.md). "rejection" (the default) draws random source
+        # tiles until a free one comes up, so the same seed gives the same results as earlier versions. "free_cells"
+        # draws one of the free source tiles directly, which avoids retries when the source is nearly full
+        self.resource_spawning = parameter_dictionary['environment']['slope'].get('resource_spawning', "rejection")
+        if self.resource_spawning not in ["free_cells", "rejection"]:
+            raise RuntimeError("Resource spawning is not set to free_cells or rejection")
+
+        # Where the random numbers of each episode come from (see README.md). "legacy" (the default) draws all
+        # episodes from a single RandomState, so the same seed gives the same results as earlier versions. With
+        # "per_episode", every episode gets its own stream spawned from the seed, so episode k starts the same way
+        # whichever episodes ran before it and its initial state can be reused from the bank
+        self.rng_streams = parameter_dictionary['environment']['slope'].get('rng_streams', "legacy")
+        if self.rng_streams not in ["per_episode", "legacy"]:
+            raise RuntimeError("RNG streams is not set to per_episode or legacy")
+
+        # Which patterns find_loop() looks for. "idle" detects teams whose state stops changing from one step to the
+        # next, "loop" detects teams that come back to any earlier state of the episode and "off" (the default) doesn't
+        # look. Incremental rewards depend on the history of the resources, so they can't be used with detection
+        self.idle_detection = parameter_dictionary['environment']['slope'].get('idle_detection', "off")
+        if self.idle_detection not in ["off", "idle", "loop"]:
+            raise RuntimeError("Idle detection is not set to off, idle or loop")
+
+        if self.incremental_rewards and self.idle_detection != "off":
+            raise RuntimeError("Idle detection can't be used with incremental rewards")
+
         # Rendering constants
         self.scale = 50  # Scale for rendering
         self.nest_colour = [0.25, 0.25, 0.25]
@@ -86,37 +175,55 @@ class SlopeEnv:
         self.agent_colour = [0, 0, 0.25]
         self.resource_colour = [0, 0.25, 0]
 
-        # Rendering variables
+        # Rendering variables (created by render())
         self.viewer = None
         self.agent_transforms = None
         self.resource_transforms = None
 
-        try:
-            self.agent_transforms = [rendering.Transform() for i in range(self.num_agents)]
-            self.resource_transforms = [rendering.Transform() for i in range(self.default_num_resources)]
+        # Arena state. Positions are stored as an (num_agents, 2) array of x,y coordinates and the maps are integer
+        # occupancy grids indexed by [y, x] holding agent index + 1 and resource id + 1 respectively (0 if empty).
+        # The maps are views into grids padded by the sensor range so that observations never go out of bounds
+        self.agent_positions = np.zeros((self.num_agents, 2), dtype=np.int64)
+        self.padded_agent_map = self.generate_padded_arena()
+        self.padded_resource_map = self.generate_padded_arena()
+        self.agent_map = self.get_arena_view(self.padded_agent_map)
+        self.resource_map = self.get_arena_view(self.padded_resource_map)
+        self.closest_y_for_resource = {}
 
-        except:
-            pass
+        # Resource index. Alongside resources_in_arena and the spatial index, it keeps the resource map, the resources
+        # that can slide and the resources at the source up to date as resources move, so the cost of a step depends on
+        # the number of agents and of resources that move rather than on the size of the arena or the number of
+        # resources in it. Occupancy of the source tiles is indexed by [y - source_start, x], with the number of free
+        # tiles in each row so that free tiles can be found a row at a time
+        self.source_occupied = np.zeros((self.source_size, self.arena_constraints["x_max"]), dtype=bool)
+        self.free_source_tiles_in_row = np.zeros(self.source_size, dtype=np.int64)
+        self.clear_resource_index()
 
-        self.agent_positions = [None] * self.num_agents
-        self.resources_in_arena = {}
-        self.resource_carried_by = [[False for i in range(self.num_agents)] for j in range(self.max_resources)]
-        self.closest_y_for_resource = {}
-        self.resource_history = [{"dropped_on_slope": False, # True/False (False unless the resource was dropped on the slope once)
-                                  "dropper_index": -1, # index of agent that dropped the resource on the slope
-                                  "collected_from_cache": False, # True/False (The last time it was picked up, was it picked up on the cache?)
-                                  "collector_index": -1, # index of agent who last picked it up on the cache (if the resource is delivered, this will also be the agent that delivers it)
-                                  "retrieved": False # Was the resource retrieved
-                                  } for i in range(self.max_resources)]
+        # Resource positions and history, indexed by resource id. The arrays start with room for the initial resources
+        # and double in size whenever a spawned resource does not fit
+        self.allocate_resource_arrays(self.default_num_resources)
 
 
         # Step variables
         self.behaviour_map = [self.forward_step, self.backward_step, self.left_step, self.right_step]
         self.action_name = ["FORWARD", "BACKWARD", "LEFT", "RIGHT", "PICKUP", "DROP"]
+        self.area_names = ["NEST", "CACHE", "SLOPE", "SOURCE"]
         self.has_resource = [None] * self.num_agents
 
+        # Area code of every row of the arena, so the area of a position is a lookup of its y coordinate
+        self.area_of_row = np.zeros(self.arena_constraints["y_max"], dtype=np.int64)
+        self.area_of_row[self.cache_start:self.slope_start] = self.CACHE
+        self.area_of_row[self.slope_start:self.source_start] = self.SLOPE
+        self.area_of_row[self.source_start:] = self.SOURCE
+
         self.seed_value = parameter_dictionary['general']['seed']
         self.np_random = np.random.RandomState(self.seed_value)
+        self.next_episode = 0  # Episode whose random number stream the next reset() uses
+
+        # Initial state bank. With per-episode streams, the initial positions of an episode and the state of its random
+        # number generator after placing them depend only on (seed, episode), so they are drawn once, saved here under
+        # that key and copied into the arrays by later resets of the same episode
+        self.initial_state_bank = {}
 
         # Observation space (additional details explained in self.get_agent_observations())
 
@@ -126,6 +233,66 @@ class SlopeEnv:
         # 1 bit for each tile in range + 4 bits for location + 1 bit for object possession
         self.observation_space_size = self.tiles_in_sensing_range + 4 + 1
 
+        # Observation engine. Tiles in the padding are walls. Each tile of a sensing window is stored as an offset
+        # into the flattened padded grids relative to the window's centre, going row by row from the top left tile
+        padded_width = self.padded_agent_map.shape[1]
+        window_side = 2 * self.sensor_range + 1
+        window_dy = self.sensor_range - np.arange(self.tiles_in_sensing_range) // window_side
+        window_dx = np.arange(self.tiles_in_sensing_range) % window_side - self.sensor_range
+        self.window_offsets = window_dy * padded_width + window_dx
+        self.window_centre = self.tiles_in_sensing_range // 2
+        self.padded_walls = generate_padded_walls(self.arena_constraints["y_max"], self.arena_constraints["x_max"],
+                                                  self.sensor_range)
+        self.observation_buffer = np.zeros((self.num_agents, self.observation_space_size), dtype=np.int64)
+
+        # Step buffers. Every array used while stepping is created here and overwritten in place, so step_in_place()
+        # doesn't allocate any arrays. The flat grids are views of the padded grids, which are never reallocated
+        self.flat_walls = self.padded_walls.ravel()
+        self.flat_agent_map = self.padded_agent_map.ravel()
+        self.flat_resource_map = self.padded_resource_map.ravel()
+        self.centre_offset = self.sensor_range * padded_width + self.sensor_range
+        self.area_bits_of_row = np.eye(4, dtype=np.int64)[self.area_of_row]
+        self.old_agent_positions = np.zeros_like(self.agent_positions)
+        self.reward_buffer = np.zeros(self.num_agents)
+        window_shape = (self.num_agents, self.tiles_in_sensing_range)
+        self.window_offset_buffer = np.tile(self.window_offsets, (self.num_agents, 1))
+        self.tile_index_buffer = np.zeros(self.num_agents, dtype=np.int64)
+        self.centre_buffer = np.zeros(self.num_agents, dtype=np.int64)
+        self.window_buffer = np.zeros(window_shape, dtype=np.int64)
+        self.tile_buffer = np.zeros(window_shape, dtype=self.padded_agent_map.dtype)
+        self.carried_buffer = np.zeros(window_shape, dtype=self.padded_resource_map.dtype)
+        self.object_buffer = np.zeros(window_shape, dtype=bool)
+        self.mask_buffer = np.zeros(window_shape, dtype=bool)
+        self.resource_mask_buffer = np.zeros(window_shape, dtype=bool)
+        self.area_bits_buffer = np.zeros((self.num_agents, 4), dtype=np.int64)
+
+        # Collision and pickup buffers. Agents are resolved by the tiles they move from and to, and resources dropped
+        # or delivered by each agent are kept by agent index
+        self.new_tile_buffer = np.zeros(self.num_agents, dtype=np.int64)
+        self.blocked_buffer = np.zeros(self.num_agents, dtype=bool)
+
+        # Memoryviews of the buffers that are read and written one element at a time. Indexing them gives Python
+        # scalars, which is much faster than creating NumPy scalars
+        self.new_tile_view = memoryview(self.new_tile_buffer)
+        self.tile_index_view = memoryview(self.tile_index_buffer)
+        self.blocked_view = memoryview(self.blocked_buffer)
+        self.flat_agent_map_view = memoryview(self.flat_agent_map)
+
+        self.dropped_resource_buffer = np.full(self.num_agents, -1, dtype=np.int64)
+        self.delivered_resource_buffer = np.full(self.num_agents, -1, dtype=np.int64)
+        self.pickup_candidate_buffer = np.zeros(self.num_agents * self.tiles_in_sensing_range, dtype=np.int64)
+
+        # Numba backend state. The kernels keep the resource arrays and the resource held by each agent (-1 if none) up
+        # to date, while resources_in_arena, the spatial index and the source occupancy are only rebuilt by
+        # sync_resource_index() when they are needed
+        self.held_resources = np.full(self.num_agents, -1, dtype=np.int64)
+        self.resource_index_stale = False
+
+        # Profiling counters (see enable_profiling()). Maps each phase of a step to its total nanoseconds and number of
+        # calls. When profiling is off, stepping only checks the flag
+        self.profiling = False
+        self.profile = {}
+
         # Action space
         # 0- Forward, 1- Backward, 2- Left, 3- Right, 4- Pick up, 5- Drop
         self.action_space_size = 6
@@ -140,95 +307,387 @@ class SlopeEnv:
         a boolean indicating if the simulation is done, any additional information
         """
 
-        # Returns an error if the number of actions is incorrect
-        assert len(agent_actions) == self.num_agents, "Incorrect number of actions"
+        observations, rewards = self.step_in_place(agent_actions)
 
-        # Returns an error if any action is invalid
-        for action in agent_actions:
-            assert action in range(self.action_space_size), "%r (%s) invalid" % (action, type(action))
+        return observations.copy(), rewards.tolist()
 
-        old_agent_positions = copy.deepcopy(self.agent_positions)
+    def step_in_place(self, agent_actions, observations=None, rewards=None):
+        """
+        Updates the environment according to agents' actions without allocating any arrays. The observations and
+        rewards are written into the given arrays or, if none are given, into buffers owned by the environment that are
+        overwritten by the next step. Collisions and pickups are resolved in preallocated buffers rather than Python
+        containers, so once warmed up, a step keeps no memory unless it spawns a resource. It still creates temporary
+        objects: NumPy scalars and views, and the tuple and tile list the spatial index stores when a resource moves
+
+        :param agent_actions: Array-like of integers representing the action each agent is taking
+        :param observations: Integer array with shape (num_agents, observation_size) to write the observations into
+        :param rewards: Float array with shape (num_agents,) to write the rewards into
+        :return: The observations and rewards arrays
+        """
+        if observations is None:
+            observations = self.observation_buffer
 
-        rewards = self.act_and_reward(agent_actions)
+        if rewards is None:
+            rewards = self.reward_buffer
+
+        # Returns an error if the number of actions is incorrect or any action is invalid
+        agent_actions = np.asarray(agent_actions)
+        assert agent_actions.shape == (self.num_agents,), "Incorrect number of actions"
+        assert np.issubdtype(agent_actions.dtype, np.integer) and \
+            0 <= agent_actions.min() and agent_actions.max() < self.action_space_size, "Invalid action"
+
+        if self.backend == "numba":
+            return self.step_kernels(agent_actions, observations, rewards)
+
+        old_agent_positions = self.old_agent_positions
+        np.copyto(old_agent_positions, self.agent_positions)
+
+        if self.profiling:
+            return self.step_phases_profiled(agent_actions, old_agent_positions, observations, rewards)
+
+        self.act_and_reward(agent_actions, rewards)
         self.wipe_old_positions(old_agent_positions)
         self.update_agent_positions(old_agent_positions)
-        rewards = self.update_resource_positions(agent_actions, old_agent_positions, rewards)
+        self.update_resource_positions(agent_actions, old_agent_positions, rewards)
         self.replenish_resources()
-        observations = self.get_agent_observations()
+        self.write_agent_observations(observations)
 
         return observations, rewards
 
-    def reset(self):
+    def step_phases_profiled(self, agent_actions, old_agent_positions, observations, rewards):
         """
+        The phases of step_in_place(), each timed and added to the profile
+        :return: The observations and rewards arrays
         """
+        start = time.perf_counter_ns()
+        self.act_and_reward(agent_actions, rewards)
+        start = self.add_to_profile("act_and_reward", start)
+        self.wipe_old_positions(old_agent_positions)
+        start = self.add_to_profile("wipe_old_positions", start)
+        self.update_agent_positions(old_agent_positions)
+        start = self.add_to_profile("update_agent_positions", start)
+        self.update_resource_positions(agent_actions, old_agent_positions, rewards)
+        start = self.add_to_profile("update_resource_positions", start)
+        self.replenish_resources()
+        start = self.add_to_profile("replenish_resources", start)
+        self.write_agent_observations(observations)
+        self.add_to_profile("get_agent_observations", start)
+
+        return observations, rewards
+
+    def step_kernels(self, agent_actions, observations, rewards):
+        """
+        Updates the environment with the compiled kernels of the numba backend. Same dynamics as step_in_place()
+
+        :param agent_actions: Integer array with the action each agent is taking
+        :param observations: Integer array with shape (num_agents, observation_size) to write the observations into
+        :param rewards: Float array with shape (num_agents,) to write the rewards into
+        :return: The observations and rewards arrays
+        """
+        if self.profiling:
+            start = time.perf_counter_ns()
+
+        num_deleted, resource_deficit = slope_kernels.step_dynamics(
+            agent_actions, self.agent_positions, self.old_agent_positions, self.held_resources, rewards,
+            self.agent_map, self.resource_map, self.resource_positions, self.resource_alive, self.resource_carried_by,
+            self.dropped_on_slope, self.dropper_index, self.collected_from_cache, self.collector_index,
+            self.retrieved, self.area_of_row, self.latest_resource_id + 1, self.sensor_range, self.sliding_speed,
+            self.cache_start, self.source_start, float(self.base_cost), float(self.carry_factor),
+            float(self.upward_cost_factor), float(self.downward_cost_factor), float(self.reward_for_resource),
+            self.default_num_resources)
+
+        self.current_num_resources -= num_deleted
+        self.resource_index_stale = True
+
+        if self.profiling:
+            start = self.add_to_profile("step_dynamics", start)
+
+        # New resources are spawned with the environment's random number generator, exactly as in the python backend
+        if resource_deficit > 0:
+            self.sync_resource_index()
+
+            for i in range(resource_deficit):
+                self.spawn_resource()
+
+        if self.profiling:
+            start = self.add_to_profile("replenish_resources", start)
+
+        slope_kernels.write_observations(self.agent_positions, self.held_resources, self.padded_agent_map,
+                                         self.padded_resource_map, self.padded_walls, self.resource_positions,
+                                         self.resource_alive, self.latest_resource_id + 1, self.area_of_row,
+                                         self.sensor_range, observations)
+
+        self.has_resource = [None if resource_id == -1 else resource_id for resource_id in self.held_resources.tolist()]
+
+        if self.profiling:
+            self.add_to_profile("get_agent_observations", start)
+
+        return observations, rewards
+
+    def reset(self, episode=None):
+        """
+        Places agents and resources for a new episode
+        :param episode: Index of the episode. With per-episode random number streams, the episode is set up and run
+        with the stream of this index, which makes it independent of any other episode. Defaults to the episode after
+        the one last reset (0 after reset_rng()). Has no effect in legacy mode
+        :return: The agents' observations
+        """
+        if episode is None:
+            episode = self.next_episode
+
+        self.next_episode = episode + 1
+        initial_state = None
+
+        if self.rng_streams == "per_episode":
+            initial_state = self.initial_state_bank.get((self.seed_value, episode))
+
+            if initial_state is None:
+                self.np_random = self.get_episode_rng(self.seed_value, episode)
 
         # Make sure agents and resources will all fit in the environment
         assert self.num_agents <= self.arena_constraints["x_max"] * self.nest_size, "Not enough room in the nest for all agents"
         assert self.default_num_resources <= self.arena_constraints["x_max"] * self.source_size, "Not enough room in the source for all resources"
 
-        try:
-            self.viewer.close()
-        except:
-            pass
-
-        self.viewer = None
-        self.resources_in_arena = {}
-        self.resource_carried_by = [[False for i in range(self.num_agents)] for j in range(self.max_resources)]
+        self.close()
+        self.clear_resource_index()
         self.closest_y_for_resource = {}
-        self.resource_history = [
-            {"dropped_on_slope": False,
-             "dropper_index": -1,
-             "collected_from_cache": False,
-             "collector_index": -1,
-             "retrieved": False
-             } for i in range(self.max_resources)]
-
-        try:
-            self.resource_transforms = [rendering.Transform() for i in range(self.default_num_resources)]
-        except:
-            pass
-
+        self.clear_resource_arrays()
         self.latest_resource_id = self.default_num_resources - 1
 
-        # Creates empty state
-        self.agent_map = self.generate_arena()  # Empty agent map
-        self.resource_map = self.generate_arena()  # Empty resource map
+        # Empties the state, reusing the existing arrays
+        self.agent_map.fill(0)
+        self.resource_map.fill(0)
 
-        # Places all agents
-        for i in range(self.num_agents):
-            agent_placed = False
-            while not agent_placed:
-                x, y = self.generate_agent_position()
-                if self.agent_map[y][x] == 0:
-                    self.agent_map[y][x] = i + 1
-                    self.agent_positions[i] = (x, y)
-                    agent_placed = True
+        if initial_state is not None:
+            self.load_initial_state(initial_state)
 
-        # Places all resources
-        for i in range(self.default_num_resources):
-            resource_placed = False
-            while not resource_placed:
-                x, y = self.generate_resource_position()
-                if self.resource_map[y][x] == 0:
-                    self.resource_map[y][x] = i + 1
-                    self.resources_in_arena[i] = (x, y)
-                    self.closest_y_for_resource[i] = y
-                    resource_placed = True
+        else:
+            # Places all agents
+            for i in range(self.num_agents):
+                agent_placed = False
+                while not agent_placed:
+                    x, y = self.generate_agent_position()
+                    if self.agent_map[y, x] == 0:
+                        self.agent_map[y, x] = i + 1
+                        self.agent_positions[i] = (x, y)
+                        agent_placed = True
+
+            # Places all resources
+            for i in range(self.default_num_resources):
+                resource_placed = False
+                while not resource_placed:
+                    if self.resource_spawning == "free_cells":
+                        x, y = self.generate_free_resource_position()
+                    else:
+                        x, y = self.generate_resource_position()
+
+                    if self.resource_map[y, x] == 0:
+                        self.resource_map[y, x] = i + 1
+                        self.set_resource_position(i, (x, y))
+                        self.closest_y_for_resource[i] = y
+                        resource_placed = True
+
+            if self.rng_streams == "per_episode":
+                self.initial_state_bank[(self.seed_value, episode)] = \
+                    (self.agent_positions.copy(), [self.resources_in_arena[i] for i in range(self.default_num_resources)],
+                     self.np_random.get_state())
 
         # Reset variables that were changed during runtime
         self.has_resource = [None] * self.num_agents
+        self.held_resources.fill(-1)
+        self.resource_index_stale = False
         self.current_num_resources = self.default_num_resources
+        self.visited_states = {}  # States seen by find_loop() and the step after which they were seen
+        self.visited_states_num_resources = self.default_num_resources
+        self.num_checked_steps = 0
+
+        return self.get_agent_observations()
+
+    def load_initial_state(self, initial_state):
+        """
+        Place agents and resources from an entry of the initial state bank (see reset()) and put the random number
+        generator in the state it was in after they were first placed. Expects empty maps and resource indices
+        :param initial_state: Agent positions, resource positions and random number generator state
+        :return:
+        """
+        agent_positions, resource_positions, rng_state = initial_state
+        np.copyto(self.agent_positions, agent_positions)
+
+        for i, (x, y) in enumerate(agent_positions.tolist()):
+            self.agent_map[y, x] = i + 1
+
+        for i, (x, y) in enumerate(resource_positions):
+            self.resource_map[y, x] = i + 1
+            self.set_resource_position(i, (x, y))
+            self.closest_y_for_resource[i] = y
+
+        self.np_random.set_state(rng_state)
+
+    def find_loop(self, agent_memory=b""):
+        """
+        Check whether the team is stuck in a loop, looking for the patterns set by idle_detection. Meant to be called
+        after every step. If the state of the arena and of the agents' memories is the same as after an earlier step,
+        deterministic agents will repeat the steps since then, with the same rewards, until the end of the episode. No
+        resources are spawned or delivered in such a loop, since either would change the state for good, so the team
+        can't earn any further reward
+
+        @param agent_memory: Bytes holding everything (besides their observations) the agents' next actions depend on
+        @return: Number of steps in the loop, or None if the team isn't known to be in one
+        """
+        if self.idle_detection == "off":
+            return None
+
+        num_resources = self.latest_resource_id + 1
+        state = (self.agent_positions.tobytes(), tuple(self.has_resource),
+                 self.resource_positions[:num_resources].tobytes(), self.resource_alive[:num_resources].tobytes(),
+                 agent_memory)
+        step = self.num_checked_steps
+        self.num_checked_steps += 1
+
+        # States from before a resource was spawned can't come back, so they are forgotten
+        if num_resources != self.visited_states_num_resources:
+            self.visited_states = {}
+            self.visited_states_num_resources = num_resources
+
+        # In idle mode, only the state after the previous step is kept
+        if self.idle_detection == "idle":
+            is_idle = self.visited_states.get(state) == step - 1
+            self.visited_states = {state: step}
+            return 1 if is_idle else None
+
+        loop_start = self.visited_states.get(state)
+        self.visited_states[state] = step
+
+        if loop_start is None:
+            return None
+
+        return step - loop_start
+
+    def get_state(self):
+        """
+        Snapshot of everything that changes while an episode runs, including the random number generator, so that
+        set_state() can later restore it in this environment or in another one created from the same parameter file.
+
+        The snapshot is a flat int64 array. With n = latest_resource_id + 1 and A = num_agents, its layout is:
+
+        [0:6]       n, current_num_resources, next episode, RandomState pos, has_gauss and cached_gaussian (float64
+                    bits)
+        [6:630]     RandomState key
+        then        agent positions (A x 2), resource held by each agent (A, -1 if none),
+                    resource positions (n x 2), resource_alive (n), resource_carried_by (n x A), dropped_on_slope (n),
+                    dropper_index (n), collected_from_cache (n), collector_index (n), retrieved (n) and the closest y
+                    reached by each resource (n, -1 if the resource isn't in the arena)
+
+        The maps and the resource indices are rebuilt from it by set_state()
+
+        @return: 1D integer array
+        """
+        if self.resource_index_stale:
+            self.sync_resource_index()
+
+        num_resources = self.latest_resource_id + 1
+        _, key, pos, has_gauss, cached_gaussian = self.np_random.get_state()
+        held_resources = [-1 if resource_id is None else resource_id for resource_id in self.has_resource]
+        closest_y = [self.closest_y_for_resource.get(resource_id, -1) if self.resource_alive[resource_id] else -1
+                     for resource_id in range(num_resources)]
+
+        return np.concatenate([
+            [num_resources, self.current_num_resources, self.next_episode, pos, has_gauss],
+            np.array([cached_gaussian], dtype=np.float64).view(np.int64),
+            key,
+            self.agent_positions.ravel(),
+            held_resources,
+            self.resource_positions[:num_resources].ravel(),
+            self.resource_alive[:num_resources],
+            self.resource_carried_by[:num_resources].ravel(),
+            self.dropped_on_slope[:num_resources],
+            self.dropper_index[:num_resources],
+            self.collected_from_cache[:num_resources],
+            self.collector_index[:num_resources],
+            self.retrieved[:num_resources],
+            closest_y]).astype(np.int64)
+
+    def set_state(self, state):
+        """
+        Restore a snapshot made by get_state(). The environment continues exactly as the one the snapshot was taken from
+
+        @param state: 1D integer array returned by get_state()
+        @return: The agents' observations in the restored state
+        """
+        state = np.asarray(state, dtype=np.int64)
+        num_resources = int(state[0])
+        num_agents = self.num_agents
+        expected_size = 630 + 3 * num_agents + num_resources * (9 + num_agents)
+
+        if state.ndim != 1 or len(state) != expected_size:
+            raise ValueError("State does not match the parameters of this environment")
+
+        self.current_num_resources = int(state[1])
+        self.next_episode = int(state[2])
+        self.np_random.set_state(("MT19937", state[6:630].astype(np.uint32), int(state[3]), int(state[4]),
+                                  float(state[5:6].view(np.float64)[0])))
+
+        # Split the rest of the state into its sections
+        sections = []
+        start = 630
+        for size in [2 * num_agents, num_agents, 2 * num_resources, num_resources, num_resources * num_agents,
+                     num_resources, num_resources, num_resources, num_resources, num_resources, num_resources]:
+            sections += [state[start:start + size]]
+            start += size
+
+        agent_positions, held_resources, resource_positions, resource_alive, resource_carried_by, dropped_on_slope, \
+            dropper_index, collected_from_cache, collector_index, retrieved, closest_y = sections
+
+        self.agent_positions[:] = agent_positions.reshape(num_agents, 2)
+        self.held_resources[:] = held_resources
+        self.has_resource = [None if resource_id == -1 else resource_id for resource_id in held_resources.tolist()]
+
+        while self.resource_capacity < num_resources:
+            self.grow_resource_arrays()
+
+        self.clear_resource_arrays()
+        self.resource_positions[:num_resources] = resource_positions.reshape(num_resources, 2)
+        self.resource_alive[:num_resources] = resource_alive
+        self.resource_carried_by[:num_resources] = resource_carried_by.reshape(num_resources, num_agents)
+        self.dropped_on_slope[:num_resources] = dropped_on_slope
+        self.dropper_index[:num_resources] = dropper_index
+        self.collected_from_cache[:num_resources] = collected_from_cache
+        self.collector_index[:num_resources] = collector_index
+        self.retrieved[:num_resources] = retrieved
+        self.latest_resource_id = num_resources - 1
+
+        # Rebuild the resource indices and the maps
+        self.resource_map.fill(0)
+        self.sync_resource_index()
+        self.closest_y_for_resource = {resource_id: int(closest_y[resource_id])
+                                       for resource_id in self.resources_in_arena}
+
+        self.agent_map.fill(0)
+        for i in range(num_agents):
+            self.agent_map[self.agent_positions[i, 1], self.agent_positions[i, 0]] = i + 1
+
+        # Loops are looked for from the restored state onwards
+        self.visited_states = {}
+        self.visited_states_num_resources = num_resources
+        self.num_checked_steps = 0
+
+        # The viewer is rebuilt on the next call to render()
+        self.close()
 
         return self.get_agent_observations()
 
     # Step helpers ----------------------------------------------------------------------------------------------------
-    def act_and_reward(self, agent_actions):
+    def act_and_reward(self, agent_actions, rewards=None):
         """
         Agents act and receive rewards depending on where they are and what they do
         @param agent_actions: Action being taken by each agent
-        @return: A list of float-value rewards, one for each agent
+        @param rewards: Float array to write the rewards into. A new list is created if None
+        @return: The float-value rewards, one for each agent
         """
-        rewards = [0.0] * len(agent_actions)
+        if rewards is None:
+            rewards = [0.0] * len(agent_actions)
+        else:
+            rewards.fill(0.0)
 
         for i in range(len(agent_actions)):
             cost_multiplier = 1
@@ -241,12 +700,12 @@ class SlopeEnv:
                 self.behaviour_map[agent_actions[i]](i)
 
                 # More costly for agent to move up the slope than down
-                if self.get_area_from_position(self.agent_positions[i]) == "SLOPE":
-                    if self.action_name[agent_actions[i]] == "FORWARD":
+                if self.area_of_row[self.agent_positions[i, 1]] == self.SLOPE:
+                    if agent_actions[i] == self.FORWARD:
                         rewards[i] -= self.base_cost*cost_multiplier + \
                                       (self.base_cost * cost_multiplier * self.upward_cost_factor * self.sliding_speed)
 
-                    elif self.action_name[agent_actions[i]] == "BACKWARD":
+                    elif agent_actions[i] == self.BACKWARD:
                         rewards[i] -= self.base_cost*cost_multiplier - \
                                       (self.base_cost * cost_multiplier * self.downward_cost_factor * self.sliding_speed)
 
@@ -265,86 +724,171 @@ class SlopeEnv:
 
     def wipe_old_positions(self, old_agent_positions):
         """
-        Set positions of agents and resources to 0 in the maps
+        Set positions of agents to 0 in the agent map. The resource map is kept up to date by the resource index
         @return:
         """
         # The agents' old positions are wiped out
-        for position in old_agent_positions:
-            self.agent_map[position[1]][position[0]] = 0
-
-        # The resources' old positions are wiped out
-        for index,position in self.resources_in_arena.items():
-            self.resource_map[position[1]][position[0]] = 0
+        self.write_tile_indices(old_agent_positions, self.tile_index_buffer)
+        np.put(self.flat_agent_map, self.tile_index_buffer, 0, mode='clip')
 
     def update_agent_positions(self, old_agent_positions):
         """
-        Update the positions of agents
+        Update the positions of agents. If several agents move to the same tile, only the one with the largest index
+        gets there and the others keep their old positions. If an agent stays still (or walks into a wall), any agent
+        moving onto its tile keeps its old position.
+
+        Collisions are found by having every agent claim the tile it is moving to in the agent map, which the old
+        positions have been wiped from, so the cost is linear in the number of agents
         @param old_agent_positions: Positions of agents at previous time step
         @return:
         """
-        agent_collision_positions = copy.deepcopy(self.agent_positions)
+        self.write_tile_indices(self.agent_positions, self.new_tile_buffer)
+        self.write_tile_indices(old_agent_positions, self.tile_index_buffer)
+        new_tiles = self.new_tile_view
+        old_tiles = self.tile_index_view
+        blocked = self.blocked_view
+        flat_agent_map = self.flat_agent_map_view
+
+        # Claims are made in order of index, so the agent with the largest index keeps each tile. An agent that stays
+        # still then blocks its tile with a claim that matches no agent
+        for i in range(self.num_agents):
+            flat_agent_map[new_tiles[i]] = i + 1
 
-        # The agents' new positions are updated
-        for i in range(len(self.agent_positions)):
-            for j in range(len(self.agent_positions)):
-                # If agent i is colliding with agent j's new position, it keeps its old position if it has a smaller index
-                if (self.agent_positions[i] == self.agent_positions[j]) and (i < j or (i >= j and self.agent_positions[j] == old_agent_positions[j])):
-                    agent_collision_positions[i] = old_agent_positions[i]
+        for i in range(self.num_agents):
+            if new_tiles[i] == old_tiles[i]:
+                flat_agent_map[new_tiles[i]] = -1
 
-            self.agent_map[agent_collision_positions[i][1]][agent_collision_positions[i][0]] = i + 1
+        for i in range(self.num_agents):
+            blocked[i] = flat_agent_map[new_tiles[i]] != i + 1
+
+        for i in range(self.num_agents):
+            flat_agent_map[new_tiles[i]] = 0
 
-        self.agent_positions = agent_collision_positions
+        # The agents' new positions are updated. Agents whose claim didn't win keep their old positions
+        for i in range(self.num_agents):
+            if blocked[i]:
+                self.agent_positions[i] = old_agent_positions[i]
+                new_tiles[i] = old_tiles[i]
+
+            flat_agent_map[new_tiles[i]] = i + 1
+
+    def write_tile_indices(self, positions, tiles):
+        """
+        Write the index of each position's tile in the flattened padded grids into an array
+        @param positions: Integer array of x,y positions with shape (num_agents, 2)
+        @param tiles: Integer array with shape (num_agents,)
+        @return:
+        """
+        np.multiply(positions[:, 1], self.padded_agent_map.shape[1], out=tiles)
+        tiles += positions[:, 0]
+        tiles += self.centre_offset
 
     def update_resource_positions(self, agent_actions, old_agent_positions, rewards):
         """
-        Resources get moved, dropped, picked up, slided and deleted (if at the nest)
+        Resources get moved, dropped, picked up, slided and deleted (if at the nest).
+
+        Resources are handled in order of id and agents in order of index, so a resource goes to the first agent that
+        can pick it up and an agent picks up the resource with the smallest id among those it can pick up. A resource
+        dropped this step can only be picked up by an agent with a larger index than the one that dropped it. Agents
+        only look for resources in their sensing window, using the spatial index of resources. Pickups are resolved in
+        the step buffers and the per-resource scratch arrays, which are left cleared for the next step
         @param agent_actions: Action being performed by each agent
         @param old_agent_positions: Positions of all agents prior to acting
         @param rewards: List of rewards for each agent
         @return: Updated list of rewards for each agent
         """
-        resources_to_delete = {}
+        dropped_resources = self.dropped_resource_buffer
+        delivered_resources = self.delivered_resource_buffer
+        dropped_resources.fill(-1)
+        delivered_resources.fill(-1)
 
-        for resource_id, resource_position in self.resources_in_arena.items():
-            for j in range(len(old_agent_positions)):
-                # Move resources with the agents carrying them or drop them
-                if resource_position == old_agent_positions[j]:
-                    if self.has_resource[j] == resource_id:
-                        if self.action_name[agent_actions[j]] == "DROP":
-                            self.drop_resource(j)
+        # Move resources with the agents carrying them or drop them
+        for j in range(self.num_agents):
+            resource_id = self.has_resource[j]
 
-                            # If agent/resource is on slope, update resource history
-                            if self.get_area_from_position(resource_position) == "SLOPE":
-                                self.resource_history[resource_id]["dropped_on_slope"] = True
-                                self.resource_history[resource_id]["dropper_index"] = j
+            if resource_id is None or not self.resource_alive[resource_id] or \
+                    self.resource_positions[resource_id, 0] != old_agent_positions[j, 0] or \
+                    self.resource_positions[resource_id, 1] != old_agent_positions[j, 1]:
+                continue
 
-                            # If an agent has returned a resource to the nest, the resource is deleted and all agents
-                            # are rewarded
-                            if self.get_area_from_position(resource_position) == "NEST":
-                                resources_to_delete[resource_id] = resource_id
+            resource_area = self.area_of_row[old_agent_positions[j, 1]]
 
-                        else:
-                            self.pickup_or_hold_resource(j, resource_id)
+            if agent_actions[j] == self.DROP:
+                self.drop_resource(j)
+                dropped_resources[j] = resource_id
+                self.first_eligible_agent[resource_id] = j + 1
 
-                # Ensure that a resource that is in range of an agent now gets picked up if the agent is
-                # doing a pickup action and no other agent is carrying the resource
-                if self.resource_in_range(j, resource_id):
-                    #TODO: Add "and resource_id not in resources_to_delete"
-                    if self.has_resource[j] is None and resource_id not in self.has_resource:
-                        if self.action_name[agent_actions[j]] == "PICKUP":
-                            # If resource is on the cache, update resource history
-                            if self.get_area_from_position(resource_position) == "CACHE":
-                                self.resource_history[resource_id]["collected_from_cache"] = True
-                                self.resource_history[resource_id]["collector_index"] = j
+                # If agent/resource is on slope, update resource history
+                if resource_area == self.SLOPE:
+                    self.dropped_on_slope[resource_id] = True
+                    self.dropper_index[resource_id] = j
+
+                # If an agent has returned a resource to the nest, the resource is deleted and all agents
+                # are rewarded
+                if resource_area == self.NEST:
+                    delivered_resources[j] = resource_id
+
+            else:
+                self.pickup_or_hold_resource(j, resource_id)
+
+        # Ensure that a resource that is in range of an agent now gets picked up if the agent is
+        # doing a pickup action and no other agent is carrying the resource
+        for resource_id in self.has_resource:
+            if resource_id is not None:
+                self.resource_held[resource_id] = True
+
+        num_candidates = 0
+
+        for j in range(self.num_agents):
+            if self.has_resource[j] is None and agent_actions[j] == self.PICKUP:
+                num_candidates = self.write_pickup_candidates(j, num_candidates)
+
+        # Each candidate is stored as resource_id * num_agents + j, so sorting them orders them by resource and then
+        # by agent
+        pickup_candidates = self.pickup_candidate_buffer
+        pickup_candidates[:num_candidates].sort()
+
+        for k in range(num_candidates):
+            resource_id, j = divmod(int(pickup_candidates[k]), self.num_agents)
+
+            if self.resource_held[resource_id] or self.has_resource[j] is not None:
+                continue
+
+            # If resource is on the cache, update resource history
+            if self.area_of_row[self.resource_positions[resource_id, 1]] == self.CACHE:
+                self.collected_from_cache[resource_id] = True
+                self.collector_index[resource_id] = j
+
+            self.pickup_or_hold_resource(j, resource_id)
+            self.resource_held[resource_id] = True
+
+        # If a resource is on the slope and not in the possession of a agent, it slides. Sliding changes the set of
+        # resources on the slope, so their ids are copied out of it first
+        sliding_resources = self.resource_id_buffer
+        num_sliding = 0
+
+        for resource_id in self.resources_on_slope:
+            if not self.resource_held[resource_id]:
+                sliding_resources[num_sliding] = resource_id
+                num_sliding += 1
+
+        sliding_resources[:num_sliding].sort()
+
+        for k in range(num_sliding):
+            self.slide_resource(int(sliding_resources[k]))
 
-                            self.pickup_or_hold_resource(j, resource_id)
+        # Every resource marked as held is held by an agent now
+        for resource_id in self.has_resource:
+            if resource_id is not None:
+                self.resource_held[resource_id] = False
 
-            # If a resource is on the slope and not in the possession of a agent, it slides
-            if self.get_area_from_position(resource_position) == "SLOPE" and resource_id not in self.has_resource:
-                self.slide_resource(resource_id)
+        for j in range(self.num_agents):
+            if dropped_resources[j] != -1:
+                self.first_eligible_agent[dropped_resources[j]] = 0
 
-            if self.incremental_rewards:
-                distance_travelled_by_resource = self.closest_y_for_resource[resource_id] - self.resource_positions[resource_id][1]
+        if self.incremental_rewards:
+            for resource_id in self.resources_in_arena:
+                distance_travelled_by_resource = self.closest_y_for_resource[resource_id] - self.resources_in_arena[resource_id][1]
 
                 if distance_travelled_by_resource > 0:
                     reward_for_travel = (self.reward_for_resource / self.arena_constraints["y_max"]) * distance_travelled_by_resource
@@ -352,9 +896,16 @@ class SlopeEnv:
                     for j in range(self.num_agents):
                         rewards[j] += reward_for_travel / self.num_agents
 
-                    self.closest_y_for_resource[resource_id] = self.resource_positions[resource_id][1]
+                    self.closest_y_for_resource[resource_id] = self.resources_in_arena[resource_id][1]
+
+        delivered_resources.sort()
+
+        for j in range(self.num_agents):
+            resource_id = int(delivered_resources[j])
+
+            if resource_id == -1:
+                continue
 
-        for resource_id in resources_to_delete:
             for k in range(self.num_agents):
                 if self.incremental_rewards:
                     reward_for_retrieval = self.reward_for_resource / self.arena_constraints["y_max"]
@@ -363,7 +914,7 @@ class SlopeEnv:
                     rewards[k] += self.reward_for_resource / self.num_agents
 
             self.delete_resource(resource_id)
-            self.resource_history[resource_id]["retrieved"] = True
+            self.retrieved[resource_id] = True
 
         return rewards
 
@@ -372,38 +923,38 @@ class SlopeEnv:
         Spawn new resources at the source if some have been moved
         @return:
         """
-        num_resources_at_source = 0
-
         # Spawn a new resource any time the number of resources at the source decreases below the default threshold
-        for resource_id, resource_position in self.resources_in_arena.items():
-            try:
-                if self.get_area_from_position(resource_position) == "SOURCE":
-                    num_resources_at_source += 1
-            except ValueError:
-                pass
-
-            # If there are more resources at the source than the default, there's no need to continue counting
-            if num_resources_at_source >= self.default_num_resources:
-                break
-
-        resource_deficit = self.default_num_resources - num_resources_at_source
+        resource_deficit = self.default_num_resources - min(self.num_resources_at_source, self.default_num_resources)
 
         if resource_deficit > 0:
             for i in range(resource_deficit):
                 self.spawn_resource()
 
-        # Update the state with the new resource positions
-        for resource_id, resource_position in self.resources_in_arena.items():
-            self.resource_map[resource_position[1]][resource_position[0]] = resource_id + 1
-
     # Initialisers ----------------------------------------------------------------------------------------------------
     def generate_arena(self):
         """
         Generates 2D matrix representing an empty arena i.e. each tile contains a 0
-        :return:
+        :return: Integer array indexed by [y, x]
+        """
+
+        return np.zeros((self.arena_constraints["y_max"], self.arena_constraints["x_max"]), dtype=np.int32)
+
+    def generate_padded_arena(self):
+        """
+        Generates an empty arena surrounded by a border as wide as the sensor range
+        :return: Integer array indexed by [y + sensor_range, x + sensor_range]
         """
+        return np.zeros((self.arena_constraints["y_max"] + 2 * self.sensor_range,
+                         self.arena_constraints["x_max"] + 2 * self.sensor_range), dtype=np.int32)
 
-        return [[0 for i in range(self.arena_constraints["x_max"])] for j in range(self.arena_constraints["y_max"])]
+    def get_arena_view(self, padded_arena):
+        """
+        Returns the part of a padded arena that lies inside the arena, without copying it
+        :param padded_arena: Array created by generate_padded_arena()
+        :return: View of padded_arena indexed by [y, x]
+        """
+        return padded_arena[self.sensor_range:self.sensor_range + self.arena_constraints["y_max"],
+                            self.sensor_range:self.sensor_range + self.arena_constraints["x_max"]]
 
     def generate_agent_position(self):
         """
@@ -423,6 +974,21 @@ class SlopeEnv:
         y = self.np_random.randint(low=self.source_start, high=self.arena_constraints["y_max"])
         return x, y
 
+    def generate_free_resource_position(self):
+        """
+        Picks one of the source tiles that have no resource on them, each with equal probability. Assumes the source is
+        not full
+        :return: x and y coordinates of the resource
+        """
+        tile = self.np_random.randint(self.num_free_source_tiles)
+
+        # Free tiles are counted in row-major order, so find the row holding the tile and then the tile in the row
+        free_tiles_up_to_row = np.cumsum(self.free_source_tiles_in_row)
+        row = int(np.searchsorted(free_tiles_up_to_row, tile, side='right'))
+        tile -= int(free_tiles_up_to_row[row] - self.free_source_tiles_in_row[row])
+        x = int(np.flatnonzero(~self.source_occupied[row])[tile])
+        return x, self.source_start + row
+
     def get_agent_observations(self):
         """
         Generate a list containing each agent's observation. Each agent observes:
@@ -438,85 +1004,57 @@ class SlopeEnv:
 
         3. Whether or not the agent is carrying a resource (encoded as a single bit)
 
-        :return:
+        :return: Integer array with one row per agent
         """
-        observations = []
-        readable_observations = []
-
-        for j in range(len(self.agent_positions)):
-            position = self.agent_positions[j]
-            observation = [0] * self.observation_space_size
-            readable_observation = []
-
-            # If a tile in the agent's sensing range is:
-            # An agent, wall or object-            observation[k] = 1, otherwise 0
-            current_x = position[0] - self.sensor_range
-            current_y = position[1] + self.sensor_range
-            row_progress = 0
-
-            resource_in_range = False
-
-            for k in range(self.tiles_in_sensing_range):
-                # If coordinate is out of bounds then it is a wall
-                if self.arena_constraints["x_max"] <= current_x or current_x < 0 or self.arena_constraints[
-                    "y_max"] <= current_y or current_y < 0:
-                    observation[k] = 1  # Wall
-                    readable_observation += ["Object (wall)"]
-                # If coordinate contains a agent and the agent is not this agent
-                elif self.agent_map[current_y][current_x] != 0 and (
-                        current_x != position[0] or current_y != position[1]):
-                    observation[k] = 1  # Another agent
-                    readable_observation += ["Object (agent)"]
-                # If coordinate is a resource
-                elif self.resource_map[current_y][current_x] != 0 and self.has_resource[j] != \
-                        self.resource_map[current_y][current_x] - 1:
-                    observation[k] = 1  # A resource
-                    readable_observation += ["Object (resource)"]
-                    resource_in_range = True
-                else:
-                    observation[k] = 0  # Blank space
-                    readable_observation += ["Blank"]
-
-                row_progress += 1
+        self.write_agent_observations(self.observation_buffer)
 
-                if row_progress >= self.sensor_range * 2 + 1:
-                    row_progress = 0
-                    current_x = position[0] - self.sensor_range
-                    current_y -= 1
-                else:
-                    current_x += 1
-
-            area = self.get_area_from_position(position)
-            obs_index = self.tiles_in_sensing_range
-
-            # If the area the agent is located in is
-            # The nest-     observation[9] = 1, otherwise 0
-            # The cache-    observation[10] = 1, otherwise 0
-            # The slope-    observation[11] = 1, otherwise 0
-            # The source-   observation[12] = 1, otherwise 0
-            if area == "NEST":
-                observation[obs_index] = 1
-            elif area == "CACHE":
-                observation[obs_index + 1] = 1
-            elif area == "SLOPE":
-                observation[obs_index + 2] = 1
-            elif area == "SOURCE":
-                observation[obs_index + 3] = 1
-
-            readable_observation += [area]
-
-            # If the agent
-            # Has a resource-   observation[13] = 1, otherwise 0
-            if self.has_resource[j] is not None:
-                observation[obs_index + 4] = 1
-                readable_observation += ["Has"]
-            else:
-                readable_observation += ["Doesn't have"]
+        return self.observation_buffer.copy()
 
-            observations += [np.array(observation)]
-            readable_observations += [readable_observation]
+    def write_agent_observations(self, observations):
+        """
+        Write each agent's observation (see get_agent_observations()) into an array, using only the step buffers. The
+        sensing windows of all agents are read from the padded maps with a single gather
 
-        return observations
+        :param observations: Integer array with shape (num_agents, observation_size)
+        :return:
+        """
+        # Index of every tile of every agent's sensing window in the flattened padded grids. Arrays of the same shape
+        # are used throughout because broadcasting makes NumPy allocate temporary arrays
+        centres = self.centre_buffer
+        np.multiply(self.agent_positions[:, 1], self.padded_agent_map.shape[1], out=centres)
+        centres += self.agent_positions[:, 0]
+        centres += self.centre_offset
+        windows = self.window_buffer
+        np.copyto(windows, centres[:, np.newaxis])
+        windows += self.window_offset_buffer
+
+        # Id + 1 of the resource each agent is carrying (0 if none), to match the resource map
+        carried_resources = self.carried_buffer
+        for j in range(self.num_agents):
+            carried_resources[j] = 0 if self.has_resource[j] is None else self.has_resource[j] + 1
+
+        # A tile is an object if it is a wall, contains another agent or contains a resource the agent isn't carrying
+        objects = self.object_buffer
+        mask = self.mask_buffer
+        tiles = self.tile_buffer
+        np.take(self.flat_walls, windows, out=objects, mode='clip')
+        np.take(self.flat_agent_map, windows, out=tiles, mode='clip')
+        np.not_equal(tiles, 0, out=mask)
+        objects |= mask
+        objects[:, self.window_centre] = False
+        np.take(self.flat_resource_map, windows, out=tiles, mode='clip')
+        np.not_equal(tiles, 0, out=mask)
+        np.not_equal(tiles, carried_resources, out=self.resource_mask_buffer)
+        mask &= self.resource_mask_buffer
+        objects |= mask
+        observations[:, :self.tiles_in_sensing_range] = objects
+
+        # Where the agent is (Nest, Cache, Slope or Source), read from a table of the area bits of each row
+        np.take(self.area_bits_of_row, self.agent_positions[:, 1], axis=0, out=self.area_bits_buffer, mode='clip')
+        observations[:, self.tiles_in_sensing_range:self.tiles_in_sensing_range + 4] = self.area_bits_buffer
+
+        # Whether the agent has a resource
+        np.not_equal(carried_resources[:, 0], 0, out=observations[:, self.tiles_in_sensing_range + 4])
 
     # Simple getters --------------------------------------------------------------------------------------------------
     def get_num_agents(self):
@@ -553,29 +1091,17 @@ class SlopeEnv:
         if x < self.arena_constraints["x_min"] or x > self.arena_constraints["x_max"]:
             raise ValueError("x position is not valid")
 
-        if self.nest_start <= y < self.cache_start:
-            return "NEST"
-        elif self.cache_start <= y < self.slope_start:
-            return "CACHE"
-        elif self.slope_start <= y < self.source_start:
-            return "SLOPE"
-        elif self.source_start <= y < self.arena_constraints["y_max"]:
-            return "SOURCE"
-        else:
+        if not self.arena_constraints["y_min"] <= y < self.arena_constraints["y_max"]:
             raise ValueError("y position is not valid")
 
+        return self.area_names[self.area_of_row[y]]
+
     def source_is_full(self):
         """
         Determines if the source area has a resource at every grid position and is thus "full"
         :return: True if full, False otherwise
         """
-        for y in range(int(self.source_size)):
-            for x in range(self.arena_constraints["x_max"]):
-                if self.resource_map[int(self.source_start) + y][x] == 0 and \
-                        (x, int(self.source_start) + y) not in self.resources_in_arena.values():
-                    return False
-
-        return True
+        return self.num_free_source_tiles == 0
 
     def resource_in_range(self, agent_index, resource_index):
         """
@@ -584,17 +1110,209 @@ class SlopeEnv:
         @param resource_index: Index of a resource in the resource position list
         @return: Boolean denoting whether the resource is in range of the agent
         """
-        agent_pos = self.agent_positions[agent_index]
+        agent_x, agent_y = self.agent_positions[agent_index].tolist()
         res_pos = self.resources_in_arena[resource_index]
 
-        if agent_pos[0] - self.sensor_range <= res_pos[0] <= agent_pos[0] + self.sensor_range and\
-            agent_pos[1] - self.sensor_range <= res_pos[1] <= agent_pos[1] + self.sensor_range:
+        if agent_x - self.sensor_range <= res_pos[0] <= agent_x + self.sensor_range and\
+            agent_y - self.sensor_range <= res_pos[1] <= agent_y + self.sensor_range:
             return True
         else:
             return False
 
+    def get_resources_in_range(self, agent_index):
+        """
+        Get the ids of all resources in the sensing range of the given agent, using the spatial index of resources
+        @param agent_index: Index of an agent in the agent position list
+        @return: List of resource ids
+        """
+        agent_x, agent_y = self.agent_positions[agent_index].tolist()
+        resource_ids = []
+
+        for y in range(max(agent_y - self.sensor_range, self.arena_constraints["y_min"]),
+                       min(agent_y + self.sensor_range, self.arena_constraints["y_max"] - 1) + 1):
+            for x in range(max(agent_x - self.sensor_range, self.arena_constraints["x_min"]),
+                           min(agent_x + self.sensor_range, self.arena_constraints["x_max"] - 1) + 1):
+                resources_at_tile = self.resources_at_tile.get((x, y))
+
+                if resources_at_tile:
+                    resource_ids += resources_at_tile
+
+        return resource_ids
+
+    def write_pickup_candidates(self, agent_index, num_candidates):
+        """
+        Add the resources in the sensing range of an agent that it is allowed to pick up (see
+        update_resource_positions()) to the pickup candidates, growing the buffer if it is full
+        @param agent_index: Index of an agent in the agent position list
+        @param num_candidates: Number of candidates already in the buffer
+        @return: Number of candidates in the buffer
+        """
+        agent_x = int(self.agent_positions[agent_index, 0])
+        agent_y = int(self.agent_positions[agent_index, 1])
+
+        for y in range(max(agent_y - self.sensor_range, self.arena_constraints["y_min"]),
+                       min(agent_y + self.sensor_range, self.arena_constraints["y_max"] - 1) + 1):
+            for x in range(max(agent_x - self.sensor_range, self.arena_constraints["x_min"]),
+                           min(agent_x + self.sensor_range, self.arena_constraints["x_max"] - 1) + 1):
+                resources_at_tile = self.resources_at_tile.get((x, y))
+
+                if not resources_at_tile:
+                    continue
+
+                for resource_id in resources_at_tile:
+                    #TODO: Add "and resource_id not in resources_to_delete"
+                    if self.resource_held[resource_id] or self.first_eligible_agent[resource_id] > agent_index:
+                        continue
+
+                    if num_candidates == len(self.pickup_candidate_buffer):
+                        old_buffer = self.pickup_candidate_buffer
+                        self.pickup_candidate_buffer = np.zeros(2 * len(old_buffer), dtype=np.int64)
+                        self.pickup_candidate_buffer[:num_candidates] = old_buffer
+
+                    self.pickup_candidate_buffer[num_candidates] = resource_id * self.num_agents + agent_index
+                    num_candidates += 1
+
+        return num_candidates
+
+    def set_resource_position(self, resource_id, position):
+        """
+        Place a resource at a position, adding it to the arena if it is new and keeping the spatial index up to date
+        @param resource_id: Id of the resource
+        @param position: x,y tuple
+        @return:
+        """
+        old_position = self.resources_in_arena.get(resource_id)
+
+        if old_position == position:
+            return
+
+        if old_position is not None:
+            self.remove_resource_from_tile(resource_id, old_position)
+
+        self.resources_in_arena[resource_id] = position
+        self.resource_positions[resource_id] = position
+        self.resource_alive[resource_id] = True
+        x, y = position
+
+        if position in self.resources_at_tile:
+            self.resources_at_tile[position].append(resource_id)
+        else:
+            self.resources_at_tile[position] = [resource_id]
+
+            if y >= self.source_start:
+                self.source_occupied[y - self.source_start, x] = True
+                self.free_source_tiles_in_row[y - self.source_start] -= 1
+                self.num_free_source_tiles -= 1
+
+        # A tile with several resources shows the largest id in the resource map
+        self.resource_map[y, x] = max(self.resource_map[y, x], resource_id + 1)
+
+        if self.area_of_row[y] == self.SLOPE:
+            self.resources_on_slope.add(resource_id)
+        elif y >= self.source_start:
+            self.num_resources_at_source += 1
+
+    def remove_resource_from_tile(self, resource_id, position):
+        """
+        Remove a resource from the spatial index
+        @param resource_id: Id of the resource
+        @param position: x,y tuple where the resource is indexed
+        @return:
+        """
+        resources_at_tile = self.resources_at_tile[position]
+        resources_at_tile.remove(resource_id)
+        x, y = position
+
+        if resources_at_tile:
+            self.resource_map[y, x] = max(resources_at_tile) + 1
+        else:
+            del self.resources_at_tile[position]
+            self.resource_map[y, x] = 0
+
+            if y >= self.source_start:
+                self.source_occupied[y - self.source_start, x] = False
+                self.free_source_tiles_in_row[y - self.source_start] += 1
+                self.num_free_source_tiles += 1
+
+        if self.area_of_row[y] == self.SLOPE:
+            self.resources_on_slope.discard(resource_id)
+        elif y >= self.source_start:
+            self.num_resources_at_source -= 1
+
+    def clear_resource_index(self):
+        """
+        Empty the resource index (see __init__()). Doesn't clear the resource map
+        @return:
+        """
+        self.resources_in_arena = {}
+        self.resources_at_tile = {}
+        self.resources_on_slope = set()
+        self.num_resources_at_source = 0
+        self.source_occupied.fill(False)
+        self.free_source_tiles_in_row.fill(self.arena_constraints["x_max"])
+        self.num_free_source_tiles = self.source_occupied.size
+
+    def sync_resource_index(self):
+        """
+        Rebuild the resource index from the resource arrays. Only needed with the numba backend, whose kernels keep just
+        the arrays and the resource map up to date
+        @return:
+        """
+        self.clear_resource_index()
+
+        for resource_id in np.flatnonzero(self.resource_alive[:self.latest_resource_id + 1]).tolist():
+            self.set_resource_position(resource_id, tuple(self.resource_positions[resource_id].tolist()))
+
+        self.resource_index_stale = False
+
+    def enable_profiling(self, enabled=True):
+        """
+        Turn the profiling of steps on or off. While it is on, the time taken by each phase of a step is added to the
+        profile. The python backend's phases are the methods called by step_in_place(). The numba backend's are
+        step_dynamics (the compiled kernel, up to and including the movement of resources), replenish_resources and
+        get_agent_observations
+        @param enabled: Boolean indicating whether steps are profiled
+        @return:
+        """
+        self.profiling = enabled
+
+    def get_profile(self):
+        """
+        @return: Dictionary mapping each profiled phase to a dictionary with its total nanoseconds ("ns") and number of
+        calls ("calls")
+        """
+        return {phase: {"ns": ns, "calls": calls} for phase, (ns, calls) in self.profile.items()}
+
+    def reset_profile(self):
+        self.profile = {}
+
+    def add_to_profile(self, phase, start):
+        """
+        Add the time since start to a phase of the profile
+        @param phase: Name of the phase
+        @param start: Time the phase started, from time.perf_counter_ns()
+        @return: The current time, so the next phase can start from it
+        """
+        end = time.perf_counter_ns()
+        counters = self.profile.setdefault(phase, [0, 0])
+        counters[0] += end - start
+        counters[1] += 1
+        return end
+
     def reset_rng(self):
         self.np_random = np.random.RandomState(self.seed_value)
+        self.next_episode = 0
+
+    @staticmethod
+    def get_episode_rng(seed, episode):
+        """
+        Random number generator of one episode. Its stream is the episode-th child of a SeedSequence made from the
+        seed, so streams of different episodes are independent
+        :param seed: Seed of the environment
+        :param episode: Index of the episode
+        :return: RandomState for the episode
+        """
+        return np.random.RandomState(np.random.MT19937(np.random.SeedSequence(seed, spawn_key=(episode,))))
 
     # Actions ---------------------------------------------------------------------------------------------------------
     def forward_step(self, agent_id):
@@ -603,10 +1321,8 @@ class SlopeEnv:
         :param agent_id: Index of the agent in self.agent_positions
         :return:
         """
-        self.agent_positions[agent_id] = (
-            self.agent_positions[agent_id][0],
-            np.clip(self.agent_positions[agent_id][1] + 1, self.arena_constraints["y_min"],
-                    self.arena_constraints["y_max"] - 1))
+        self.agent_positions[agent_id, 1] = min(self.agent_positions[agent_id, 1] + 1,
+                                                self.arena_constraints["y_max"] - 1)
 
     def backward_step(self, agent_id):
         """
@@ -614,10 +1330,8 @@ class SlopeEnv:
         :param agent_id: Index of the agent in self.agent_positions
         :return:
         """
-        self.agent_positions[agent_id] = (
-            self.agent_positions[agent_id][0],
-            np.clip(self.agent_positions[agent_id][1] - 1, self.arena_constraints["y_min"],
-                    self.arena_constraints["y_max"] - 1))
+        self.agent_positions[agent_id, 1] = max(self.agent_positions[agent_id, 1] - 1,
+                                                self.arena_constraints["y_min"])
 
     def left_step(self, agent_id):
         """
@@ -625,10 +1339,8 @@ class SlopeEnv:
         :param agent_id: Index of the agent in self.agent_positions
         :return:
         """
-        self.agent_positions[agent_id] = (
-            np.clip(self.agent_positions[agent_id][0] - 1, self.arena_constraints["x_min"],
-                    self.arena_constraints["x_max"] - 1),
-            self.agent_positions[agent_id][1])
+        self.agent_positions[agent_id, 0] = max(self.agent_positions[agent_id, 0] - 1,
+                                                self.arena_constraints["x_min"])
 
     def right_step(self, agent_id):
         """
@@ -636,10 +1348,8 @@ class SlopeEnv:
         :param agent_id: Index of the agent in self.agent_positions
         :return:
         """
-        self.agent_positions[agent_id] = (
-            np.clip(self.agent_positions[agent_id][0] + 1, self.arena_constraints["x_min"],
-                    self.arena_constraints["x_max"] - 1),
-            self.agent_positions[agent_id][1])
+        self.agent_positions[agent_id, 0] = min(self.agent_positions[agent_id, 0] + 1,
+                                                self.arena_constraints["x_max"] - 1)
 
     def pickup_or_hold_resource(self, agent_id, resource_id):
         """
@@ -649,7 +1359,8 @@ class SlopeEnv:
         :param resource_id: Index of the resource in self.resources_in_arena
         :return:
         """
-        self.resources_in_arena[resource_id] = self.agent_positions[agent_id]
+        self.set_resource_position(resource_id, (int(self.agent_positions[agent_id, 0]),
+                                                 int(self.agent_positions[agent_id, 1])))
         self.has_resource[agent_id] = resource_id
 
     def drop_resource(self, agent_id):
@@ -660,8 +1371,7 @@ class SlopeEnv:
         """
         resource_id = self.has_resource[agent_id]
 
-        if not self.resource_carried_by[resource_id][agent_id]:
-            self.resource_carried_by[resource_id][agent_id] = True
+        self.resource_carried_by[resource_id, agent_id] = True
 
         self.has_resource[agent_id] = None
 
@@ -677,7 +1387,7 @@ class SlopeEnv:
         new_y = max(self.resources_in_arena[resource_id][1] - self.sliding_speed,
                     self.cache_start)
 
-        self.resources_in_arena[resource_id] = (new_x, new_y)
+        self.set_resource_position(resource_id, (new_x, new_y))
 
     def spawn_resource(self):
         """
@@ -692,22 +1402,21 @@ class SlopeEnv:
             return None
 
         while not resource_placed:
-            x, y = self.generate_resource_position()
-            if self.resource_map[y][x] == 0 and (x, y) not in self.resources_in_arena.values():
-                self.resource_map[y][x] = self.latest_resource_id + 1
+            if self.resource_spawning == "free_cells":
+                x, y = self.generate_free_resource_position()
+            else:
+                x, y = self.generate_resource_position()
+
+            if self.resource_map[y, x] == 0 and (x, y) not in self.resources_at_tile:
+                if self.latest_resource_id + 1 >= self.resource_capacity:
+                    self.grow_resource_arrays()
+
+                self.resource_map[y, x] = self.latest_resource_id + 1
                 self.latest_resource_id += 1
-                self.resources_in_arena[self.latest_resource_id] = (x, y)
+                self.set_resource_position(self.latest_resource_id, (x, y))
                 self.closest_y_for_resource[self.latest_resource_id] = y
-                try:
-                    self.resource_transforms += [rendering.Transform()]
-                except:
-                    pass
                 resource_placed = True
                 self.current_num_resources += 1
-                try:
-                    self.add_resource_to_rendering(self.latest_resource_id)
-                except:
-                    pass
                 return x, y
 
     def delete_resource(self, resource_id):
@@ -716,10 +1425,78 @@ class SlopeEnv:
         :param resource_id:
         :return:
         """
+        self.remove_resource_from_tile(resource_id, self.resources_in_arena[resource_id])
         del self.resources_in_arena[resource_id]
         del self.closest_y_for_resource[resource_id]
+        self.resource_alive[resource_id] = False
         self.current_num_resources -= 1
 
+    def allocate_resource_arrays(self, capacity):
+        """
+        Create empty resource arrays able to hold resource ids up to capacity-1
+
+        resource_positions: x,y position of the resource
+        resource_alive: True if the resource is in the arena
+        resource_carried_by: Whether each agent has carried the resource
+        dropped_on_slope: True if the resource was dropped on the slope at least once
+        dropper_index: Index of the agent that last dropped the resource on the slope (-1 if none)
+        collected_from_cache: True if the resource was picked up from the cache at least once
+        collector_index: Index of the agent that last picked the resource up from the cache (-1 if none). If the
+        resource is delivered, this is also the agent that delivered it
+        retrieved: True if the resource was delivered to the nest
+
+        The scratch arrays used by update_resource_positions() are also indexed by resource id and are cleared at the
+        end of every step:
+
+        resource_held: True if an agent is holding the resource
+        first_eligible_agent: Smallest index of an agent that may pick up the resource (non-zero if it was just dropped)
+        resource_id_buffer: Ids of the resources that slide
+
+        :param capacity: Number of resource ids the arrays can hold
+        :return:
+        """
+        self.resource_capacity = capacity
+        self.resource_held = np.zeros(capacity, dtype=bool)
+        self.first_eligible_agent = np.zeros(capacity, dtype=np.int64)
+        self.resource_id_buffer = np.zeros(capacity, dtype=np.int64)
+        self.resource_positions = np.zeros((capacity, 2), dtype=np.int64)
+        self.resource_alive = np.zeros(capacity, dtype=bool)
+        self.resource_carried_by = np.zeros((capacity, self.num_agents), dtype=bool)
+        self.dropped_on_slope = np.zeros(capacity, dtype=bool)
+        self.dropper_index = np.full(capacity, -1, dtype=np.int64)
+        self.collected_from_cache = np.zeros(capacity, dtype=bool)
+        self.collector_index = np.full(capacity, -1, dtype=np.int64)
+        self.retrieved = np.zeros(capacity, dtype=bool)
+
+    def grow_resource_arrays(self):
+        """
+        Double the number of resource ids the resource arrays can hold, keeping their contents
+        :return:
+        """
+        old_capacity = self.resource_capacity
+        old_arrays = [self.resource_positions, self.resource_alive, self.resource_carried_by, self.dropped_on_slope,
+                      self.dropper_index, self.collected_from_cache, self.collector_index, self.retrieved]
+        self.allocate_resource_arrays(2 * old_capacity)
+        new_arrays = [self.resource_positions, self.resource_alive, self.resource_carried_by, self.dropped_on_slope,
+                      self.dropper_index, self.collected_from_cache, self.collector_index, self.retrieved]
+
+        for old_array, new_array in zip(old_arrays, new_arrays):
+            new_array[:old_capacity] = old_array
+
+    def clear_resource_arrays(self):
+        """
+        Clear the resources of the previous episode, keeping the arrays so they are not reallocated
+        :return:
+        """
+        self.resource_positions.fill(0)
+        self.resource_alive.fill(False)
+        self.resource_carried_by.fill(False)
+        self.dropped_on_slope.fill(False)
+        self.dropper_index.fill(-1)
+        self.collected_from_cache.fill(False)
+        self.collector_index.fill(-1)
+        self.retrieved.fill(False)
+
     # Specialisation Metrics ------------------------------------------------------------------------------------------
     def calculate_ferrante_specialisation(self):
         """
@@ -727,37 +1504,35 @@ class SlopeEnv:
         Of all the retrieved resources, what proportion were carried by multiple agents
         :return: Float denoting degree of specialisation
         """
-        n_coop = 0 # Resources retrieved with cooperation (i.e. picked up by at least 2 agents before being delivered to the nest)
-        r_coop = 0
+        # Only resources that have been spawned this episode have a history
+        num_resources = self.latest_resource_id + 1
+        retrieved = self.retrieved[:num_resources]
+        num_carriers = self.resource_carried_by[:num_resources].sum(axis=1)
 
-        n_coop_eff = 0 # Resources retrieved with efficient cooperation (i.e. the resource was dropped on the slope, picked up from the cache and the agents that dropped and picked up were different)
-        r_coop_eff = 0
+        # Resources retrieved with cooperation (i.e. picked up by at least 2 agents before being delivered to the nest)
+        n_coop = int(np.count_nonzero(retrieved & (num_carriers > 1)))
 
-        r_spec = 0
-        participation = 0
-        total_resources_retrieved = 0
-        agent_participated = [False for i in range(self.num_agents)]
-
-        for i in range(self.latest_resource_id+1):
-            if self.resource_history[i]["retrieved"]:
-                total_resources_retrieved += 1
+        # Resources retrieved with efficient cooperation (i.e. the resource was dropped on the slope, picked up from
+        # the cache and the agents that dropped and picked up were different)
+        n_coop_eff = int(np.count_nonzero(retrieved & self.dropped_on_slope[:num_resources] &
+                                          self.collected_from_cache[:num_resources] &
+                                          (self.dropper_index[:num_resources] != self.collector_index[:num_resources])))
 
-                if sum(self.resource_carried_by[i]) > 1:
-                    n_coop += 1
+        total_resources_retrieved = int(np.count_nonzero(retrieved))
 
-                # Mark all agents that participated in the retrieval of any resource
-                for agent_index in range(sum(self.resource_carried_by[i])):
-                    agent_participated[agent_index] = True
-
-                if self.resource_history[i]["dropped_on_slope"] and self.resource_history[i]["collected_from_cache"] and \
-                    (self.resource_history[i]["dropper_index"] != self.resource_history[i]["collector_index"]):
-                    n_coop_eff += 1
+        r_coop = 0
+        r_coop_eff = 0
+        r_spec = 0
+        participation = 0
 
         if total_resources_retrieved != 0:
+            # As many agents are marked as having participated as there were carriers of the most carried resource
+            agents_participated = int(num_carriers[retrieved].max())
+
             r_coop = n_coop / total_resources_retrieved
             r_coop_eff = n_coop_eff / total_resources_retrieved
             r_spec = (r_coop + r_coop_eff) / 2
-            participation = sum(agent_participated) / self.num_agents
+            participation = agents_participated / self.num_agents
 
         return [r_coop, r_coop_eff, r_spec, r_coop * participation, r_coop_eff * participation, r_spec * participation]
 
@@ -826,16 +1601,25 @@ class SlopeEnv:
 
     def render(self, mode='human'):
         """
-        Renders the environment, placing all agents and resources in appropriate positions
+        Renders the environment, placing all agents and resources in appropriate positions. The rendering module is
+        imported the first time this is called
         :param mode:
         :return:
         """
+        if self.headless:
+            raise RuntimeError("Cannot render a headless environment")
 
         screen_width = self.arena_constraints["x_max"] * self.scale
         screen_height = self.arena_constraints["y_max"] * self.scale
 
+        if self.resource_index_stale:
+            self.sync_resource_index()
+
         if self.viewer is None:
+            import_rendering()
             self.viewer = rendering.Viewer(screen_width, screen_height)
+            self.agent_transforms = [rendering.Transform() for i in range(self.num_agents)]
+            self.resource_transforms = []
 
             # Draw nest
             nest = self.draw_arena_segment(self.nest_size, self.nest_start, self.nest_colour)
@@ -873,17 +1657,10 @@ class SlopeEnv:
                 agent.add_attr(self.agent_transforms[i])
                 self.viewer.add_geom(agent)
 
-            # Draw resource(s)
-            for i in range(self.default_num_resources):
-                resource = rendering.make_circle(self.resource_width / 2 * self.scale)
-                resource.set_color(self.resource_colour[0], self.resource_colour[1], self.resource_colour[2])
-                resource.add_attr(
-                    rendering.Transform(
-                        translation=(
-                            0,
-                            0)))
-                resource.add_attr(self.resource_transforms[i])
-                self.viewer.add_geom(resource)
+        # Draw resource(s) that haven't been drawn yet, including any spawned since the last render
+        while len(self.resource_transforms) <= self.latest_resource_id:
+            self.resource_transforms += [rendering.Transform()]
+            self.add_resource_to_rendering(len(self.resource_transforms) - 1)
 
         # Set position of agent(s)
         for i in range(self.num_agents):
@@ -915,3 +1692,559 @@ class SlopeEnv:
         if self.viewer:
             self.viewer.close()
             self.viewer = None
+
+
+class BatchedSlopeEnv:
+    """
+    Steps several independent arenas of the slope environment at once. The state of every arena is held in NumPy
+    arrays whose first axis is the arena index, so a single call to step() advances all of them.
+
+    Each arena has its own RandomState and makes exactly the same random draws as a SlopeEnv with the same seed, so
+    arena n behaves bit-for-bit like a SlopeEnv seeded with seeds[n] that receives the same actions.
+    """
+
+    # Area codes used to index the area bits of an observation
+    NEST = 0
+    CACHE = 1
+    SLOPE = 2
+    SOURCE = 3
+
+    # Action codes
+    PICKUP = 4
+    DROP = 5
+
+    def __init__(self, parameter_filename=None, num_arenas=1, seeds=None):
+        """
+        Initialises constants for the arenas and a random number generator for each one
+
+        @param parameter_filename: Name of the file containing the experiment parameters
+        @param num_arenas: Number of arenas to simulate in parallel
+        @param seeds: List containing a seed for each arena. Uses the seed in the parameter file for all arenas if None
+        """
+        if parameter_filename is None:
+            raise RuntimeError("No parameter file specified for the environment")
+
+        parameter_dictionary = json.loads(open(parameter_filename).read())
+        slope_parameters = parameter_dictionary['environment']['slope']
+
+        # Environment dimensions
+        self.num_arenas = num_arenas
+        self.arena_width = slope_parameters['arena_width']
+        self.arena_length = slope_parameters['arena_length']
+        self.nest_start = 0
+        self.cache_start = slope_parameters['cache_start']
+        self.slope_start = slope_parameters['slope_start']
+        self.source_start = slope_parameters['source_start']
+        self.nest_size = self.cache_start
+        self.source_size = self.arena_length - self.source_start
+        self.sliding_speed = slope_parameters['sliding_speed']
+        self.sensor_range = slope_parameters['sensor_range']
+
+        # Costs and rewards
+        self.base_cost = slope_parameters['base_cost']
+        self.reward_for_resource = slope_parameters['resource_reward']
+        self.upward_cost_factor = slope_parameters['upward_cost_factor']
+        self.downward_cost_factor = slope_parameters['downward_cost_factor']
+        self.carry_factor = slope_parameters['carry_factor']
+
+        if slope_parameters['incremental_rewards'] == "True":
+            raise RuntimeError("Incremental rewards are not supported by the batched environment")
+        elif slope_parameters['incremental_rewards'] != "False":
+            raise RuntimeError("Incremental rewards is not set to True or False")
+
+        self.num_agents = slope_parameters['num_agents']
+        self.default_num_resources = slope_parameters['num_resources']
+
+        # How new resources are placed at the source. See SlopeEnv.__init__()
+        self.resource_spawning = slope_parameters.get('resource_spawning', "rejection")
+        if self.resource_spawning not in ["free_cells", "rejection"]:
+            raise RuntimeError("Resource spawning is not set to free_cells or rejection")
+
+        # Where the random numbers of each episode come from. See SlopeEnv.__init__()
+        self.rng_streams = slope_parameters.get('rng_streams', "legacy")
+        if self.rng_streams not in ["per_episode", "legacy"]:
+            raise RuntimeError("RNG streams is not set to per_episode or legacy")
+
+        # Area code of every row of the arena
+        self.area_of_row = np.zeros(self.arena_length, dtype=np.int64)
+        self.area_of_row[self.cache_start:self.slope_start] = self.CACHE
+        self.area_of_row[self.slope_start:self.source_start] = self.SLOPE
+        self.area_of_row[self.source_start:] = self.SOURCE
+
+        # Change in x and y caused by each action. Pickup and drop don't move the agent
+        self.action_dx = np.array([0, 0, -1, 1, 0, 0])
+        self.action_dy = np.array([1, -1, 0, 0, 0, 0])
+
+        # Observation and action spaces (same layout as SlopeEnv)
+        self.tiles_in_sensing_range = (2 * self.sensor_range + 1) ** 2
+        self.observation_space_size = self.tiles_in_sensing_range + 4 + 1
+        self.action_space_size = 6
+
+        # Offsets of each tile in the sensing window, going row by row from the top left tile to the bottom right tile
+        window_side = 2 * self.sensor_range + 1
+        self.window_dy = self.sensor_range - np.arange(self.tiles_in_sensing_range) // window_side
+        self.window_dx = np.arange(self.tiles_in_sensing_range) % window_side - self.sensor_range
+        self.window_centre = self.tiles_in_sensing_range // 2
+
+        # Tiles outside the arena are walls. The arena is padded by the sensor range so windows never go out of bounds
+        self.padded_walls = generate_padded_walls(self.arena_length, self.arena_width, self.sensor_range)
+
+        # Seeding values
+        self.seed_value = parameter_dictionary['general']['seed']
+
+        if seeds is None:
+            seeds = [self.seed_value] * self.num_arenas
+
+        assert len(seeds) == self.num_arenas, "Need exactly one seed per arena"
+        self.seeds = list(seeds)
+        self.np_randoms = [np.random.RandomState(seed) for seed in self.seeds]
+        self.next_episode = 0
+
+        # Initial state bank, shared by all arenas with the same seed. See SlopeEnv.__init__()
+        self.initial_state_bank = {}
+
+        # State variables (created in reset)
+        self.agent_positions = None
+        self.has_resource = None
+        self.resource_capacity = 0
+        self.latest_resource_id = None
+        self.current_num_resources = None
+
+    def step(self, agent_actions):
+        """
+        Updates every arena according to its agents' actions
+
+        @param agent_actions: Array-like of integers with shape (num_arenas, num_agents)
+        @return: Observations with shape (num_arenas, num_agents, observation_size) and rewards with shape
+        (num_arenas, num_agents)
+        """
+        agent_actions = np.asarray(agent_actions)
+
+        assert agent_actions.shape == (self.num_arenas, self.num_agents), "Incorrect number of actions"
+        assert ((0 <= agent_actions) & (agent_actions < self.action_space_size)).all(), "Invalid action"
+
+        old_agent_positions = self.agent_positions.copy()
+
+        rewards = self.act_and_reward(agent_actions)
+        self.update_agent_positions(old_agent_positions)
+        rewards = self.update_resource_positions(agent_actions, old_agent_positions, rewards)
+        self.replenish_resources()
+        observations = self.get_agent_observations()
+
+        return observations, rewards
+
+    def reset(self, episode=None):
+        """
+        Places agents and resources in every arena using each arena's random number generator
+
+        @param episode: Index of the episode, which selects the random number stream of every arena in the same way as
+        SlopeEnv.reset()
+        @return: Observations with shape (num_arenas, num_agents, observation_size)
+        """
+        if episode is None:
+            episode = self.next_episode
+
+        self.next_episode = episode + 1
+
+        assert self.num_agents <= self.arena_width * self.nest_size, "Not enough room in the nest for all agents"
+        assert self.default_num_resources <= self.arena_width * self.source_size, "Not enough room in the source for all resources"
+
+        self.agent_positions = np.zeros((self.num_arenas, self.num_agents, 2), dtype=np.int64)
+        self.has_resource = np.full((self.num_arenas, self.num_agents), -1, dtype=np.int64)
+        self.latest_resource_id = np.full(self.num_arenas, self.default_num_resources - 1, dtype=np.int64)
+        self.current_num_resources = np.full(self.num_arenas, self.default_num_resources, dtype=np.int64)
+        self.allocate_resource_arrays(max(2 * self.default_num_resources, 1))
+
+        for n in range(self.num_arenas):
+            bank_key = (self.seeds[n], episode)
+
+            if self.rng_streams == "per_episode":
+                if bank_key in self.initial_state_bank:
+                    agent_positions, resource_positions, rng_state = self.initial_state_bank[bank_key]
+                    self.agent_positions[n] = agent_positions
+                    self.resource_positions[n, :self.default_num_resources] = resource_positions
+                    self.resource_alive[n, :self.default_num_resources] = True
+                    self.np_randoms[n].set_state(rng_state)
+                    continue
+
+                self.np_randoms[n] = SlopeEnv.get_episode_rng(self.seeds[n], episode)
+
+            np_random = self.np_randoms[n]
+
+            # Places all agents
+            occupied = set()
+            for i in range(self.num_agents):
+                while True:
+                    x = np_random.randint(low=0, high=self.arena_width)
+                    y = np_random.randint(low=self.nest_start, high=self.nest_start + self.nest_size)
+                    if (x, y) not in occupied:
+                        break
+                occupied.add((x, y))
+                self.agent_positions[n, i] = (x, y)
+
+            # Places all resources
+            occupied = set()
+            source_occupied = np.zeros((self.source_size, self.arena_width), dtype=bool)
+            for i in range(self.default_num_resources):
+                while True:
+                    if self.resource_spawning == "free_cells":
+                        x, y = self.generate_free_resource_position(n, source_occupied)
+                    else:
+                        x = np_random.randint(low=0, high=self.arena_width)
+                        y = np_random.randint(low=self.source_start, high=self.arena_length)
+                    if (x, y) not in occupied:
+                        break
+                occupied.add((x, y))
+                source_occupied[y - self.source_start, x] = True
+                self.resource_positions[n, i] = (x, y)
+                self.resource_alive[n, i] = True
+
+            if self.rng_streams == "per_episode":
+                self.initial_state_bank[bank_key] = (self.agent_positions[n].copy(),
+                                                     self.resource_positions[n, :self.default_num_resources].copy(),
+                                                     np_random.get_state())
+
+        return self.get_agent_observations()
+
+    # Step helpers ----------------------------------------------------------------------------------------------------
+    def act_and_reward(self, agent_actions):
+        """
+        Agents in all arenas act and receive rewards depending on where they are and what they do
+
+        @param agent_actions: Array of actions with shape (num_arenas, num_agents)
+        @return: Array of float rewards with shape (num_arenas, num_agents)
+        """
+        new_x = np.clip(self.agent_positions[..., 0] + self.action_dx[agent_actions], 0, self.arena_width - 1)
+        new_y = np.clip(self.agent_positions[..., 1] + self.action_dy[agent_actions], 0, self.arena_length - 1)
+        self.agent_positions[..., 0] = new_x
+        self.agent_positions[..., 1] = new_y
+
+        # If agent is carrying something, multiply the cost of moving
+        cost_multiplier = np.where(self.has_resource != -1, self.carry_factor, 1)
+        movement_cost = self.base_cost * cost_multiplier
+
+        # More costly for agent to move up the slope than down. Same expressions as SlopeEnv so results are identical
+        on_slope = self.area_of_row[new_y] == self.SLOPE
+        upward_cost = movement_cost + (movement_cost * self.upward_cost_factor * self.sliding_speed)
+        downward_cost = movement_cost - (movement_cost * self.downward_cost_factor * self.sliding_speed)
+
+        cost = np.where(on_slope & (agent_actions == 0), upward_cost,
+                        np.where(on_slope & (agent_actions == 1), downward_cost, movement_cost))
+
+        # Negative reward for dropping/picking up but is not affected by resource weight
+        cost = np.where(agent_actions < 4, cost, self.base_cost)
+
+        return 0.0 - cost
+
+    def update_agent_positions(self, old_agent_positions):
+        """
+        Resolve collisions between agents. An agent keeps its old position if an agent with a larger index moves to
+        the same tile or if any agent that stayed still is on that tile
+
+        @param old_agent_positions: Positions of agents at previous time step
+        @return:
+        """
+        agent_indices = np.tile(np.arange(self.num_agents), self.num_arenas)
+        tiles = self.agent_positions[..., 1] * self.arena_width + self.agent_positions[..., 0]
+        tiles = (tiles + (np.arange(self.num_arenas) * self.arena_length * self.arena_width)[:, np.newaxis]).ravel()
+        _, groups = np.unique(tiles, return_inverse=True)
+        groups = groups.ravel()
+
+        largest_index = np.full(groups.max() + 1, -1)
+        np.maximum.at(largest_index, groups, agent_indices)
+
+        stationary = (self.agent_positions == old_agent_positions).all(axis=2).ravel()
+        has_stationary = np.bincount(groups, weights=stationary, minlength=len(largest_index)) > 0
+
+        collided = (agent_indices != largest_index[groups]) | has_stationary[groups]
+        collided = collided.reshape(self.num_arenas, self.num_agents)
+        self.agent_positions = np.where(collided[..., np.newaxis], old_agent_positions, self.agent_positions)
+
+    def update_resource_positions(self, agent_actions, old_agent_positions, rewards):
+        """
+        Resources get moved, dropped, picked up, slided and deleted (if at the nest). Pickups are resolved in the same
+        order as SlopeEnv: resources in order of id, each going to the first eligible agent
+
+        @param agent_actions: Array of actions with shape (num_arenas, num_agents)
+        @param old_agent_positions: Positions of all agents prior to acting
+        @param rewards: Array of rewards with shape (num_arenas, num_agents)
+        @return: Updated array of rewards
+        """
+        arenas = np.arange(self.num_arenas)[:, np.newaxis]
+        original_area = self.area_of_row[self.resource_positions[..., 1]]
+
+        # Index of the agent holding each resource, -1 if none
+        holder = np.full((self.num_arenas, self.resource_capacity), -1, dtype=np.int64)
+        carrier_arenas, carriers = np.nonzero(self.has_resource != -1)
+        holder[carrier_arenas, self.has_resource[carrier_arenas, carriers]] = carriers
+        held = self.resource_alive & (holder != -1)
+        safe_holder = np.maximum(holder, 0)
+
+        # Move resources with the agents carrying them or drop them
+        with_holder = held & (self.resource_positions == old_agent_positions[arenas, safe_holder]).all(axis=2)
+        dropped = with_holder & (agent_actions[arenas, safe_holder] == self.DROP)
+        carried = with_holder & ~dropped
+
+        drop_arenas, drop_resources = np.nonzero(dropped)
+        droppers = holder[drop_arenas, drop_resources]
+        self.has_resource[drop_arenas, droppers] = -1
+        self.resource_carried_by[drop_arenas, drop_resources, droppers] = True
+
+        # If agent/resource is on slope, update resource history
+        dropped_on_slope = dropped & (original_area == self.SLOPE)
+        self.dropped_on_slope |= dropped_on_slope
+        self.dropper_index = np.where(dropped_on_slope, holder, self.dropper_index)
+
+        # If an agent has returned a resource to the nest, the resource is deleted and all agents are rewarded
+        to_delete = dropped & (original_area == self.NEST)
+
+        carry_arenas, carry_resources = np.nonzero(carried)
+        self.resource_positions[carry_arenas, carry_resources] = \
+            self.agent_positions[carry_arenas, holder[carry_arenas, carry_resources]]
+
+        # A free resource can be picked up by any agent. A resource dropped this step can only be picked up by agents
+        # with a larger index than the one that dropped it
+        can_be_picked_up = (self.resource_alive & ~held) | dropped
+        first_eligible_agent = np.where(dropped, holder + 1, 0)
+        picking_up = (agent_actions == self.PICKUP) & (self.has_resource == -1)
+
+        distance = np.abs(self.resource_positions[:, :, np.newaxis, :] - self.agent_positions[:, np.newaxis, :, :])
+        in_range = (distance <= self.sensor_range).all(axis=3)
+        eligible = can_be_picked_up[:, :, np.newaxis] & picking_up[:, np.newaxis, :] & in_range & \
+            (np.arange(self.num_agents) >= first_eligible_agent[:, :, np.newaxis])
+
+        # Each round, the lowest id resource with an eligible agent goes to the eligible agent with the lowest index
+        while True:
+            has_eligible = eligible.any(axis=2)
+            active_arenas = np.nonzero(has_eligible.any(axis=1))[0]
+
+            if len(active_arenas) == 0:
+                break
+
+            resources = has_eligible[active_arenas].argmax(axis=1)
+            agents = eligible[active_arenas, resources].argmax(axis=1)
+
+            # If resource is on the cache, update resource history
+            from_cache = original_area[active_arenas, resources] == self.CACHE
+            self.collected_from_cache[active_arenas[from_cache], resources[from_cache]] = True
+            self.collector_index[active_arenas[from_cache], resources[from_cache]] = agents[from_cache]
+
+            self.resource_positions[active_arenas, resources] = self.agent_positions[active_arenas, agents]
+            self.has_resource[active_arenas, agents] = resources
+            eligible[active_arenas, resources, :] = False
+            eligible[active_arenas, :, agents] = False
+
+        # If a resource is on the slope and not in the possession of an agent, it slides
+        held = np.zeros((self.num_arenas, self.resource_capacity), dtype=bool)
+        carrier_arenas, carriers = np.nonzero(self.has_resource != -1)
+        held[carrier_arenas, self.has_resource[carrier_arenas, carriers]] = True
+        sliding = self.resource_alive & ~held & (original_area == self.SLOPE)
+        self.resource_positions[..., 1] = np.where(sliding,
+                                                   np.maximum(self.resource_positions[..., 1] - self.sliding_speed,
+                                                              self.cache_start),
+                                                   self.resource_positions[..., 1])
+
+        # Rewards are added one resource at a time so the floating point result matches SlopeEnv
+        num_deleted = to_delete.sum(axis=1)
+        reward_per_agent = self.reward_for_resource / self.num_agents
+
+        for i in range(num_deleted.max(initial=0)):
+            rewards += np.where(num_deleted > i, reward_per_agent, 0.0)[:, np.newaxis]
+
+        self.resource_alive &= ~to_delete
+        self.retrieved |= to_delete
+        self.current_num_resources -= num_deleted
+
+        return rewards
+
+    def replenish_resources(self):
+        """
+        Spawn new resources at the source of any arena where some have been moved
+
+        @return:
+        """
+        at_source = self.resource_alive & (self.area_of_row[self.resource_positions[..., 1]] == self.SOURCE)
+        resource_deficit = self.default_num_resources - np.minimum(at_source.sum(axis=1), self.default_num_resources)
+
+        for n in np.nonzero(resource_deficit > 0)[0]:
+            for i in range(resource_deficit[n]):
+                self.spawn_resource(n)
+
+    def get_agent_observations(self):
+        """
+        Generate the observations of every agent in every arena, laid out as in SlopeEnv.get_agent_observations()
+
+        @return: Integer array with shape (num_arenas, num_agents, observation_size)
+        """
+        padded_shape = (self.num_arenas,) + self.padded_walls.shape
+        x = self.agent_positions[..., 0] + self.sensor_range
+        y = self.agent_positions[..., 1] + self.sensor_range
+        arena_index = np.arange(self.num_arenas)
+
+        # Tiles containing agents
+        agent_map = np.zeros(padded_shape, dtype=bool)
+        agent_map[arena_index[:, np.newaxis], y, x] = True
+
+        # Tiles containing resources. Where several share a tile, the one with the largest id is recorded
+        resource_map = np.zeros(padded_shape, dtype=np.int64)
+        resource_arenas, resource_ids = np.nonzero(self.resource_alive)
+        np.maximum.at(resource_map, (resource_arenas,
+                                     self.resource_positions[resource_arenas, resource_ids, 1] + self.sensor_range,
+                                     self.resource_positions[resource_arenas, resource_ids, 0] + self.sensor_range),
+                      resource_ids + 1)
+
+        # Coordinates of every tile in each agent's sensing window
+        window_y = y[..., np.newaxis] + self.window_dy
+        window_x = x[..., np.newaxis] + self.window_dx
+        window_arena = arena_index[:, np.newaxis, np.newaxis]
+
+        walls = self.padded_walls[window_y, window_x]
+        other_agents = agent_map[window_arena, window_y, window_x]
+        other_agents[..., self.window_centre] = False
+        resources = resource_map[window_arena, window_y, window_x]
+        resources = (resources != 0) & (resources - 1 != self.has_resource[..., np.newaxis])
+
+        observations = np.zeros((self.num_arenas, self.num_agents, self.observation_space_size), dtype=np.int64)
+        observations[..., :self.tiles_in_sensing_range] = walls | other_agents | resources
+
+        areas = self.area_of_row[self.agent_positions[..., 1]]
+        np.put_along_axis(observations, (self.tiles_in_sensing_range + areas)[..., np.newaxis], 1, axis=2)
+        observations[..., self.tiles_in_sensing_range + 4] = self.has_resource != -1
+
+        return observations
+
+    # Resource storage ------------------------------------------------------------------------------------------------
+    def allocate_resource_arrays(self, capacity):
+        """
+        Create empty per-resource arrays able to hold resource ids up to capacity-1 in every arena
+
+        @param capacity: Number of resource ids each arena can hold
+        @return:
+        """
+        shape = (self.num_arenas, capacity)
+        self.resource_capacity = capacity
+        self.resource_positions = np.zeros(shape + (2,), dtype=np.int64)
+        self.resource_alive = np.zeros(shape, dtype=bool)
+        self.resource_carried_by = np.zeros(shape + (self.num_agents,), dtype=bool)
+        self.dropped_on_slope = np.zeros(shape, dtype=bool)
+        self.dropper_index = np.full(shape, -1, dtype=np.int64)
+        self.collected_from_cache = np.zeros(shape, dtype=bool)
+        self.collector_index = np.full(shape, -1, dtype=np.int64)
+        self.retrieved = np.zeros(shape, dtype=bool)
+
+    def grow_resource_arrays(self):
+        """
+        Double the number of resource ids the per-resource arrays can hold, keeping their contents
+
+        @return:
+        """
+        old_capacity = self.resource_capacity
+        old_arrays = [self.resource_positions, self.resource_alive, self.resource_carried_by, self.dropped_on_slope,
+                      self.dropper_index, self.collected_from_cache, self.collector_index, self.retrieved]
+        self.allocate_resource_arrays(2 * old_capacity)
+        new_arrays = [self.resource_positions, self.resource_alive, self.resource_carried_by, self.dropped_on_slope,
+                      self.dropper_index, self.collected_from_cache, self.collector_index, self.retrieved]
+
+        for old_array, new_array in zip(old_arrays, new_arrays):
+            new_array[:, :old_capacity] = old_array
+
+    def spawn_resource(self, arena_index):
+        """
+        Spawn a new resource in the source area of an arena if it is possible to do so. Positions are drawn with the
+        arena's random number generator in the same way as SlopeEnv.spawn_resource()
+
+        @param arena_index: Index of the arena
+        @return: x,y coordinate of new resource if successful. None otherwise
+        """
+        alive_positions = self.resource_positions[arena_index][self.resource_alive[arena_index]]
+        occupied = set(map(tuple, alive_positions.tolist()))
+        occupied_at_source = sum(1 for (x, y) in occupied if y >= self.source_start)
+
+        # If there is no space to spawn new resources, don't spawn
+        if occupied_at_source >= self.arena_width * self.source_size:
+            return None
+
+        if self.resource_spawning == "free_cells":
+            source_occupied = np.zeros((self.source_size, self.arena_width), dtype=bool)
+            for (x, y) in occupied:
+                if y >= self.source_start:
+                    source_occupied[y - self.source_start, x] = True
+            x, y = self.generate_free_resource_position(arena_index, source_occupied)
+        else:
+            while True:
+                x = self.np_randoms[arena_index].randint(low=0, high=self.arena_width)
+                y = self.np_randoms[arena_index].randint(low=self.source_start, high=self.arena_length)
+                if (x, y) not in occupied:
+                    break
+
+        if self.latest_resource_id[arena_index] + 1 >= self.resource_capacity:
+            self.grow_resource_arrays()
+
+        self.latest_resource_id[arena_index] += 1
+        resource_id = self.latest_resource_id[arena_index]
+        self.resource_positions[arena_index, resource_id] = (x, y)
+        self.resource_alive[arena_index, resource_id] = True
+        self.current_num_resources[arena_index] += 1
+
+        return x, y
+
+    def generate_free_resource_position(self, arena_index, source_occupied):
+        """
+        Picks one of the free source tiles of an arena with its random number generator, in the same way as
+        SlopeEnv.generate_free_resource_position()
+
+        @param arena_index: Index of the arena
+        @param source_occupied: Boolean array indexed by [y - source_start, x] that is True for occupied source tiles
+        @return: x and y coordinates of the resource
+        """
+        free_tiles = np.flatnonzero(~source_occupied)
+        tile = int(free_tiles[self.np_randoms[arena_index].randint(len(free_tiles))])
+        return tile % self.arena_width, self.source_start + tile // self.arena_width
+
+    # Helpers ---------------------------------------------------------------------------------------------------------
+    def get_num_arenas(self):
+        return self.num_arenas
+
+    def get_observation_size(self):
+        return self.observation_space_size
+
+    def get_action_size(self):
+        return self.action_space_size
+
+    def reset_rng(self):
+        self.np_randoms = [np.random.RandomState(seed) for seed in self.seeds]
+        self.next_episode = 0
+
+    # Specialisation Metrics ------------------------------------------------------------------------------------------
+    def calculate_ferrante_specialisation(self):
+        """
+        Calculates task specialisation in every arena according to Ferrante et al's measure. See
+        SlopeEnv.calculate_ferrante_specialisation()
+
+        @return: List containing the list of specialisation measures of each arena
+        """
+        num_carriers = self.resource_carried_by.sum(axis=2)
+        total_resources_retrieved = self.retrieved.sum(axis=1)
+        n_coop = (self.retrieved & (num_carriers > 1)).sum(axis=1)
+        n_coop_eff = (self.retrieved & self.dropped_on_slope & self.collected_from_cache &
+                      (self.dropper_index != self.collector_index)).sum(axis=1)
+        agents_participated = np.where(self.retrieved, num_carriers, 0).max(axis=1, initial=0)
+
+        specialisations = []
+
+        for n in range(self.num_arenas):
+            r_coop = 0
+            r_coop_eff = 0
+            r_spec = 0
+            participation = 0
+
+            if total_resources_retrieved[n] != 0:
+                r_coop = int(n_coop[n]) / int(total_resources_retrieved[n])
+                r_coop_eff = int(n_coop_eff[n]) / int(total_resources_retrieved[n])
+                r_spec = (r_coop + r_coop_eff) / 2
+                participation = int(agents_participated[n]) / self.num_agents
+
+            specialisations += [[r_coop, r_coop_eff, r_spec, r_coop * participation, r_coop_eff * participation,
+                                 r_spec * participation]]
+
+        return specialisations
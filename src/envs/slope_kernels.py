@@ -0,0 +1,261 @@
+"""
+Kernels for the numba backend of SlopeEnv. They implement the same dynamics as the Python methods of SlopeEnv
+(act_and_reward, wipe_old_positions, update_agent_positions, update_resource_positions, replenish_resources and
+get_agent_observations) as loops over the integer arrays that hold the state of the arena, so they can be compiled.
+
+The state of the resources is held in arrays indexed by resource id (see SlopeEnv.allocate_resource_arrays()) and the
+resource held by each agent in an integer array where -1 means the agent isn't holding anything.
+
+Spawning new resources uses the environment's RandomState, so it is left to SlopeEnv. step_dynamics() returns the
+number of resources that need to be spawned and write_observations() is called once they have been.
+
+If numba is not installed, the kernels are left as plain Python functions.
+"""
+import numpy as np
+
+try:
+    from numba import njit
+    numba_available = True
+
+except ImportError:
+    numba_available = False
+
+# Area codes (same as SlopeEnv)
+NEST = 0
+CACHE = 1
+SLOPE = 2
+SOURCE = 3
+
+# Action codes (same as SlopeEnv)
+FORWARD = 0
+BACKWARD = 1
+LEFT = 2
+RIGHT = 3
+PICKUP = 4
+DROP = 5
+
+
+def step_dynamics(agent_actions, agent_positions, old_agent_positions, held_resources, rewards, agent_map,
+                  resource_map, resource_positions, resource_alive, resource_carried_by, dropped_on_slope,
+                  dropper_index, collected_from_cache, collector_index, retrieved, area_of_row, num_resources,
+                  sensor_range, sliding_speed, cache_start, source_start, base_cost, carry_factor, upward_cost_factor,
+                  downward_cost_factor, reward_for_resource, default_num_resources):
+    """
+    Agents act and get rewarded, collide, carry, drop and pick up resources, resources slide and are delivered. Updates
+    the arrays in place
+
+    @param agent_actions: Integer array with the action of each agent
+    @param agent_positions: Integer array of x,y positions of the agents
+    @param old_agent_positions: Integer array that the positions of the agents before acting are written into
+    @param held_resources: Id of the resource held by each agent (-1 if none)
+    @param rewards: Float array that the rewards are written into
+    @param agent_map: Integer grid indexed by [y, x] holding agent index + 1
+    @param resource_map: Integer grid indexed by [y, x] holding resource id + 1. Wiped by this function
+    @param num_resources: Number of resource ids that have been used in this episode
+    @return: Number of resources delivered to the nest and number of resources that need to be spawned
+    """
+    num_agents = agent_positions.shape[0]
+    arena_length, arena_width = agent_map.shape
+
+    # Agents act and receive rewards depending on where they are and what they do
+    for i in range(num_agents):
+        old_agent_positions[i, 0] = agent_positions[i, 0]
+        old_agent_positions[i, 1] = agent_positions[i, 1]
+        rewards[i] = 0.0
+        action = agent_actions[i]
+
+        if action < 4:
+            if action == FORWARD:
+                agent_positions[i, 1] = min(agent_positions[i, 1] + 1, arena_length - 1)
+            elif action == BACKWARD:
+                agent_positions[i, 1] = max(agent_positions[i, 1] - 1, 0)
+            elif action == LEFT:
+                agent_positions[i, 0] = max(agent_positions[i, 0] - 1, 0)
+            else:
+                agent_positions[i, 0] = min(agent_positions[i, 0] + 1, arena_width - 1)
+
+            # If agent is carrying something, multiply the cost of moving
+            movement_cost = base_cost * (carry_factor if held_resources[i] != -1 else 1.0)
+
+            # More costly for agent to move up the slope than down
+            if area_of_row[agent_positions[i, 1]] == SLOPE and action == FORWARD:
+                rewards[i] -= movement_cost + (movement_cost * upward_cost_factor * sliding_speed)
+            elif area_of_row[agent_positions[i, 1]] == SLOPE and action == BACKWARD:
+                rewards[i] -= movement_cost - (movement_cost * downward_cost_factor * sliding_speed)
+            else:
+                rewards[i] -= movement_cost
+
+        else:
+            rewards[i] -= base_cost
+
+    # The old positions are wiped out
+    for i in range(num_agents):
+        agent_map[old_agent_positions[i, 1], old_agent_positions[i, 0]] = 0
+
+    for resource_id in range(num_resources):
+        if resource_alive[resource_id]:
+            resource_map[resource_positions[resource_id, 1], resource_positions[resource_id, 0]] = 0
+
+    # Collisions. The map first records the largest index of the agents moving to each tile, negated if an agent is
+    # staying on the tile. Agents that aren't the largest index on their tile or whose tile is taken go back
+    collided = np.zeros(num_agents, dtype=np.bool_)
+
+    for i in range(num_agents):
+        agent_map[agent_positions[i, 1], agent_positions[i, 0]] = i + 1
+
+    for i in range(num_agents):
+        if agent_positions[i, 0] == old_agent_positions[i, 0] and agent_positions[i, 1] == old_agent_positions[i, 1]:
+            agent_map[agent_positions[i, 1], agent_positions[i, 0]] = -abs(agent_map[agent_positions[i, 1],
+                                                                                     agent_positions[i, 0]])
+
+    for i in range(num_agents):
+        collided[i] = agent_map[agent_positions[i, 1], agent_positions[i, 0]] != i + 1
+
+    for i in range(num_agents):
+        agent_map[agent_positions[i, 1], agent_positions[i, 0]] = 0
+
+    for i in range(num_agents):
+        if collided[i]:
+            agent_positions[i, 0] = old_agent_positions[i, 0]
+            agent_positions[i, 1] = old_agent_positions[i, 1]
+
+        agent_map[agent_positions[i, 1], agent_positions[i, 0]] = i + 1
+
+    # Resources get moved with the agents carrying them or dropped
+    first_eligible_agent = np.zeros(num_resources, dtype=np.int64)
+    to_delete = np.zeros(num_resources, dtype=np.bool_)
+
+    for j in range(num_agents):
+        resource_id = held_resources[j]
+
+        if resource_id == -1 or not resource_alive[resource_id] or \
+                resource_positions[resource_id, 0] != old_agent_positions[j, 0] or \
+                resource_positions[resource_id, 1] != old_agent_positions[j, 1]:
+            continue
+
+        if agent_actions[j] == DROP:
+            held_resources[j] = -1
+            resource_carried_by[resource_id, j] = True
+            first_eligible_agent[resource_id] = j + 1
+            resource_area = area_of_row[old_agent_positions[j, 1]]
+
+            if resource_area == SLOPE:
+                dropped_on_slope[resource_id] = True
+                dropper_index[resource_id] = j
+
+            if resource_area == NEST:
+                to_delete[resource_id] = True
+
+        else:
+            resource_positions[resource_id, 0] = agent_positions[j, 0]
+            resource_positions[resource_id, 1] = agent_positions[j, 1]
+
+    # Each free resource goes to the free agent with the smallest index that is picking up and has it in range
+    is_held = np.zeros(num_resources, dtype=np.bool_)
+
+    for j in range(num_agents):
+        if held_resources[j] != -1:
+            is_held[held_resources[j]] = True
+
+    for resource_id in range(num_resources):
+        if not resource_alive[resource_id] or is_held[resource_id]:
+            continue
+
+        for j in range(first_eligible_agent[resource_id], num_agents):
+            if held_resources[j] == -1 and agent_actions[j] == PICKUP and \
+                    abs(agent_positions[j, 0] - resource_positions[resource_id, 0]) <= sensor_range and \
+                    abs(agent_positions[j, 1] - resource_positions[resource_id, 1]) <= sensor_range:
+
+                if area_of_row[resource_positions[resource_id, 1]] == CACHE:
+                    collected_from_cache[resource_id] = True
+                    collector_index[resource_id] = j
+
+                resource_positions[resource_id, 0] = agent_positions[j, 0]
+                resource_positions[resource_id, 1] = agent_positions[j, 1]
+                held_resources[j] = resource_id
+                is_held[resource_id] = True
+                break
+
+    # Resources on the slope that nobody is holding slide
+    for resource_id in range(num_resources):
+        if resource_alive[resource_id] and not is_held[resource_id] and \
+                area_of_row[resource_positions[resource_id, 1]] == SLOPE:
+            resource_positions[resource_id, 1] = max(resource_positions[resource_id, 1] - sliding_speed, cache_start)
+
+    # Resources dropped in the nest are deleted and all agents are rewarded
+    num_deleted = 0
+
+    for resource_id in range(num_resources):
+        if to_delete[resource_id]:
+            for k in range(num_agents):
+                rewards[k] += reward_for_resource / num_agents
+
+            resource_alive[resource_id] = False
+            retrieved[resource_id] = True
+            num_deleted += 1
+
+    # Number of resources needed to bring the source back to the default number
+    num_resources_at_source = 0
+
+    for resource_id in range(num_resources):
+        if resource_alive[resource_id] and resource_positions[resource_id, 1] >= source_start:
+            num_resources_at_source += 1
+
+    return num_deleted, default_num_resources - min(num_resources_at_source, default_num_resources)
+
+
+def write_observations(agent_positions, held_resources, padded_agent_map, padded_resource_map, padded_walls,
+                       resource_positions, resource_alive, num_resources, area_of_row, sensor_range, observations):
+    """
+    Write the resources into the resource map and each agent's observation (see SlopeEnv.get_agent_observations())
+    into an array
+
+    @param padded_agent_map: Agent map padded by the sensor range
+    @param padded_resource_map: Resource map padded by the sensor range. Expected to contain no resources
+    @param padded_walls: Boolean grid padded by the sensor range that is True outside the arena
+    @param observations: Integer array with shape (num_agents, observation_size)
+    @return:
+    """
+    num_agents = agent_positions.shape[0]
+    window_side = 2 * sensor_range + 1
+    tiles_in_sensing_range = window_side * window_side
+    window_centre = tiles_in_sensing_range // 2
+
+    # Resources with larger ids are written last, so a tile holding several resources shows the largest id
+    for resource_id in range(num_resources):
+        if resource_alive[resource_id]:
+            padded_resource_map[resource_positions[resource_id, 1] + sensor_range,
+                                resource_positions[resource_id, 0] + sensor_range] = resource_id + 1
+
+    for j in range(num_agents):
+        x = agent_positions[j, 0]
+        y = agent_positions[j, 1]
+        carried_resource = held_resources[j] + 1
+        tile = 0
+
+        # Tiles go row by row from the top left tile (in padded coordinates, the window starts at x, y + 2*range)
+        for row in range(window_side):
+            padded_y = y + 2 * sensor_range - row
+
+            for column in range(window_side):
+                padded_x = x + column
+                is_object = padded_walls[padded_y, padded_x] or \
+                    (tile != window_centre and padded_agent_map[padded_y, padded_x] != 0)
+
+                if not is_object:
+                    resource = padded_resource_map[padded_y, padded_x]
+                    is_object = resource != 0 and resource != carried_resource
+
+                observations[j, tile] = 1 if is_object else 0
+                tile += 1
+
+        for area in range(4):
+            observations[j, tiles_in_sensing_range + area] = 0
+
+        observations[j, tiles_in_sensing_range + area_of_row[y]] = 1
+        observations[j, tiles_in_sensing_range + 4] = 1 if held_resources[j] != -1 else 0
+
+
+if numba_available:
+    step_dynamics = njit(cache=True)(step_dynamics)
+    write_observations = njit(cache=True)(write_observations)
@@ -3,19 +3,44 @@ Evaluate the learned/evolved agent models with or without visualisation
 """
 
 import argparse
+import hashlib
 import os
 import numpy as np
 import json
 
 from fitness import FitnessCalculator
 from agents.nn_agent_lean import NNAgent
+from trajectory_recorder import TrajectoryRecorder
 from operator import add
 from glob import glob
 from agents.hardcoded.hitchhiker import HardcodedHitchhikerAgent
 from array2gif import write_gif
 
 
-def evaluate_model(model_path, episodes=None, rendering=None, time_delay=None, print_scores=None, ids_to_remove=None):
+def get_team_key(model_files, ids_to_remove):
+    """
+    Identify the team a model evaluation is done with
+
+    @param model_files: Names of the genome files the team's agents are loaded from
+    @param ids_to_remove: Indices of the agents replaced by hardcoded hitchhikers
+    @return: Dictionary with a hash of the contents of the genome files and the ids of the removed agents
+    """
+    model_hash = hashlib.sha256()
+
+    for model_file in model_files:
+        model_hash.update(open(model_file, "rb").read())
+
+    return {"model_hash": model_hash.hexdigest(), "ids_to_remove": sorted(ids_to_remove) if ids_to_remove else []}
+
+
+def evaluate_model(model_path, episodes=None, rendering=None, time_delay=None, print_scores=None, ids_to_remove=None,
+                   trajectory_path=None):
+    """
+    Evaluate a model. If a trajectory path is given, the team's trajectories are recorded there the first time the model
+    is evaluated and replayed from there afterwards, which is faster and doesn't need the agents. Trajectories are only
+    replayed if they were recorded from the same model files, with the same agents removed and the same environment.
+    Otherwise the team is evaluated again and the recording is replaced
+    """
     if rendering == "True":
         rendering = True
     else:
@@ -69,65 +94,101 @@ def evaluate_model(model_path, episodes=None, rendering=None, time_delay=None, p
     else:
         fitness_calculator = FitnessCalculator(parameter_path)
 
-    if parameter_dictionary["general"]["learning_type"] == "centralised" and \
-            parameter_dictionary["general"]["reward_level"] == "team" and \
-            parameter_dictionary["general"]["team_type"] == "heterogeneous":
+    # Genome files of the team. In decentralised learning there is one for each agent
+    if parameter_dictionary["general"]["learning_type"] == "decentralised" and \
+            parameter_dictionary["general"]["reward_level"] == "individual":
+        genome_prefix = "_".join(str(item) for item in parameter_list)
+        genome_suffix = f"{generation}.npy"
+        all_genome_files = glob(f"{data_directory}/{genome_prefix}*{genome_suffix}")
+        model_files = sorted(all_genome_files)
+    else:
+        model_files = [model_path]
 
-        full_genome = np.load(model_path)
+    team_key = None
+    trajectories = None
 
-        for i in range(num_agents):
-            if ids_to_remove and i in ids_to_remove:
-                agent = HardcodedHitchhikerAgent()
+    # The team is only identified when its trajectories are recorded or replayed, so that evaluations without a
+    # trajectory path don't read every genome file to hash it
+    if trajectory_path is not None:
+        team_key = get_team_key(model_files, ids_to_remove)
 
-            else:
-                start = i * int(len(full_genome) / num_agents)
-                end = (i + 1) * int(len(full_genome) / num_agents)
-                sub_genome = full_genome[start:end]
-                agent = NNAgent(fitness_calculator.get_observation_size(), fitness_calculator.get_action_size(),
-                                parameter_path, sub_genome)
+        # np.savez_compressed() adds the extension if it is missing, so the recording is looked for under the same name
+        if not trajectory_path.endswith(".npz"):
+            trajectory_path += ".npz"
 
-            agent_list += [agent]
+        if os.path.exists(trajectory_path):
+            trajectories = TrajectoryRecorder.load(trajectory_path)
 
-    elif (parameter_dictionary["general"]["learning_type"] == "centralised" and \
-            parameter_dictionary["general"]["reward_level"] == "individual") or \
-            parameter_dictionary["general"]["team_type"] == "homogeneous":
+            if trajectories["metadata"] != team_key or trajectories["parameters"]["environment"] != \
+                    fitness_calculator.get_parameter_dictionary()["environment"]:
+                print(f"{trajectory_path} was recorded from a different team or environment, so it will be recorded "
+                      f"again")
+                trajectories = None
 
-        for i in range(num_agents):
-            if ids_to_remove and i in ids_to_remove:
-                agent = HardcodedHitchhikerAgent()
+    # A team whose trajectories have been recorded is replayed without creating the agents
+    if trajectories is not None:
+        results = fitness_calculator.calculate_fitness_from_trajectories(trajectories, render=rendering,
+                                                                         time_delay=time_delay,
+                                                                         measure_specialisation=True,
+                                                                         render_mode="human")
 
-            else:
-                genome = np.load(model_path)
-                agent = NNAgent(fitness_calculator.get_observation_size(),
-                                   fitness_calculator.get_action_size(), parameter_path, genome)
+    else:
+        if parameter_dictionary["general"]["learning_type"] == "centralised" and \
+                parameter_dictionary["general"]["reward_level"] == "team" and \
+                parameter_dictionary["general"]["team_type"] == "heterogeneous":
 
-            agent_list += [agent]
+            full_genome = np.load(model_path)
 
-    elif parameter_dictionary["general"]["learning_type"] == "decentralised" and \
-            parameter_dictionary["general"]["reward_level"] == "individual":
+            for i in range(num_agents):
+                if ids_to_remove and i in ids_to_remove:
+                    agent = HardcodedHitchhikerAgent()
 
-        # Find genomes of all teammates
-        genome_prefix = "_".join(str(item) for item in parameter_list)
-        genome_suffix = f"{generation}.npy"
-        all_genome_files = glob(f"{data_directory}/{genome_prefix}*{genome_suffix}")
+                else:
+                    start = i * int(len(full_genome) / num_agents)
+                    end = (i + 1) * int(len(full_genome) / num_agents)
+                    sub_genome = full_genome[start:end]
+                    agent = NNAgent(fitness_calculator.get_observation_size(), fitness_calculator.get_action_size(),
+                                    parameter_path, sub_genome)
+
+                agent_list += [agent]
+
+        elif (parameter_dictionary["general"]["learning_type"] == "centralised" and \
+                parameter_dictionary["general"]["reward_level"] == "individual") or \
+                parameter_dictionary["general"]["team_type"] == "homogeneous":
+
+            for i in range(num_agents):
+                if ids_to_remove and i in ids_to_remove:
+                    agent = HardcodedHitchhikerAgent()
+
+                else:
+                    genome = np.load(model_path)
+                    agent = NNAgent(fitness_calculator.get_observation_size(),
+                                       fitness_calculator.get_action_size(), parameter_path, genome)
+
+                agent_list += [agent]
+
+        elif parameter_dictionary["general"]["learning_type"] == "decentralised" and \
+                parameter_dictionary["general"]["reward_level"] == "individual":
 
-        assert len(all_genome_files) == num_agents, "Number of genome files does not match number of agents on the team"
+            assert len(all_genome_files) == num_agents, "Number of genome files does not match number of agents on the team"
 
-        for i, genome_file in enumerate(all_genome_files):
+            for i, genome_file in enumerate(all_genome_files):
 
-            if ids_to_remove and i in ids_to_remove:
-                agent = HardcodedHitchhikerAgent()
+                if ids_to_remove and i in ids_to_remove:
+                    agent = HardcodedHitchhikerAgent()
 
-            else:
-                genome = np.load(genome_file)
-                agent = NNAgent(fitness_calculator.get_observation_size(),
-                                fitness_calculator.get_action_size(), parameter_path, genome)
+                else:
+                    genome = np.load(genome_file)
+                    agent = NNAgent(fitness_calculator.get_observation_size(),
+                                    fitness_calculator.get_action_size(), parameter_path, genome)
 
-            agent_list += [agent]
+                agent_list += [agent]
 
-    results = fitness_calculator.calculate_fitness(agent_list=agent_list, render=rendering, time_delay=time_delay,
-                                                   measure_specialisation=True, logging=False, logfilename=None,
-                                                   render_mode="human")
+        # Overwrites any recording already at trajectory_path, e.g. one made from a different team
+        results = fitness_calculator.calculate_fitness(agent_list=agent_list, render=rendering, time_delay=time_delay,
+                                                       measure_specialisation=True, logging=trajectory_path is not None,
+                                                       logfilename=trajectory_path, render_mode="human",
+                                                       log_metadata=team_key)
 
     '''results = fitness_calculator.calculate_fitness(agent_list=agent_list, render=True, time_delay=0,
                                                    render_mode="rgb_array")
@@ -169,15 +230,17 @@ if __name__ == "__main__":
     parser.add_argument('--time_delay', action="store")
     parser.add_argument('--print_scores', action="store")
     parser.add_argument('--ids_to_remove', action="store")
+    parser.add_argument('--trajectory_path', action="store")
     model_path = parser.parse_args().model_path
     episodes = int(parser.parse_args().episodes)
     rendering = parser.parse_args().rendering
     time_delay = parser.parse_args().time_delay
     print_scores = parser.parse_args().print_scores
     ids_to_remove = parser.parse_args().ids_to_remove
+    trajectory_path = parser.parse_args().trajectory_path
 
     if ids_to_remove:
         ids_to_remove = [int(id) for id in ids_to_remove.strip("[]").split(",")]
 
-    evaluate_model(model_path, episodes, rendering, time_delay, print_scores, ids_to_remove)
+    evaluate_model(model_path, episodes, rendering, time_delay, print_scores, ids_to_remove, trajectory_path)
     #evaluate_model(model_path, rendering, time_delay)
\ No newline at end of file
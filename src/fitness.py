@@ -1,15 +1,25 @@
 import copy
 import json
-import os
 import numpy as np
 import time
-from envs.slope import SlopeEnv
+from envs.slope import SlopeEnv, BatchedSlopeEnv
+from agents.nn_agent_lean import NNAgent, NNAgentFactory
+from agents.lean_networks.BatchedRNN import BatchedRNN
+from agents.lean_networks.BatchedFFNN import BatchedFFNN
+from trajectory_recorder import TrajectoryRecorder, TrajectoryReplay
 
 
 class FitnessCalculator:
 
-    def __init__(self, parameter_filename):
-
+    def __init__(self, parameter_filename, backend="python", headless=False, profiling=False):
+        """
+        @param parameter_filename: Name of the file containing the experiment parameters
+        @param backend: Backend used by the SlopeEnv that fitness is calculated in ("python" or "numba")
+        @param headless: Boolean indicating whether the SlopeEnv is headless i.e. can't be rendered
+        @param profiling: Boolean indicating whether calculate_fitness() measures where its time goes. The time spent
+        resetting the environment ("reset"), choosing actions ("act") and in each phase of the environment's steps (see
+        SlopeEnv.enable_profiling()) is returned with each evaluation and added up in self.profile
+        """
         if parameter_filename is None:
             raise RuntimeError("No parameter file specified for the fitness function")
 
@@ -17,7 +27,16 @@ class FitnessCalculator:
         self.parameter_dictionary = json.loads(open(parameter_filename).read())
 
         if self.parameter_dictionary["general"]["environment"] == "slope":
-            self.env = SlopeEnv(parameter_filename)
+            self.env = SlopeEnv(parameter_filename, backend=backend, headless=headless)
+
+        # Created on demand by calculate_fitness_batched and calculate_fitness_of_genome_population
+        self.batched_env = None
+        self.agent_factory = None
+
+        # Profile of all evaluations since the last reset_profile(), in the format of SlopeEnv.get_profile()
+        self.profiling = profiling
+        self.profile = {}
+        self.env.enable_profiling(profiling)
 
         environment_name = self.parameter_dictionary['general']['environment']
         self.num_agents = self.parameter_dictionary['environment'][environment_name]['num_agents']
@@ -34,23 +53,72 @@ class FitnessCalculator:
         self.episode_length = self.parameter_dictionary['environment']['slope']['episode_length']
         self.num_episodes = self.parameter_dictionary['environment']['slope']['num_episodes']
 
-    def calculate_fitness_of_agent_population(self, population, calculate_specialisation):
+    def calculate_fitness_of_agent_population(self, population, calculate_specialisation, batched=False):
         """
         Takes a population of Agent objects, places each group in a team and calculates the fitnesses of each
 
         @param population: List of Agent objects
+        @param calculate_specialisation: Boolean indicating whether or not specialisation is being measured
+        @param batched: Boolean indicating whether all teams are simulated together in a BatchedSlopeEnv
         @return: List containing fitness value of each Agent in the population
         """
 
         assert len(population) % self.num_agents == 0, "Population needs to be divisible by the number of agents per team"
 
+        agents_per_team = self.num_agents
+        team_list = [population[i:i+agents_per_team] for i in range(0, len(population), agents_per_team)]
+
+        if batched:
+            results_list = self.calculate_fitness_batched(team_list, measure_specialisation=calculate_specialisation)
+        else:
+            results_list = [self.calculate_fitness(agent_list, measure_specialisation=calculate_specialisation)
+                            for agent_list in team_list]
+
+        return self.get_population_results(results_list)
+
+    def calculate_fitness_of_genome_population(self, genome_matrix, calculate_specialisation):
+        """
+        Same as calculate_fitness_of_agent_population(batched=True) for a population of NNAgents, but the agents are
+        given by their genomes and never created. Their networks are loaded straight from the genome matrix into a
+        single batched network
+
+        @param genome_matrix: Array with shape (population size, num_weights), the genome of one agent per row
+        @param calculate_specialisation: Boolean indicating whether or not specialisation is being measured
+        @return: List containing fitness value of each agent in the population
+        """
+        assert len(genome_matrix) % self.num_agents == 0, "Population needs to be divisible by the number of agents per team"
+
+        if self.agent_factory is None:
+            self.agent_factory = NNAgentFactory(self.observation_size, self.action_size, self.parameter_filename)
+
+        batched_net = self.agent_factory.create_batched_network(genome_matrix)
+        results_list = self.simulate_teams_batched(len(genome_matrix) // self.num_agents, calculate_specialisation,
+                                                   batched_net=batched_net)
+
+        return self.get_population_results(results_list)
+
+    def can_calculate_fitness_of_genome_population(self):
+        """
+        Whether calculate_fitness_of_genome_population() can stand in for calculating the fitness of each team of NNAgents
+        with calculate_fitness(). The BatchedSlopeEnv doesn't support incremental rewards, and idle detection and
+        profiling only happen in calculate_fitness()
+
+        @return: Boolean
+        """
+        return self.parameter_dictionary['general']['agent_type'] == "nn" and \
+            self.parameter_dictionary['agent']['nn']['architecture'] in ["rnn", "ffnn"] and \
+            self.parameter_dictionary['environment']['slope']['incremental_rewards'] == "False" and \
+            self.env.idle_detection == "off" and not self.profiling
+
+    def get_population_results(self, results_list):
+        """
+        @param results_list: List containing the results dictionary of each team
+        @return: List containing the fitness list of each agent and list containing the specialisation list of each team
+        """
         fitnesses = []
         specialisations = []
-        agents_per_team = self.num_agents
 
-        for i in range(0, len(population), agents_per_team):
-            agent_list = [population[i+j] for j in range(0, agents_per_team)]
-            results_dict = self.calculate_fitness(agent_list, measure_specialisation=calculate_specialisation)
+        for results_dict in results_list:
             fitness_matrix = results_dict['fitness_matrix']
 
             # Specialisation of the team calculated through several measures. List of lists. One list of measures for each episode
@@ -62,54 +130,71 @@ class FitnessCalculator:
         return fitnesses, specialisations
 
     def calculate_fitness(self, agent_list, render=False, time_delay=0, measure_specialisation=False,
-                          logging=False, logfilename=None, render_mode="human"):
+                          logging=False, logfilename=None, render_mode="human", log_metadata=None):
         """
         Calculates the fitness of a team of agents. Fitness is calculated
         by running the simulation for t time steps (as specified in the parameter file) with each agent acting every
         time step based on its observations. The simulation is restarted at the end and repeated a certain number of
-        times (according to the parameter file). This is done without resetting the random number generator so that
-        there are new initial positions for agents and resources in each simulation run.
+        times (according to the parameter file). Each episode has its own initial positions for agents and resources,
+        drawn from the environment's single random number generator without resetting it between episodes (or, if
+        rng_streams is per_episode, from the episode's own random number stream).
 
         @param agent_list: List of Agent objects
         @param render: Boolean indicating whether or not simulations will be visualised
         @param time_delay: Integer indicating how many seconds delay (for smoother visualisation)
         @param measure_specialisation: Boolean indicating whether or not specialisation is being measured
-        @param logging: Boolean indicating whether or not actions will be logged
-        @param logfilename: String name of the file where actions will be logged
+        @param logging: Boolean indicating whether or not the team's trajectories (actions, positions, carried resources
+        and rewards) will be logged. Episodes aren't fast-forwarded when logging, so every step is recorded
+        @param logfilename: String name of the .npz file where trajectories will be logged (see TrajectoryRecorder). Any
+        existing file with this name is overwritten rather than appended to, so use a different name for each evaluation
+        whose trajectories should be kept
         @param render_mode: If rgb_array, creates an rgb array of the first episode. Otherwise plays video. Only does either if render is True
+        @param log_metadata: Dictionary saved with the logged trajectories, e.g. to identify the team they came from
         @return: Dictionary containing 'fitness_matrix' (each index i is a list of agent i's fitnesses for every episode)
         and 'specialisation_list' (a measure of the degree of
-        specialisation observed for the team for each episode)
+        specialisation observed for the team for each episode). If profiling, also contains 'profile' (the time spent
+        in each phase of this evaluation)
         """
 
         assert len(agent_list) == self.num_agents, "Agents passed to function do not match parameter file"
 
+        if self.profiling:
+            self.env.reset_profile()
+
         # Initialise major variables
-        file_reader = None
+        recorder = None
         fitness_matrix = [[0]*self.num_episodes for i in range(len(agent_list))]
         specialisation_list = []
         agent_copies = [copy.deepcopy(agent) for agent in agent_list]
         video_frames = []
         self.env.reset_rng()
 
-        # Create logging file if logging
+        # Create trajectory recorder if logging
         if logging:
             if not logfilename:
                 raise RuntimeError("Cannot log results without naming the logfile")
 
-            if not os.path.exists(logfilename):
-                file_reader = open(logfilename, "w+")
-                header_line = ','.join(f"t={t}" for t in range(self.episode_length)) + "\n"
-                file_reader.write(header_line)
-            else:
-                file_reader = open(logfilename, "a")
+            recorder = TrajectoryRecorder(self.num_episodes, self.episode_length, self.num_agents)
+
+        # Teams stuck in a loop can be fast-forwarded to the end of the episode (see SlopeEnv.find_loop()) if every agent
+        # can tell what its next action depends on. Not done when rendering or logging, so the whole episode is shown
+        fast_forward = self.env.idle_detection != "off" and not render and not logging and \
+            all(agent.get_memory() is not None for agent in agent_copies)
 
         # Run the simulation several times
         for episode in range(self.num_episodes):
-            observations = self.env.reset()
+            if self.profiling:
+                start = time.perf_counter_ns()
+
+            observations = self.env.reset(episode)
+
+            if self.profiling:
+                self.env.add_to_profile("reset", start)
+
+            if logging:
+                recorder.record_reset(episode, self.env)
 
             # Initialise variables
-            agent_action_matrix = [[-1]*self.episode_length for i in range(len(agent_list))]
             current_episode_reward_matrix = [[0]*self.episode_length for i in range(len(agent_list))]
 
             # Do 1 run of the simulation
@@ -119,15 +204,23 @@ class FitnessCalculator:
                 elif render:
                     self.env.render(mode=render_mode)
 
+                if self.profiling:
+                    start = time.perf_counter_ns()
+
                 robot_actions = []
 
                 for i in range(len(observations)):
                     robot_actions += [agent_copies[i].act(observations[i])]
-                    agent_action_matrix[i][t] = [robot_actions[-1]]
+
+                if self.profiling:
+                    self.env.add_to_profile("act", start)
 
                 # The environment changes according to all their actions
                 observations, rewards = self.env.step(robot_actions)
 
+                if logging:
+                    recorder.record_step(episode, t, robot_actions, rewards, self.env)
+
                 # Calculate how much of the rewards go to each agent type
                 for i in range(len(rewards)):
                     fitness_matrix[i][episode] += rewards[i]
@@ -136,26 +229,161 @@ class FitnessCalculator:
                 if time_delay > 0:
                     time.sleep(time_delay)
 
+                # If the team is in a loop, the rewards of the loop's steps repeat until the end of the episode. They
+                # are added one step at a time so the fitness is exactly the same as when simulating those steps
+                if fast_forward:
+                    loop_length = self.env.find_loop(b"".join(agent.get_memory() for agent in agent_copies))
+
+                    if loop_length is not None:
+                        for future_t in range(t + 1, self.episode_length):
+                            for i in range(len(rewards)):
+                                fitness_matrix[i][episode] += current_episode_reward_matrix[i][future_t - loop_length]
+                                current_episode_reward_matrix[i][future_t] = \
+                                    current_episode_reward_matrix[i][future_t - loop_length]
+
+                        break
+
             # Reset agent networks
             agent_copies = [copy.deepcopy(agent) for agent in agent_list]
 
-            # Extra computations if calculating specialisation or logging actions
+            # Extra computations if calculating specialisation
             if measure_specialisation:
                 specialisation_list += [self.env.calculate_ferrante_specialisation()]
 
-            if logging:
-                #for agent_action_list in agent_action_matrix:
-                #    action_string = ','.join(str(action) for action in agent_action_list) + '\n'
-                #    file_reader.write(action_string)
-                for reward_list in current_episode_reward_matrix:
-                    reward_string = ','.join(str(reward) for reward in reward_list) + '\n'
-                    file_reader.write(reward_string)
-
         if logging:
-            file_reader.close()
+            recorder.save(logfilename, self.parameter_dictionary, log_metadata)
+
+        results = {"fitness_matrix": fitness_matrix, "specialisation_list": specialisation_list, "video_frames": video_frames}
+
+        if self.profiling:
+            results["profile"] = self.env.get_profile()
+
+            for phase, counters in results["profile"].items():
+                total = self.profile.setdefault(phase, {"ns": 0, "calls": 0})
+                total["ns"] += counters["ns"]
+                total["calls"] += counters["calls"]
+
+        return results
+
+    def calculate_fitness_from_trajectories(self, trajectory_filename, render=False, time_delay=0,
+                                            measure_specialisation=False, render_mode="human"):
+        """
+        Calculates the fitness of a team from the trajectories recorded by calculate_fitness(logging=True). Every
+        episode is replayed with the recorded actions (see TrajectoryReplay), so no agents are needed
+
+        @param trajectory_filename: String name of the .npz file the trajectories were logged to, or the dictionary
+        returned by TrajectoryRecorder.load()
+        @param render: Boolean indicating whether or not simulations will be visualised
+        @param time_delay: Integer indicating how many seconds delay (for smoother visualisation)
+        @param measure_specialisation: Boolean indicating whether or not specialisation is being measured
+        @param render_mode: If rgb_array, creates an rgb array of the first episode. Otherwise plays video. Only does either if render is True
+        @return: Dictionary in the same format as calculate_fitness()
+        """
+        replay = TrajectoryReplay(self.parameter_filename, trajectory_filename)
+        fitness_matrix = [[0]*replay.num_episodes for i in range(self.num_agents)]
+        specialisation_list = []
+        video_frames = []
+
+        for episode in range(replay.num_episodes):
+            replay.reset(episode)
+
+            for t in range(replay.episode_length):
+                if render and render_mode == "rgb_array" and episode == 0:
+                    video_frames += [replay.env.render(mode=render_mode)]
+                elif render:
+                    replay.env.render(mode=render_mode)
+
+                observations, rewards = replay.step()
+
+                for i in range(len(rewards)):
+                    fitness_matrix[i][episode] += rewards[i]
+
+                if time_delay > 0:
+                    time.sleep(time_delay)
+
+            if measure_specialisation:
+                specialisation_list += [replay.env.calculate_ferrante_specialisation()]
 
         return {"fitness_matrix": fitness_matrix, "specialisation_list": specialisation_list, "video_frames": video_frames}
 
+    def calculate_fitness_batched(self, team_list, measure_specialisation=False):
+        """
+        Calculates the fitness of several teams at once. Each team gets its own arena in a BatchedSlopeEnv and every
+        arena is seeded like self.env, so the results are identical to calling calculate_fitness() on each team in turn.
+        If every agent is an NNAgent and their networks have the same architecture, all the networks are run together in
+        a BatchedRNN or BatchedFFNN
+
+        @param team_list: List of teams, each of which is a list of Agent objects
+        @param measure_specialisation: Boolean indicating whether or not specialisation is being measured
+        @return: List containing the results dictionary of each team, in the same format as calculate_fitness()
+        """
+
+        for agent_list in team_list:
+            assert len(agent_list) == self.num_agents, "Agents passed to function do not match parameter file"
+
+        agents = [agent for agent_list in team_list for agent in agent_list]
+        batched_net = None
+
+        if all(isinstance(agent, NNAgent) for agent in agents):
+            networks = [agent.net for agent in agents]
+
+            if BatchedRNN.can_batch(networks):
+                batched_net = BatchedRNN(networks)
+            elif BatchedFFNN.can_batch(networks):
+                batched_net = BatchedFFNN(networks)
+
+        return self.simulate_teams_batched(len(team_list), measure_specialisation, team_list, batched_net)
+
+    def simulate_teams_batched(self, num_teams, measure_specialisation, team_list=None, batched_net=None):
+        """
+        Simulates several teams at once in a BatchedSlopeEnv. Agents act through batched_net if it is given and through
+        copies of the agents in team_list otherwise
+
+        @param num_teams: Number of teams
+        @param measure_specialisation: Boolean indicating whether or not specialisation is being measured
+        @param team_list: List of teams, each of which is a list of Agent objects. When batched_net is given, the
+        networks of the agents only supply the state batched_net starts each episode from. If there are no agents, it
+        starts from a state of 0
+        @param batched_net: BatchedRNN or BatchedFFNN holding the network of every agent of every team, team by team
+        @return: List containing the results dictionary of each team, in the same format as calculate_fitness()
+        """
+        if self.batched_env is None or self.batched_env.get_num_arenas() != num_teams:
+            self.batched_env = BatchedSlopeEnv(self.parameter_filename, num_arenas=num_teams)
+
+        fitness_matrices = np.zeros((num_teams, self.num_agents, self.num_episodes))
+        specialisation_lists = [[] for n in range(num_teams)]
+        self.batched_env.reset_rng()
+
+        for episode in range(self.num_episodes):
+            # Fresh copies (or, for the batched network, a fresh state) so that agent networks are reset every episode
+            if batched_net is not None and team_list is not None:
+                batched_net.set_state([agent.net for agent_list in team_list for agent in agent_list])
+            elif batched_net is not None:
+                batched_net.reset_state()
+            else:
+                agent_copies = [[copy.deepcopy(agent) for agent in agent_list] for agent_list in team_list]
+
+            observations = self.batched_env.reset(episode)
+
+            for t in range(self.episode_length):
+                if batched_net is not None:
+                    activation_values = batched_net.forward(observations.reshape(num_teams * self.num_agents, -1))
+                    robot_actions = activation_values.argmax(axis=1).reshape(num_teams, self.num_agents)
+                else:
+                    robot_actions = [[agent_copies[n][i].act(observations[n][i]) for i in range(self.num_agents)]
+                                     for n in range(num_teams)]
+
+                # All arenas change according to their agents' actions
+                observations, rewards = self.batched_env.step(robot_actions)
+                fitness_matrices[:, :, episode] += rewards
+
+            if measure_specialisation:
+                for n, specialisation in enumerate(self.batched_env.calculate_ferrante_specialisation()):
+                    specialisation_lists[n] += [specialisation]
+
+        return [{"fitness_matrix": fitness_matrices[n].tolist(), "specialisation_list": specialisation_lists[n],
+                 "video_frames": []} for n in range(num_teams)]
+
     # Helpers ---------------------------------------------------------------------------------------------------------
 
     def get_observation_size(self):
@@ -173,3 +401,9 @@ class FitnessCalculator:
     def get_parameter_dictionary(self):
         return self.parameter_dictionary
 
+    def get_profile(self):
+        return self.profile
+
+    def reset_profile(self):
+        self.profile = {}
+
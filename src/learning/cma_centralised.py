@@ -8,6 +8,7 @@ import numpy as np
 import ray
 
 from fitness import FitnessCalculator
+from agents.nn_agent_lean import NNAgent
 from learning.learner_centralised import CentralisedLearner
 from learning.cma_parent import CMALearner
 from glob import glob
@@ -72,12 +73,20 @@ class CentralisedCMALearner(CentralisedLearner, CMALearner):
                 """
                 raise RuntimeError("This configuration is not supported yet")
 
-            # Convert genomes to agents
-            agent_population = self.convert_genomes_to_agents(genome_population)
-            agent_pop_size = len(agent_population)
             agent_fitness_lists = []
 
-            if self.multithreading:
+            # When the settings allow it, neural network agents are evaluated straight from their genomes, with all teams
+            # simulated together
+            if self.Agent == NNAgent and not self.multithreading and \
+                    self.fitness_calculator.can_calculate_fitness_of_genome_population():
+                genome_matrix = self.convert_genomes_to_genome_matrix(genome_population)
+                agent_fitness_lists, team_specialisations = self.fitness_calculator.calculate_fitness_of_genome_population(genome_matrix, self.calculate_specialisation)
+
+            elif self.multithreading:
+                # Convert genomes to agents
+                agent_population = self.convert_genomes_to_agents(genome_population)
+                agent_pop_size = len(agent_population)
+
                 remainder_agents = agent_pop_size % (self.num_agents**2)
                 divisible_pop_size = agent_pop_size - remainder_agents
                 parallel_threads = []
@@ -101,6 +110,7 @@ class CentralisedCMALearner(CentralisedLearner, CMALearner):
                     #team_specialisations += element[1]
 
             else:
+                agent_population = self.convert_genomes_to_agents(genome_population)
                 agent_fitness_lists, team_specialisations = self.fitness_calculator.calculate_fitness_of_agent_population(agent_population, self.calculate_specialisation)
 
             # Convert agent fitnesses into genome fitnesses
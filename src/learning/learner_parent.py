@@ -1,6 +1,7 @@
 import json
+import numpy as np
 from fitness import FitnessCalculator
-from agents.nn_agent_lean import NNAgent
+from agents.nn_agent_lean import NNAgent, NNAgentFactory
 from operator import add
 
 
@@ -25,11 +26,15 @@ class Learner:
             if self.reward_level == "team":
                 raise RuntimeError("Cannot reward at the team level")
 
-        self.genome_length = self.get_genome_length()
         self.Agent = None
+        self.agent_factory = None
 
         if self.parameter_dictionary['general']['agent_type'] == "nn":
             self.Agent = NNAgent
+            self.agent_factory = NNAgentFactory(self.fitness_calculator.get_observation_size(),
+                                                self.fitness_calculator.get_action_size(), self.parameter_filename)
+
+        self.genome_length = self.get_genome_length()
 
         # Will specialisation be computed?
         if self.parameter_dictionary['general']['calculate_specialisation'] == "True":
@@ -55,8 +60,7 @@ class Learner:
         if self.parameter_dictionary['general']['agent_type'] == "nn":
 
             # Get the number of weights in a neural network-based agent
-            num_weights = NNAgent(self.fitness_calculator.get_observation_size(),
-                                  self.fitness_calculator.get_action_size(), self.parameter_filename).get_num_weights()
+            num_weights = self.agent_factory.get_num_weights()
 
             # Genomes for heterogeneous teams rewarded at the team level are longer because multiple agent genomes
             # must be concatenated into a larger one
@@ -80,8 +84,7 @@ class Learner:
         if self.team_type == "homogeneous":
             for genome in genome_population:
                 for i in range(self.num_agents):
-                    agent = self.Agent(self.fitness_calculator.get_observation_size(),
-                                       self.fitness_calculator.get_action_size(), self.parameter_filename, genome)
+                    agent = self.agent_factory.create_agent(genome)
                     agent_population += [agent]
 
         elif self.team_type == "heterogeneous":
@@ -96,20 +99,39 @@ class Learner:
                         end_index = (i+1) * sub_genome_length
                         sub_genome = genome[start_index:end_index]
 
-                        agent = self.Agent(self.fitness_calculator.get_observation_size(),
-                                         self.fitness_calculator.get_action_size(), self.parameter_filename,
-                                         sub_genome)
+                        agent = self.agent_factory.create_agent(sub_genome)
                         agent_population += [agent]
 
             # In heterogeneous teams rewarded at the individual level, each genome is a unique agent
             elif self.reward_level == "individual":
                 for genome in genome_population:
-                    agent = self.Agent(self.fitness_calculator.get_observation_size(),
-                                         self.fitness_calculator.get_action_size(), self.parameter_filename, genome)
+                    agent = self.agent_factory.create_agent(genome)
                     agent_population += [agent]
 
         return agent_population
 
+    def convert_genomes_to_genome_matrix(self, genome_population):
+        """
+        Same as convert_genomes_to_agents() but, instead of creating the agents, returns a matrix with the genome of each
+        agent in a row, for FitnessCalculator.calculate_fitness_of_genome_population()
+
+        @param genome_population: List of genomes
+        @return: Array with one row for each agent in the population
+        """
+        genome_matrix = np.asarray(genome_population, dtype=np.float64)
+
+        # In homogeneous teams, each genome is used for two identical agents
+        if self.team_type == "homogeneous":
+            return np.repeat(genome_matrix, self.num_agents, axis=0)
+
+        # In heterogeneous teams rewarded at the team level, each genome is two concatenated agents
+        elif self.team_type == "heterogeneous" and self.reward_level == "team":
+            return genome_matrix.reshape(len(genome_matrix) * self.num_agents, -1)
+
+        # In heterogeneous teams rewarded at the individual level, each genome is a unique agent
+        elif self.team_type == "heterogeneous" and self.reward_level == "individual":
+            return genome_matrix
+
     def get_genome_fitnesses_from_agent_fitnesses(self, agent_fitness_lists):
         """
         Given a list of fitness lists of teams of agents, returns the fitness lists of the genomes they came from, based on the
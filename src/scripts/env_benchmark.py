@@ -0,0 +1,237 @@
+"""
+Benchmarks SlopeEnv on a fixed set of scenarios covering team sizes, sensor ranges, sliding speeds and arena sizes.
+For each scenario it times reset(), step_in_place(), the resolution of collisions within a step and the building of
+observations. Every scenario runs on a fixed seed with the same scripted actions, so the work done is identical from
+one run to the next and times can be compared between versions of the environment.
+
+Scenarios are grouped into suites:
+- pinned: the default suite, a quick check of the common settings
+- arena_scaling: the number of agents doubles in the largest arena, then the arena doubles in length and width with a
+  fixed number of agents. Step time should grow with the number of agents and stay flat as the arena grows
+- collisions: the number of agents doubles in a nest just large enough to hold them. Collision time per agent should
+  stay flat
+
+Results are written as JSON. When a baseline file from an earlier run is given, each time is compared with the
+baseline and the script exits with an error if any of them got slower by more than the tolerance.
+
+Run from the src directory:
+python -m scripts.env_benchmark --output benchmark.json
+python -m scripts.env_benchmark --output new_benchmark.json --baseline benchmark.json
+python -m scripts.env_benchmark --suite arena_scaling collisions --output scaling_benchmark.json
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+
+from envs.slope import SlopeEnv
+
+# Changes to the base parameters for each scenario. Don't edit existing scenarios, or their results will no longer be
+# comparable with baselines recorded before the edit
+SCENARIOS = {
+    "default": {},
+    "agents_8": {"num_agents": 8, "arena_width": 8},
+    "agents_32": {"num_agents": 32, "arena_width": 32},
+    "sensor_range_2": {"sensor_range": 2},
+    "sensor_range_3": {"sensor_range": 3},
+    "sliding_speed_1": {"sliding_speed": 1},
+    "sliding_speed_4": {"sliding_speed": 4},
+    "arena_16x64": {"arena_width": 16, "arena_length": 64, "slope_start": 8, "source_start": 56, "num_resources": 16},
+    "arena_64x256": {"num_agents": 8, "arena_width": 64, "arena_length": 256, "slope_start": 32, "source_start": 224,
+                     "num_resources": 16},
+}
+
+# Arenas four times as long as they are wide, with a source one tile deep holding the same number of resources
+for num_agents in [4, 8, 16, 32, 64, 128, 256]:
+    SCENARIOS[f"scaling_agents_{num_agents}"] = {"num_agents": num_agents, "arena_width": 256, "arena_length": 1024,
+                                                 "source_start": 1023, "num_resources": 8}
+
+for arena_width in [8, 16, 32, 64, 128, 256]:
+    SCENARIOS[f"scaling_width_{arena_width}"] = {"num_agents": 4, "arena_width": arena_width,
+                                                 "arena_length": 4 * arena_width, "source_start": 4 * arena_width - 1,
+                                                 "num_resources": 8}
+
+# Nests one tile deep with two tiles for each agent
+for num_agents in [2, 4, 8, 16, 32, 64, 128, 256, 512]:
+    SCENARIOS[f"collisions_{num_agents}"] = {"num_agents": num_agents, "arena_width": max(4, 2 * num_agents),
+                                             "cache_start": 1}
+
+SUITES = {
+    "pinned": ["default", "agents_8", "agents_32", "sensor_range_2", "sensor_range_3", "sliding_speed_1",
+               "sliding_speed_4", "arena_16x64", "arena_64x256"],
+    "arena_scaling": [scenario for scenario in SCENARIOS if scenario.startswith("scaling_")],
+    "collisions": [scenario for scenario in SCENARIOS if scenario.startswith("collisions_")],
+}
+
+# Probability of each action (forward, backward, left, right, pickup, drop) in the scripted action streams
+ACTION_PROBABILITIES = [0.4, 0.1, 0.1, 0.1, 0.2, 0.1]
+
+METRICS = ["reset_ns", "step_ns", "collision_ns", "observation_ns"]
+
+
+def create_parameter_file(base_parameter_filename, scenario, directory):
+    """
+    Create a copy of the base parameters with a scenario's changes
+
+    @param base_parameter_filename: Name of the parameter file to start from
+    @param scenario: Name of the scenario in SCENARIOS
+    @param directory: Directory where the new parameter file will be saved
+    @return: Name of the new parameter file
+    """
+    parameter_dictionary = json.loads(open(base_parameter_filename).read())
+    parameter_dictionary['environment']['slope'].update(SCENARIOS[scenario])
+
+    parameter_filename = os.path.join(directory, f"env_benchmark_{scenario}.json")
+    f = open(parameter_filename, "w")
+    f.write(json.dumps(parameter_dictionary, indent=4))
+    f.close()
+
+    return parameter_filename
+
+
+def time_scenario(parameter_filename, num_episodes, num_steps, seed, backend):
+    """
+    Time resets, steps, the resolution of collisions and the building of observations in an environment. Each episode
+    is stepped with its own part of the scripted action stream. Collisions are timed by profiling a second run of each
+    episode, so that the profiling doesn't slow down the timed steps. The numba backend resolves collisions inside its
+    compiled kernel, so its collision time is None
+
+    @param parameter_filename: Name of the parameter file
+    @param num_episodes: Number of episodes to run
+    @param num_steps: Number of steps in each episode
+    @param seed: Seed for the scripted actions
+    @param backend: Backend of the environment ("python" or "numba")
+    @return: Dictionary with the mean nanoseconds per reset, per step, per resolution of collisions and per building
+    of the observations
+    """
+    env = SlopeEnv(parameter_filename, backend=backend, headless=True)
+    action_rng = np.random.RandomState(seed)
+    agent_actions = action_rng.choice(env.get_action_size(), size=(num_episodes, num_steps, env.get_num_agents()),
+                                      p=ACTION_PROBABILITIES)
+    reset_time = 0
+    step_time = 0
+    observation_time = 0
+
+    for episode in range(num_episodes):
+        start = time.perf_counter_ns()
+        env.reset(episode)
+        reset_time += time.perf_counter_ns() - start
+
+        start = time.perf_counter_ns()
+        for t in range(num_steps):
+            env.step_in_place(agent_actions[episode, t])
+        step_time += time.perf_counter_ns() - start
+
+        start = time.perf_counter_ns()
+        for t in range(num_steps):
+            env.write_agent_observations(env.observation_buffer)
+        observation_time += time.perf_counter_ns() - start
+
+        env.reset(episode)
+        env.enable_profiling()
+        for t in range(num_steps):
+            env.step_in_place(agent_actions[episode, t])
+        env.enable_profiling(False)
+
+    collision_profile = env.get_profile().get("update_agent_positions")
+
+    return {"reset_ns": reset_time / num_episodes,
+            "step_ns": step_time / (num_episodes * num_steps),
+            "collision_ns": collision_profile["ns"] / collision_profile["calls"] if collision_profile else None,
+            "observation_ns": observation_time / (num_episodes * num_steps)}
+
+
+def run_benchmark(base_parameter_filename, scenarios, num_episodes, num_steps, num_repeats, seed, backend):
+    """
+    Time every scenario, keeping the fastest of several repeats to reduce noise, and print the results
+
+    @return: Dictionary with the settings of the benchmark and the times of each scenario
+    """
+    results = {"backend": backend, "episodes": num_episodes, "steps": num_steps, "seed": seed, "scenarios": {}}
+
+    with tempfile.TemporaryDirectory() as directory:
+        for scenario in scenarios:
+            parameter_filename = create_parameter_file(base_parameter_filename, scenario, directory)
+
+            # Untimed run, so that imports, compilation and caches don't count towards the first repeat
+            time_scenario(parameter_filename, 1, num_steps, seed, backend)
+
+            repeats = [time_scenario(parameter_filename, num_episodes, num_steps, seed, backend)
+                       for i in range(num_repeats)]
+            times = {metric: None if repeats[0][metric] is None else min(repeat[metric] for repeat in repeats)
+                     for metric in METRICS}
+            results["scenarios"][scenario] = times
+            collision_us = "      n/a" if times['collision_ns'] is None else f"{times['collision_ns'] / 1000:9.2f}"
+            print(f"{scenario:>18}: {times['reset_ns'] / 1000:9.2f} us reset, {times['step_ns'] / 1000:9.2f} us step, "
+                  f"{collision_us} us collisions, {times['observation_ns'] / 1000:9.2f} us observations")
+
+    return results
+
+
+def compare_with_baseline(results, baseline, tolerance):
+    """
+    Compare the times of each scenario with a baseline and print the ratios. Times missing from either, such as
+    collision times of the numba backend or of baselines recorded before they were measured, aren't compared
+
+    @param results: Results of run_benchmark()
+    @param baseline: Results of an earlier run_benchmark()
+    @param tolerance: Fraction by which a time can exceed the baseline before it counts as a regression
+    @return: List of (scenario, metric) pairs that regressed
+    """
+    if any(results[setting] != baseline[setting] for setting in ["backend", "episodes", "steps", "seed"]):
+        print("Warning: the baseline was recorded with different settings, so its times may not be comparable")
+
+    regressions = []
+
+    for scenario, times in results["scenarios"].items():
+        if scenario not in baseline["scenarios"]:
+            print(f"{scenario:>18}: not in baseline")
+            continue
+
+        baseline_times = baseline["scenarios"][scenario]
+        ratios = {metric: times[metric] / baseline_times[metric] for metric in METRICS
+                  if times[metric] is not None and baseline_times.get(metric) is not None}
+        regressed = [metric for metric in ratios if ratios[metric] > 1 + tolerance]
+        regressions += [(scenario, metric) for metric in regressed]
+        print(f"{scenario:>18}: " + ", ".join(f"{metric} x{ratio:.2f}" for metric, ratio in ratios.items()) +
+              (f" REGRESSED ({', '.join(regressed)})" if regressed else ""))
+
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the slope environment on pinned scenarios')
+    parser.add_argument('--parameters', action="store", default="default_parameters.json")
+    parser.add_argument('--suite', action="store", nargs="+", default=["pinned"], choices=list(SUITES.keys()),
+                        help="Suites of scenarios to run, unless scenarios are named with --scenarios")
+    parser.add_argument('--scenarios', action="store", nargs="+", choices=list(SCENARIOS.keys()))
+    parser.add_argument('--episodes', action="store", type=int, default=5)
+    parser.add_argument('--steps', action="store", type=int, default=500)
+    parser.add_argument('--repeats', action="store", type=int, default=3)
+    parser.add_argument('--seed', action="store", type=int, default=0)
+    parser.add_argument('--backend', action="store", default="python", choices=["python", "numba"])
+    parser.add_argument('--output', action="store")
+    parser.add_argument('--baseline', action="store")
+    parser.add_argument('--tolerance', action="store", type=float, default=0.2)
+    args = parser.parse_args()
+
+    scenarios = args.scenarios or [scenario for suite in args.suite for scenario in SUITES[suite]]
+    results = run_benchmark(args.parameters, scenarios, args.episodes, args.steps, args.repeats, args.seed,
+                            args.backend)
+
+    if args.output:
+        f = open(args.output, "w")
+        f.write(json.dumps(results, indent=4))
+        f.close()
+
+    if args.baseline:
+        baseline = json.loads(open(args.baseline).read())
+        regressions = compare_with_baseline(results, baseline, args.tolerance)
+
+        if regressions:
+            print(f"{len(regressions)} times regressed by more than {args.tolerance:.0%}")
+            sys.exit(1)
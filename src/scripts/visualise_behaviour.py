@@ -6,6 +6,7 @@ import time
 
 from fitness import FitnessCalculator
 from agents.nn_agent_lean import NNAgent
+from trajectory_recorder import TrajectoryReplay
 #from scripts.video_generator import get_video_from_model
 from scipy.stats import multivariate_normal
 from glob import glob
@@ -396,6 +397,22 @@ def visualise_centralised():
     print(specialisation)
 
 
+def visualise_trajectories(parameter_filename, trajectory_filename, episode=0, start=0, time_delay=0.1):
+    """
+    Watch a team from the trajectories recorded by FitnessCalculator.calculate_fitness(logging=True), starting from a
+    given step of an episode. The episode is replayed with the recorded actions, so no agents are created
+    """
+    replay = TrajectoryReplay(parameter_filename, trajectory_filename)
+    replay.seek(episode, start)
+
+    for t in range(start, replay.episode_length):
+        replay.env.render()
+        replay.step()
+        time.sleep(time_delay)
+
+    replay.env.close()
+
+
 
 #path = "/Users/mostafa/Documents/Code/PhD/TS-Platform/results/2021_02_23_decentralised_test/results/decentralised_cma_with_seeding_heterogeneous_individual_nn_slope_1_2_4_1_4_8_4_1_3_7_1_3.0_0.2_2_1000_500_20_rnn_False_1_4_tanh_100_0.2_100_0.001_0.0_0_59324.79999999987_final.npy"
 start = time.perf_counter()
@@ -0,0 +1,51 @@
+import unittest
+import numpy as np
+
+from agents.lean_networks.FFNN_multilayer import FFNN_multilayer
+from agents.lean_networks.RNN_multilayer import RNN_multilayer
+from agents.lean_networks.BatchedFFNN import BatchedFFNN
+
+
+class BatchedFFNNTest(unittest.TestCase):
+    def test_forward(self):
+        # Test: The batched forward pass gives exactly the same outputs as each network's own forward pass, whether the
+        # batch is made from the networks or from their genomes
+        for hidden_layers, use_bias, act_fn in [(0, False, "tanh"), (1, True, "tanh"), (2, False, "sigmoid")]:
+            random_state = np.random.RandomState(0)
+            networks = []
+
+            for i in range(10):
+                network = FFNN_multilayer(N_inputs=14, N_outputs=6, act_fn=act_fn, use_bias=use_bias,
+                                          N_hidden_layers=hidden_layers, N_hidden_units=4, random_dist="normal", seed=i)
+                network.set_weights_by_list(random_state.randn(network.get_num_weights()))
+                networks += [network]
+
+            genomes = np.array([network.get_weights_as_list() for network in networks])
+            batched_networks = [BatchedFFNN(networks), BatchedFFNN.from_genomes(networks[0], genomes)]
+
+            for t in range(20):
+                inputs = random_state.randint(0, 2, size=(10, 14))
+                expected_outputs = np.array([network.forward(inputs[i]) for i, network in enumerate(networks)])
+
+                for batched_network in batched_networks:
+                    self.assertTrue(np.array_equal(batched_network.forward(inputs), expected_outputs))
+
+    def test_can_batch(self):
+        # Test: Only feedforward networks with the same architecture can be batched
+        network = FFNN_multilayer(N_inputs=14, N_outputs=6, act_fn="tanh", use_bias=False, N_hidden_layers=1,
+                                  N_hidden_units=4, random_dist="normal", seed=1)
+        other_activation = FFNN_multilayer(N_inputs=14, N_outputs=6, act_fn="linear", use_bias=False,
+                                           N_hidden_layers=1, N_hidden_units=4, random_dist="normal", seed=1)
+        other_size = FFNN_multilayer(N_inputs=14, N_outputs=6, act_fn="tanh", use_bias=False, N_hidden_layers=1,
+                                     N_hidden_units=5, random_dist="normal", seed=1)
+        recurrent = RNN_multilayer(N_inputs=14, N_outputs=6, act_fn="tanh", use_bias=False, N_hidden_layers=1,
+                                   N_hidden_units=4, random_dist="normal", seed=1)
+
+        self.assertTrue(BatchedFFNN.can_batch([network, network]))
+        self.assertFalse(BatchedFFNN.can_batch([network, other_activation]))
+        self.assertFalse(BatchedFFNN.can_batch([network, other_size]))
+        self.assertFalse(BatchedFFNN.can_batch([network, recurrent]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+import numpy as np
+
+from agents.lean_networks.RNN_multilayer import RNN_multilayer
+from agents.lean_networks.BatchedRNN import BatchedRNN
+
+
+class BatchedRNNTest(unittest.TestCase):
+    def test_forward(self):
+        # Test: The batched forward pass gives exactly the same outputs as each network's own forward pass
+        for hidden_layers, use_bias, act_fn in [(0, False, "tanh"), (1, True, "tanh"), (2, False, "sigmoid")]:
+            random_state = np.random.RandomState(0)
+            networks = []
+
+            for i in range(10):
+                network = RNN_multilayer(N_inputs=14, N_outputs=6, act_fn=act_fn, use_bias=use_bias,
+                                         N_hidden_layers=hidden_layers, N_hidden_units=4, random_dist="normal", seed=i)
+                network.set_weights_by_list(random_state.randn(network.get_num_weights()))
+                networks += [network]
+
+            # One network has already been run, so its state isn't 0
+            networks[3].forward(np.ones(14))
+
+            batched_network = BatchedRNN(networks)
+
+            for t in range(50):
+                inputs = random_state.randint(0, 2, size=(10, 14))
+                outputs = batched_network.forward(inputs)
+                expected_outputs = np.array([network.forward(inputs[i]) for i, network in enumerate(networks)])
+                self.assertTrue(np.array_equal(outputs, expected_outputs))
+
+            batched_network.reset_state()
+            self.assertTrue(all(not output.any() for output in batched_network.last_output))
+
+    def test_from_genomes(self):
+        # Test: A batch made from genomes starts with a state of 0 and runs like the networks with those genomes
+        random_state = np.random.RandomState(0)
+        networks = []
+
+        for i in range(10):
+            network = RNN_multilayer(N_inputs=14, N_outputs=6, act_fn="tanh", use_bias=True, N_hidden_layers=1,
+                                     N_hidden_units=4, random_dist="normal", seed=i)
+            network.set_weights_by_list(random_state.randn(network.get_num_weights()))
+            networks += [network]
+
+        genomes = np.array([network.get_weights_as_list() for network in networks])
+        batched_network = BatchedRNN.from_genomes(networks[0], genomes)
+        self.assertTrue(all(not output.any() for output in batched_network.last_output))
+
+        for t in range(20):
+            inputs = random_state.randint(0, 2, size=(10, 14))
+            expected_outputs = np.array([network.forward(inputs[i]) for i, network in enumerate(networks)])
+            self.assertTrue(np.array_equal(batched_network.forward(inputs), expected_outputs))
+
+    def test_can_batch(self):
+        # Test: Only recurrent networks with the same architecture can be batched
+        network = RNN_multilayer(N_inputs=14, N_outputs=6, act_fn="tanh", use_bias=False, N_hidden_layers=1,
+                                 N_hidden_units=4, random_dist="normal", seed=1)
+        other_activation = RNN_multilayer(N_inputs=14, N_outputs=6, act_fn="linear", use_bias=False,
+                                          N_hidden_layers=1, N_hidden_units=4, random_dist="normal", seed=1)
+        other_size = RNN_multilayer(N_inputs=14, N_outputs=6, act_fn="tanh", use_bias=False, N_hidden_layers=1,
+                                    N_hidden_units=5, random_dist="normal", seed=1)
+
+        self.assertTrue(BatchedRNN.can_batch([network, network]))
+        self.assertFalse(BatchedRNN.can_batch([network, other_activation]))
+        self.assertFalse(BatchedRNN.can_batch([network, other_size]))
+        self.assertFalse(BatchedRNN.can_batch([network, None]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+import json
+import os
+import tempfile
+import unittest
+import warnings
+import numpy as np
+
+from agents.nn_agent_lean import NNAgent, NNAgentFactory
+
+
+class NNAgentTest(unittest.TestCase):
+    def create_parameter_file(self, directory, action_table, hidden_layers=1, bias="True", architecture="ffnn"):
+        parameter_dictionary = {
+            "general": {
+                "seed": 1
+            },
+            "agent": {
+                "nn": {
+                    "architecture": architecture,
+                    "bias": bias,
+                    "hidden_layers": hidden_layers,
+                    "hidden_units_per_layer": 4,
+                    "activation_function": "tanh",
+                    "action_table": action_table
+                }
+            }
+        }
+        filename = os.path.join(directory, f"nn_agent_{architecture}_{action_table}.json")
+        f = open(filename, "w")
+        f.write(json.dumps(parameter_dictionary))
+        f.close()
+        return filename
+
+    def get_num_weights(self, observation_size, parameter_filename):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            return NNAgent(observation_size, 6, parameter_filename).get_num_weights()
+
+    def test_action_table(self):
+        # Test: An agent whose network is compiled into an action table takes the same action as the network for every
+        # observation a SlopeEnv with sensor range 1 can produce
+        random_state = np.random.RandomState(0)
+
+        with tempfile.TemporaryDirectory() as directory:
+            for hidden_layers, bias in [(0, "False"), (2, "True")]:
+                network_file = self.create_parameter_file(directory, "False", hidden_layers, bias)
+                table_file = self.create_parameter_file(directory, "True", hidden_layers, bias)
+                genome = random_state.randn(self.get_num_weights(14, network_file))
+                network_agent = NNAgent(14, 6, network_file, genome)
+                table_agent = NNAgent(14, 6, table_file, genome)
+
+                self.assertIsNone(network_agent.action_table)
+                self.assertEqual(len(table_agent.action_table), 4096)
+
+                for tiles in range(2 ** 9):
+                    for area in range(4):
+                        for carrying in range(2):
+                            observation = np.zeros(14, dtype=np.int64)
+                            observation[:9] = (tiles >> np.arange(9)) & 1
+                            observation[9 + area] = 1
+                            observation[13] = carrying
+                            self.assertEqual(table_agent.act(observation), network_agent.act(observation))
+
+    def test_genome_views(self):
+        # Test: The network's weight matrices are views into the genome it was given, which get_genome() returns
+        with tempfile.TemporaryDirectory() as directory:
+            parameter_filename = self.create_parameter_file(directory, "False", hidden_layers=2)
+            genome = np.random.RandomState(0).randn(self.get_num_weights(14, parameter_filename))
+            agent = NNAgent(14, 6, parameter_filename, genome)
+
+            self.assertTrue(np.shares_memory(agent.get_genome(), agent.net.weights_flat))
+            self.assertTrue(np.shares_memory(agent.get_genome(), genome))
+            self.assertTrue(np.array_equal(agent.get_genome(), genome))
+            self.assertTrue(all(np.shares_memory(w, genome) for w in agent.net.weights_matrix))
+            self.assertTrue(np.array_equal(np.concatenate([w.ravel() for w in agent.net.weights_matrix]), genome))
+
+    def test_genome_read_only(self):
+        # Test: Changing a genome returned by an agent raises an error instead of changing the agent's network, while a
+        # copy of the genome can be changed without affecting the network
+        with tempfile.TemporaryDirectory() as directory:
+            for architecture in ["ffnn", "rnn"]:
+                parameter_filename = self.create_parameter_file(directory, "False", architecture=architecture)
+                genome = np.random.RandomState(0).randn(self.get_num_weights(14, parameter_filename))
+                agent = NNAgent(14, 6, parameter_filename, genome.copy())
+                returned_genome = agent.get_genome()
+
+                with self.assertRaises(ValueError):
+                    returned_genome[0] += 1
+
+                with self.assertRaises(ValueError):
+                    agent.net.get_weights_as_list()[:] = 0
+
+                mutated_genome = agent.get_genome().copy()
+                mutated_genome += 1
+                self.assertTrue(np.array_equal(agent.get_genome(), genome))
+                self.assertTrue(np.array_equal(np.concatenate([w.ravel() for w in agent.net.weights_matrix]), genome))
+
+    def test_agent_factory(self):
+        # Test: Agents made by the factory are the same as agents made directly, without the parameter file being read
+        # again, and don't share their recurrent state
+        random_state = np.random.RandomState(0)
+
+        with tempfile.TemporaryDirectory() as directory:
+            for architecture in ["ffnn", "rnn"]:
+                parameter_filename = self.create_parameter_file(directory, "False", architecture=architecture)
+                factory = NNAgentFactory(14, 6, parameter_filename)
+                genomes = random_state.randn(3, factory.get_num_weights())
+                agents = [NNAgent(14, 6, parameter_filename, genome) for genome in genomes]
+                os.remove(parameter_filename)
+                factory_agents = [factory.create_agent(genome) for genome in genomes]
+
+                for t in range(20):
+                    observation = random_state.randint(0, 2, size=14)
+
+                    for agent, factory_agent in zip(agents, factory_agents):
+                        self.assertTrue(np.array_equal(agent.get_all_activation_values(observation),
+                                                       factory_agent.get_all_activation_values(observation)))
+
+                # A new agent starts from a state of 0 after the others have acted
+                self.assertFalse(any(factory.create_agent(genomes[0]).get_memory()))
+
+    def test_agent_factory_random_weights(self):
+        # Test: Agents made by the factory randomise their weights the same way as agents made directly, without
+        # changing the weights or random number generator of the factory or its other agents
+        with tempfile.TemporaryDirectory() as directory:
+            for architecture in ["ffnn", "rnn"]:
+                parameter_filename = self.create_parameter_file(directory, "False", architecture=architecture)
+                factory = NNAgentFactory(14, 6, parameter_filename)
+
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore")
+                    agent = NNAgent(14, 6, parameter_filename)
+                    factory_agents = [factory.create_agent() for i in range(2)]
+
+                initial_weights = agent.get_genome().copy()
+                self.assertTrue(np.array_equal(factory_agents[0].get_genome(), initial_weights))
+                random_weights = []
+
+                for i in range(2):
+                    agent.net.set_random_weights()
+                    factory_agents[0].net.set_random_weights()
+                    self.assertTrue(np.array_equal(factory_agents[0].get_genome(), agent.get_genome()))
+                    random_weights += [agent.get_genome().copy()]
+
+                self.assertTrue(np.array_equal(factory.network.get_weights_as_list(), initial_weights))
+                self.assertTrue(np.array_equal(factory_agents[1].get_genome(), initial_weights))
+
+                # Another agent's random number generator wasn't advanced by the first agent's
+                factory_agents[1].net.set_random_weights()
+                self.assertTrue(np.array_equal(factory_agents[1].get_genome(), random_weights[0]))
+
+    def test_action_table_too_large(self):
+        # Test: Networks whose observations have too many bits can't be compiled
+        with tempfile.TemporaryDirectory() as directory:
+            table_file = self.create_parameter_file(directory, "True")
+            genome = np.zeros(self.get_num_weights(30, table_file))
+
+            with self.assertRaises(RuntimeError):
+                NNAgent(30, 6, table_file, genome)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,19 @@
+import gc
+import inspect
 import json
+import os
+import pickle
+import tempfile
+import tracemalloc
 import unittest
+import warnings
+import numpy as np
 
-from envs.slope import SlopeEnv
+from unittest import mock
+
+from envs import slope, slope_kernels
+from envs.slope import SlopeEnv, BatchedSlopeEnv
+from trajectory_recorder import TrajectoryRecorder, TrajectoryReplay
 
 
 class SlopeEnvTest(unittest.TestCase):
@@ -32,8 +44,9 @@ class SlopeEnvTest(unittest.TestCase):
                     "downward_cost_factor": 0.2,
                     "carry_factor": 2,
                     "resource_reward": 1000,
-                    "simulation_length": 500,
-                    "num_simulation_runs": 5
+                    "episode_length": 500,
+                    "num_episodes": 5,
+                    "incremental_rewards": "False"
                 }
             },
             "agent": {
@@ -156,6 +169,529 @@ class SlopeEnvTest(unittest.TestCase):
         estimated_reward = int(parameter_dictionary['environment']['slope']['resource_reward'])
         self.assertTrue(reward[0]+reward[1] == estimated_reward-2)
 
+    def test_update_agent_positions(self):
+        # Test: Collisions are resolved exactly as by a pairwise comparison of all agents
+        parameter_filename = self.create_parameter_file()
+        parameter_dictionary = json.loads(open(parameter_filename).read())
+        parameter_dictionary['environment']['slope']['num_agents'] = 12
+        parameter_dictionary['environment']['slope']['cache_start'] = 3
+        parameter_dictionary['environment']['slope']['slope_start'] = 4
+        self.edit_parameter_file(parameter_filename, parameter_dictionary)
+        env = SlopeEnv(parameter_filename)
+        env.reset()
+        position_rng = np.random.RandomState(0)
+
+        for trial in range(100):
+            # Crowd agents into a small part of the arena so that many of them collide
+            old_positions = position_rng.randint(0, 3, size=(12, 2)).astype(np.int32)
+            new_positions = np.clip(old_positions + position_rng.randint(-1, 2, size=(12, 2)), 0, 2).astype(np.int32)
+
+            expected_positions = new_positions.copy()
+            for i in range(12):
+                for j in range(12):
+                    if tuple(new_positions[i]) == tuple(new_positions[j]) and \
+                            (i < j or tuple(new_positions[j]) == tuple(old_positions[j])):
+                        expected_positions[i] = old_positions[i]
+
+            env.agent_map.fill(0)
+            env.agent_positions = new_positions
+            env.update_agent_positions(old_positions)
+            self.assertTrue(np.array_equal(env.agent_positions, expected_positions))
+
+    def test_get_agent_observations(self):
+        # Test: An agent in the bottom left corner of the nest senses walls below and to the left of it, as well as an
+        # agent next to it, but not itself
+        parameter_filename = self.create_parameter_file()
+        env = SlopeEnv(parameter_filename)
+        env.reset()
+        env.agent_map.fill(0)
+        env.agent_positions[0] = (0, 0)
+        env.agent_positions[1] = (1, 0)
+        env.agent_map[0, 0] = 1
+        env.agent_map[0, 1] = 2
+        observations = env.get_agent_observations()
+        self.assertEqual(observations[0].tolist(), [1, 0, 0,
+                                                    1, 0, 1,
+                                                    1, 1, 1,
+                                                    1, 0, 0, 0,
+                                                    0])
+
+    def test_padded_walls(self):
+        # Test: The walls are exactly the border around the arena, for any sensor range
+        for arena_length, arena_width, sensor_range in [(8, 4, 1), (6, 3, 0), (10, 7, 3)]:
+            padded_walls = slope.generate_padded_walls(arena_length, arena_width, sensor_range)
+            expected_walls = np.ones((arena_length + 2 * sensor_range, arena_width + 2 * sensor_range), dtype=bool)
+            expected_walls[sensor_range:sensor_range + arena_length, sensor_range:sensor_range + arena_width] = False
+            self.assertTrue(np.array_equal(padded_walls, expected_walls))
+
+    def test_arena_state(self):
+        # Test: The occupancy grids and the resource index always agree with the agent and resource positions
+        parameter_filename = self.create_parameter_file()
+        env = SlopeEnv(parameter_filename)
+        env.reset()
+        action_rng = np.random.RandomState(0)
+
+        for t in range(200):
+            env.step(list(action_rng.randint(0, 6, size=2)))
+
+            expected_agent_map = np.zeros_like(env.agent_map)
+            for i, (x, y) in enumerate(env.agent_positions):
+                expected_agent_map[y, x] = max(expected_agent_map[y, x], i + 1)
+
+            expected_resource_map = np.zeros_like(env.resource_map)
+            for resource_id, (x, y) in env.resources_in_arena.items():
+                expected_resource_map[y, x] = max(expected_resource_map[y, x], resource_id + 1)
+
+            self.assertTrue(np.array_equal(env.agent_map, expected_agent_map))
+            self.assertTrue(np.array_equal(env.resource_map, expected_resource_map))
+
+            expected_resources_at_tile = {}
+            for resource_id, position in env.resources_in_arena.items():
+                expected_resources_at_tile.setdefault(position, set()).add(resource_id)
+
+            self.assertEqual({position: set(resource_ids) for position, resource_ids in env.resources_at_tile.items()},
+                             expected_resources_at_tile)
+
+            expected_source_occupied = expected_resource_map[env.source_start:] > 0
+            self.assertTrue(np.array_equal(env.source_occupied, expected_source_occupied))
+            self.assertEqual(env.num_free_source_tiles, np.count_nonzero(~expected_source_occupied))
+            self.assertTrue(np.array_equal(env.free_source_tiles_in_row, np.sum(~expected_source_occupied, axis=1)))
+
+            self.assertEqual(env.resources_on_slope,
+                             {resource_id for resource_id, (x, y) in env.resources_in_arena.items()
+                              if env.area_of_row[y] == env.SLOPE})
+            self.assertEqual(env.num_resources_at_source,
+                             len([y for x, y in env.resources_in_arena.values() if y >= env.source_start]))
+
+    def test_step_in_place(self):
+        # Test: Once warmed up, stepping in place writes into the given buffers and keeps no memory allocated in
+        # SlopeEnv, while agents collide and pick up, carry and drop a resource
+        parameter_filename = self.create_parameter_file()
+        env = SlopeEnv(parameter_filename)
+        env.reset()
+        observations = np.zeros((env.get_num_agents(), env.get_observation_size()), dtype=np.int64)
+        rewards = np.zeros(env.get_num_agents())
+
+        # Agent 0 moves to the cache and a resource is put above it, so that no resources are spawned or delivered.
+        # Agent 0 then picks up, drops and carries the resource up and down the cache while agent 1 moves around the
+        # nest, trying to move onto agent 0's old tile
+        env.step_in_place([0, 5])
+        env.set_resource_position(0, (int(env.agent_positions[0, 0]), env.cache_start + 1))
+        agent_actions = np.array([[4, 2], [5, 3], [4, 5], [0, 2], [5, 3], [1, 5]])
+        slope_filter = [tracemalloc.Filter(True, inspect.getfile(SlopeEnv), all_frames=True)]
+        tracemalloc.start(25)
+
+        for t in range(120):
+            env.step_in_place(agent_actions[t % len(agent_actions)], observations, rewards)
+
+        # A full collection also empties the interpreter's free lists, whose objects tracemalloc counts as allocated
+        gc.collect()
+        snapshot_before = tracemalloc.take_snapshot().filter_traces(slope_filter)
+
+        for t in range(1200):
+            returned_observations, returned_rewards = env.step_in_place(agent_actions[t % len(agent_actions)],
+                                                                        observations, rewards)
+
+        gc.collect()
+        snapshot_after = tracemalloc.take_snapshot().filter_traces(slope_filter)
+        tracemalloc.stop()
+
+        # Nothing allocated by the steps is still held. NumPy may free objects it cached before the steps
+        self.assertEqual([stat for stat in snapshot_after.compare_to(snapshot_before, "lineno")
+                          if stat.size_diff > 0 or stat.count_diff > 0], [])
+        self.assertTrue(env.collected_from_cache[0])
+        self.assertEqual(env.latest_resource_id, env.get_default_num_resources())
+        self.assertIs(returned_observations, observations)
+        self.assertIs(returned_rewards, rewards)
+
+    def test_step_in_place_temporary_memory(self):
+        # Test: The memory a step allocates and frees again (NumPy's scalars, views and ufunc buffers) doesn't grow with
+        # the number of agents, so no containers with an entry per agent are built while stepping
+        parameter_filename = self.create_parameter_file()
+        parameter_dictionary = json.loads(open(parameter_filename).read())
+        parameter_dictionary['environment']['slope']['arena_width'] = 64
+        peaks = []
+
+        for num_agents in [2, 32]:
+            parameter_dictionary['environment']['slope']['num_agents'] = num_agents
+            self.edit_parameter_file(parameter_filename, parameter_dictionary)
+            env = SlopeEnv(parameter_filename)
+            env.reset()
+            observations = np.zeros((num_agents, env.get_observation_size()), dtype=np.int64)
+            rewards = np.zeros(num_agents)
+
+            # Agents stay in the nest, colliding and trying to pick up and drop resources
+            action_rng = np.random.RandomState(0)
+            agent_actions = action_rng.choice([2, 3, 4, 5], size=(300, num_agents))
+
+            for t in range(100):
+                env.step_in_place(agent_actions[t], observations, rewards)
+
+            tracemalloc.start()
+            peak = 0
+
+            for t in range(100, 300):
+                tracemalloc.reset_peak()
+                start_memory = tracemalloc.get_traced_memory()[0]
+                env.step_in_place(agent_actions[t], observations, rewards)
+                peak = max(peak, tracemalloc.get_traced_memory()[1] - start_memory)
+
+            tracemalloc.stop()
+            peaks += [peak]
+
+        self.assertLessEqual(peaks[1], peaks[0])
+
+    def test_batched_step(self):
+        # Test: Each arena of a batched environment behaves exactly like a SlopeEnv with the same seed
+        parameter_filename = self.create_parameter_file()
+        parameter_dictionary = json.loads(open(parameter_filename).read())
+        parameter_dictionary['environment']['slope']['num_agents'] = 3
+        parameter_dictionary['environment']['slope']['sliding_speed'] = 2
+        self.edit_parameter_file(parameter_filename, parameter_dictionary)
+
+        seeds = [1, 2, 3]
+        envs = []
+        for seed in seeds:
+            env = SlopeEnv(parameter_filename)
+            env.seed_value = seed
+            env.reset_rng()
+            envs += [env]
+        batched_env = BatchedSlopeEnv(parameter_filename, num_arenas=len(seeds), seeds=seeds)
+
+        # Actions biased towards moving up and down so that resources get picked up, dropped and delivered
+        action_rng = np.random.RandomState(0)
+        action_probabilities = [0.3, 0.25, 0.1, 0.1, 0.15, 0.1]
+
+        for episode in range(2):
+            observations = [env.reset() for env in envs]
+            batched_observations = batched_env.reset()
+            self.assertTrue(np.array_equal(np.array(observations), batched_observations))
+
+            for t in range(300):
+                actions = action_rng.choice(6, size=(len(seeds), 3), p=action_probabilities)
+                batched_observations, batched_rewards = batched_env.step(actions)
+
+                for n, env in enumerate(envs):
+                    observations, rewards = env.step(list(actions[n]))
+                    self.assertTrue(np.array_equal(np.array(observations), batched_observations[n]))
+                    self.assertEqual(rewards, batched_rewards[n].tolist())
+
+            batched_specialisation = batched_env.calculate_ferrante_specialisation()
+            for n, env in enumerate(envs):
+                self.assertEqual(env.calculate_ferrante_specialisation(), batched_specialisation[n])
+
+    def test_get_and_set_state(self):
+        # Test: An environment restored from a pickled mid-episode snapshot continues exactly like the original
+        parameter_filename = self.create_parameter_file()
+        parameter_dictionary = json.loads(open(parameter_filename).read())
+        parameter_dictionary['environment']['slope']['num_agents'] = 3
+        parameter_dictionary['environment']['slope']['sliding_speed'] = 2
+        self.edit_parameter_file(parameter_filename, parameter_dictionary)
+
+        env = SlopeEnv(parameter_filename)
+        restored_env = SlopeEnv(parameter_filename)
+        env.reset()
+        action_rng = np.random.RandomState(0)
+        action_probabilities = [0.3, 0.25, 0.1, 0.1, 0.15, 0.1]
+
+        for t in range(200):
+            env.step(action_rng.choice(6, size=3, p=action_probabilities))
+
+        state = pickle.loads(pickle.dumps(env.get_state()))
+        self.assertTrue(np.array_equal(restored_env.set_state(state), env.get_agent_observations()))
+        self.assertEqual(restored_env.resources_in_arena, env.resources_in_arena)
+
+        for t in range(300):
+            actions = action_rng.choice(6, size=3, p=action_probabilities)
+            observations, rewards = env.step(actions)
+            restored_observations, restored_rewards = restored_env.step(actions)
+            self.assertTrue(np.array_equal(observations, restored_observations))
+            self.assertEqual(rewards, restored_rewards)
+
+        self.assertTrue(np.array_equal(env.get_state(), restored_env.get_state()))
+        self.assertEqual(env.calculate_ferrante_specialisation(), restored_env.calculate_ferrante_specialisation())
+
+        # The random number generator is part of the state, so the next episodes start the same way
+        self.assertTrue(np.array_equal(env.reset(), restored_env.reset()))
+
+    def test_episode_rng_streams(self):
+        # Test: Parameter files that don't choose the random number streams use legacy mode, so their seeds give the
+        # same episodes as before per-episode streams existed
+        parameter_filename = self.create_parameter_file()
+        parameter_dictionary = json.loads(open(parameter_filename).read())
+        parameter_dictionary['environment']['slope']['num_agents'] = 3
+        self.edit_parameter_file(parameter_filename, parameter_dictionary)
+        env = SlopeEnv(parameter_filename)
+        self.assertEqual(env.rng_streams, "legacy")
+
+        # Test: With per-episode random number streams an episode runs the same whether or not earlier episodes ran
+        parameter_dictionary['environment']['slope']['rng_streams'] = "per_episode"
+        self.edit_parameter_file(parameter_filename, parameter_dictionary)
+        action_rng = np.random.RandomState(0)
+        agent_actions = action_rng.choice(6, size=(3, 200, 3), p=[0.3, 0.25, 0.1, 0.1, 0.15, 0.1])
+
+        def run_episode(env, episode, reset_episode):
+            observation_list = [env.reset(reset_episode)]
+            for t in range(200):
+                observation_list += [env.step(agent_actions[episode, t])[0]]
+            return np.array(observation_list)
+
+        # Without an episode index, reset() goes through the episodes in order
+        env = SlopeEnv(parameter_filename)
+        sequential_runs = [run_episode(env, episode, None) for episode in range(3)]
+        self.assertTrue(np.array_equal(run_episode(SlopeEnv(parameter_filename), 2, 2), sequential_runs[2]))
+
+        env = SlopeEnv(parameter_filename)
+        run_episode(env, 1, 1)
+        self.assertTrue(np.array_equal(run_episode(env, 0, 0), sequential_runs[0]))
+
+        # Test: In legacy mode, episodes keep drawing from a single random number generator
+        parameter_dictionary['environment']['slope']['rng_streams'] = "legacy"
+        self.edit_parameter_file(parameter_filename, parameter_dictionary)
+        env = SlopeEnv(parameter_filename)
+        env.reset()
+        env.reset(0)
+        new_env = SlopeEnv(parameter_filename)
+        new_env.reset(0)
+        self.assertFalse(np.array_equal(env.get_state(), new_env.get_state()))
+
+    def test_initial_state_bank(self):
+        # Test: Resetting to an episode whose initial state is in the bank gives the same episode as drawing it again
+        parameter_filename = self.create_parameter_file()
+        parameter_dictionary = json.loads(open(parameter_filename).read())
+        parameter_dictionary['environment']['slope']['num_agents'] = 3
+        parameter_dictionary['environment']['slope']['rng_streams'] = "per_episode"
+        self.edit_parameter_file(parameter_filename, parameter_dictionary)
+        agent_actions = np.random.RandomState(0).choice(6, size=(300, 3), p=[0.3, 0.25, 0.1, 0.1, 0.15, 0.1])
+
+        env = SlopeEnv(parameter_filename)
+        env.reset(0)
+        env.reset(1)
+        self.assertEqual(len(env.initial_state_bank), 2)
+
+        for episode in [0, 1]:
+            new_env = SlopeEnv(parameter_filename)
+            self.assertTrue(np.array_equal(env.reset(episode), new_env.reset(episode)))
+            self.assertTrue(np.array_equal(env.get_state(), new_env.get_state()))
+
+            for t in range(300):
+                observations, rewards = env.step(agent_actions[t])
+                new_observations, new_rewards = new_env.step(agent_actions[t])
+                self.assertTrue(np.array_equal(observations, new_observations))
+                self.assertEqual(rewards, new_rewards)
+
+        self.assertEqual(len(env.initial_state_bank), 2)
+
+    def test_trajectory_recorder(self):
+        # Test: A recorded episode can be saved and loaded, and matches what happened in the environment
+        parameter_filename = self.create_parameter_file()
+        parameter_dictionary = json.loads(open(parameter_filename).read())
+        env = SlopeEnv(parameter_filename, headless=True)
+        recorder = TrajectoryRecorder(num_episodes=2, episode_length=50, num_agents=2)
+        action_rng = np.random.RandomState(0)
+        positions = []
+        total_rewards = []
+
+        for episode in range(2):
+            env.reset(episode)
+            recorder.record_reset(episode, env)
+            positions += [env.agent_positions.copy()]
+            total_rewards += [0.0]
+
+            for t in range(50):
+                agent_actions = action_rng.randint(0, 6, size=2).tolist()
+                observations, rewards = env.step(agent_actions)
+                recorder.record_step(episode, t, agent_actions, rewards, env)
+                positions += [env.agent_positions.copy()]
+                total_rewards[-1] += sum(rewards)
+
+        with tempfile.TemporaryDirectory() as directory:
+            trajectory_filename = os.path.join(directory, "trajectories.npz")
+            recorder.save(trajectory_filename, parameter_dictionary, {"model_hash": "abc", "ids_to_remove": [1]})
+            trajectories = TrajectoryRecorder.load(trajectory_filename)
+
+        self.assertEqual(trajectories["actions"].dtype, np.int8)
+        self.assertEqual(trajectories["positions"].dtype, np.int16)
+        self.assertEqual(trajectories["carried_resources"].dtype, np.int16)
+        self.assertEqual(trajectories["parameters"], parameter_dictionary)
+        self.assertEqual(trajectories["metadata"], {"model_hash": "abc", "ids_to_remove": [1]})
+        self.assertTrue(np.array_equal(trajectories["positions"].reshape(-1, 2, 2), positions))
+        self.assertTrue(np.allclose(trajectories["rewards"].sum(axis=(1, 2)), total_rewards))
+        self.assertTrue(np.array_equal(trajectories["carried_resources"][1, -1],
+                                       [-1 if resource_id is None else resource_id for resource_id in env.has_resource]))
+
+    def test_trajectory_replay(self):
+        # Test: Replaying recorded actions reproduces every step of the recorded episodes, including after seeking
+        parameter_filename = self.create_parameter_file()
+        parameter_dictionary = json.loads(open(parameter_filename).read())
+
+        for rng_streams in ["per_episode", "legacy"]:
+            parameter_dictionary["environment"]["slope"]["rng_streams"] = rng_streams
+            self.edit_parameter_file(parameter_filename, parameter_dictionary)
+            env = SlopeEnv(parameter_filename, headless=True)
+            recorder = TrajectoryRecorder(num_episodes=3, episode_length=40, num_agents=2)
+            action_rng = np.random.RandomState(0)
+            states = {}
+            env.reset_rng()
+
+            for episode in range(3):
+                env.reset(episode)
+                recorder.record_reset(episode, env)
+                states[(episode, 0)] = env.get_state()
+
+                for t in range(40):
+                    agent_actions = action_rng.choice(6, size=2, p=[0.4, 0.1, 0.1, 0.1, 0.2, 0.1]).tolist()
+                    observations, rewards = env.step(agent_actions)
+                    recorder.record_step(episode, t, agent_actions, rewards, env)
+                    states[(episode, t + 1)] = env.get_state()
+
+            with tempfile.TemporaryDirectory() as directory:
+                trajectory_filename = os.path.join(directory, "trajectories.npz")
+                recorder.save(trajectory_filename, parameter_dictionary)
+                replay = TrajectoryReplay(parameter_filename, trajectory_filename, snapshot_interval=8, headless=True)
+
+                # Replaying with different parameters is refused
+                different_parameters = json.loads(json.dumps(parameter_dictionary))
+                different_parameters["environment"]["slope"]["sliding_speed"] += 1
+                self.edit_parameter_file(parameter_filename, different_parameters)
+                self.assertRaises(RuntimeError, TrajectoryReplay, parameter_filename, trajectory_filename)
+
+            for episode, t in [(2, 17), (0, 40), (2, 3), (1, 0), (1, 25), (1, 30), (0, 9)]:
+                observations = replay.seek(episode, t)
+                self.assertTrue(np.array_equal(replay.env.get_state(), states[(episode, t)]))
+                self.assertTrue(np.array_equal(observations, replay.env.get_agent_observations()))
+
+    def test_profiling(self):
+        # Test: Profiling counts every phase of every step without changing what happens, and is off by default
+        parameter_filename = self.create_parameter_file()
+        env = SlopeEnv(parameter_filename)
+        profiled_env = SlopeEnv(parameter_filename)
+        profiled_env.enable_profiling()
+        env.reset()
+        profiled_env.reset()
+        action_rng = np.random.RandomState(0)
+
+        for t in range(100):
+            agent_actions = action_rng.randint(0, 6, size=2).tolist()
+            observations, rewards = env.step(agent_actions)
+            profiled_observations, profiled_rewards = profiled_env.step(agent_actions)
+            self.assertTrue(np.array_equal(observations, profiled_observations))
+            self.assertEqual(rewards, profiled_rewards)
+
+        profile = profiled_env.get_profile()
+        self.assertEqual(list(profile.keys()), ["act_and_reward", "wipe_old_positions", "update_agent_positions",
+                                                "update_resource_positions", "replenish_resources",
+                                                "get_agent_observations"])
+        self.assertTrue(all(counters["calls"] == 100 and counters["ns"] > 0 for counters in profile.values()))
+        self.assertEqual(env.get_profile(), {})
+
+        profiled_env.reset_profile()
+        profiled_env.enable_profiling(False)
+        profiled_env.step([0, 0])
+        self.assertEqual(profiled_env.get_profile(), {})
+
+    def test_headless(self):
+        # Test: A headless environment never imports the rendering module and can't be rendered
+        parameter_filename = self.create_parameter_file()
+        env = SlopeEnv(parameter_filename, headless=True)
+        env.reset()
+
+        for t in range(20):
+            env.step([0, 4])
+
+        self.assertIsNone(slope.rendering)
+        self.assertRaises(RuntimeError, env.render)
+
+    def test_find_loop(self):
+        # Test: Idle detection finds agents that stop changing the arena and loop detection finds agents going back and
+        # forth
+        parameter_filename = self.create_parameter_file()
+        parameter_dictionary = json.loads(open(parameter_filename).read())
+        parameter_dictionary['environment']['slope']['idle_detection'] = "idle"
+        self.edit_parameter_file(parameter_filename, parameter_dictionary)
+        env = SlopeEnv(parameter_filename)
+        env.reset()
+
+        # Agents go to the far left and stay there. The team is idle once their positions stop changing
+        for t in range(5):
+            old_agent_positions = env.agent_positions.copy()
+            env.step([2, 2])
+            is_idle = t > 0 and np.array_equal(old_agent_positions, env.agent_positions)
+            self.assertEqual(env.find_loop(), 1 if is_idle else None)
+
+        self.assertTrue(is_idle)
+
+        # The memory of the agents is part of the state
+        env.step([2, 2])
+        self.assertIsNone(env.find_loop(b"1"))
+
+        parameter_dictionary['environment']['slope']['idle_detection'] = "loop"
+        self.edit_parameter_file(parameter_filename, parameter_dictionary)
+        env = SlopeEnv(parameter_filename)
+        env.reset()
+        loop_lengths = []
+
+        for t in range(6):
+            env.step([0, 0] if t % 2 == 0 else [1, 1])
+            loop_lengths += [env.find_loop()]
+
+        self.assertEqual(loop_lengths[:2], [None, None])
+        self.assertEqual(loop_lengths[2:], [2, 2, 2, 2])
+
+    @unittest.skipUnless(slope_kernels.numba_available, "numba is not installed")
+    def test_numba_backend(self):
+        # Test: Parameter files that don't choose how resources are spawned use rejection sampling, as before
+        parameter_filename = self.create_parameter_file()
+        parameter_dictionary = json.loads(open(parameter_filename).read())
+        self.assertEqual(SlopeEnv(parameter_filename).resource_spawning, "rejection")
+
+        # Test: The numba backend behaves exactly like the python backend for both ways of spawning resources
+        action_probabilities = [0.3, 0.25, 0.1, 0.1, 0.15, 0.1]
+
+        for num_agents, sliding_speed, sensor_range in [(2, 4, 1), (4, 1, 1), (3, 2, 2), (4, 0, 1)]:
+            for resource_spawning in ["free_cells", "rejection"]:
+                parameter_dictionary['environment']['slope']['num_agents'] = num_agents
+                parameter_dictionary['environment']['slope']['sliding_speed'] = sliding_speed
+                parameter_dictionary['environment']['slope']['sensor_range'] = sensor_range
+                parameter_dictionary['environment']['slope']['resource_spawning'] = resource_spawning
+                self.edit_parameter_file(parameter_filename, parameter_dictionary)
+
+                python_env = SlopeEnv(parameter_filename)
+                numba_env = SlopeEnv(parameter_filename, backend="numba")
+                self.assertEqual(numba_env.backend, "numba")
+                action_rng = np.random.RandomState(0)
+
+                for episode in range(2):
+                    self.assertTrue(np.array_equal(python_env.reset(), numba_env.reset()))
+
+                    for t in range(300):
+                        actions = action_rng.choice(6, size=num_agents, p=action_probabilities)
+                        python_observations, python_rewards = python_env.step(actions)
+                        numba_observations, numba_rewards = numba_env.step(actions)
+                        self.assertTrue(np.array_equal(python_observations, numba_observations))
+                        self.assertEqual(python_rewards, numba_rewards)
+                        self.assertTrue(np.array_equal(python_env.agent_positions, numba_env.agent_positions))
+                        self.assertEqual(python_env.has_resource, numba_env.has_resource)
+
+                    numba_env.sync_resource_index()
+                    self.assertEqual(python_env.resources_in_arena, numba_env.resources_in_arena)
+                    self.assertEqual({position: set(ids) for position, ids in python_env.resources_at_tile.items()},
+                                     {position: set(ids) for position, ids in numba_env.resources_at_tile.items()})
+                    self.assertEqual(python_env.calculate_ferrante_specialisation(),
+                                     numba_env.calculate_ferrante_specialisation())
+
+    def test_numba_fallback(self):
+        # Test: Asking for the numba backend without numba installed warns and uses the python backend
+        parameter_filename = self.create_parameter_file()
+
+        with mock.patch.object(slope_kernels, "numba_available", False):
+            with warnings.catch_warnings(record=True) as caught_warnings:
+                warnings.simplefilter("always")
+                env = SlopeEnv(parameter_filename, backend="numba")
+
+        self.assertEqual(env.backend, "python")
+        self.assertTrue(any("numba is not installed" in str(warning.message) for warning in caught_warnings))
+        self.assertRaises(RuntimeError, SlopeEnv, parameter_filename, "fortran")
 
     if __name__ == '__main__':
         unittest.main()
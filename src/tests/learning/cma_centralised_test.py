@@ -0,0 +1,75 @@
+import json
+import os
+import tempfile
+import unittest
+
+from fitness import FitnessCalculator
+from learning.cma_centralised import CentralisedCMALearner
+
+
+class CentralisedCMALearnerTest(unittest.TestCase):
+    def create_parameter_file(self, directory, incremental_rewards):
+        parameter_dictionary = json.loads(open("default_parameters.json").read())
+        parameter_dictionary["environment"]["slope"]["incremental_rewards"] = incremental_rewards
+        parameter_dictionary["environment"]["slope"]["episode_length"] = 20
+        parameter_dictionary["environment"]["slope"]["num_episodes"] = 2
+        parameter_dictionary["algorithm"]["agent_population_size"] = 8
+        parameter_dictionary["algorithm"]["cma"]["generations"] = 1
+        parameter_dictionary["algorithm"]["cma"]["seeding_required"] = "False"
+
+        filename = os.path.join(directory, "test_parameters.json")
+        f = open(filename, "w")
+        f.write(json.dumps(parameter_dictionary, indent=4))
+        f.close()
+        return filename
+
+    def run_generation(self, incremental_rewards):
+        """
+        Run one generation of CMA-ES in a temporary directory, which the learner's files are written to
+        @return: The fitness calculator used
+        """
+        working_directory = os.getcwd()
+
+        with tempfile.TemporaryDirectory() as directory:
+            calculator = FitnessCalculator(self.create_parameter_file(directory, incremental_rewards), headless=True)
+            learner = CentralisedCMALearner(calculator)
+            os.chdir(directory)
+
+            try:
+                learner.learn(logging=False)
+            finally:
+                os.chdir(working_directory)
+
+        return calculator
+
+    def test_incremental_rewards(self):
+        # Test: Incremental rewards aren't supported by the batched environment, so a generation with them on
+        # evaluates teams one by one instead of failing
+        calculator = self.run_generation("True")
+        self.assertFalse(calculator.can_calculate_fitness_of_genome_population())
+        self.assertIsNone(calculator.batched_env)
+
+    def test_unbatchable_settings(self):
+        # Test: Idle detection and profiling only happen when teams are evaluated one by one
+        with tempfile.TemporaryDirectory() as directory:
+            parameter_filename = self.create_parameter_file(directory, "False")
+            self.assertTrue(FitnessCalculator(parameter_filename).can_calculate_fitness_of_genome_population())
+            profiling_calculator = FitnessCalculator(parameter_filename, profiling=True)
+            self.assertFalse(profiling_calculator.can_calculate_fitness_of_genome_population())
+
+            parameter_dictionary = json.loads(open(parameter_filename).read())
+            parameter_dictionary["environment"]["slope"]["idle_detection"] = "idle"
+            f = open(parameter_filename, "w")
+            f.write(json.dumps(parameter_dictionary, indent=4))
+            f.close()
+            self.assertFalse(FitnessCalculator(parameter_filename).can_calculate_fitness_of_genome_population())
+
+    def test_batched_generation(self):
+        # Test: Without incremental rewards, all teams of a generation are evaluated together
+        calculator = self.run_generation("False")
+        self.assertTrue(calculator.can_calculate_fitness_of_genome_population())
+        self.assertIsNotNone(calculator.batched_env)
+
+
+if __name__ == '__main__':
+    unittest.main()
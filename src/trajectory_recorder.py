@@ -0,0 +1,211 @@
+import json
+import numpy as np
+
+from envs.slope import SlopeEnv
+
+
+class TrajectoryRecorder:
+    """
+    Records what a team does during an evaluation into preallocated arrays, which are saved together to a single .npz
+    file. For every episode the file holds:
+
+    actions: int8 array with shape (num_episodes, episode_length, num_agents). Action taken by each agent at each step
+    positions: int16 array with shape (num_episodes, episode_length + 1, num_agents, 2). x,y position of each agent
+    after the reset (index 0) and after each step
+    carried_resources: int16 array with shape (num_episodes, episode_length + 1, num_agents). Id of the resource each
+    agent is carrying (-1 if none) after the reset and after each step
+    rewards: float32 array with shape (num_episodes, episode_length, num_agents). Reward of each agent at each step
+    parameters: The experiment parameters, as a JSON string
+    metadata: Anything else the trajectories were saved with (e.g. which team they came from), as a JSON string
+    """
+
+    def __init__(self, num_episodes, episode_length, num_agents):
+        """
+        @param num_episodes: Number of episodes in the evaluation
+        @param episode_length: Number of steps in each episode
+        @param num_agents: Number of agents on the team
+        """
+        self.actions = np.zeros((num_episodes, episode_length, num_agents), dtype=np.int8)
+        self.positions = np.zeros((num_episodes, episode_length + 1, num_agents, 2), dtype=np.int16)
+        self.carried_resources = np.full((num_episodes, episode_length + 1, num_agents), -1, dtype=np.int16)
+        self.rewards = np.zeros((num_episodes, episode_length, num_agents), dtype=np.float32)
+
+    def record_reset(self, episode, env):
+        """
+        Record the state of the environment at the start of an episode
+
+        @param episode: Index of the episode
+        @param env: SlopeEnv that has just been reset
+        @return:
+        """
+        assert max(env.arena_constraints["x_max"], env.arena_constraints["y_max"]) <= np.iinfo(np.int16).max, \
+            "Arena is too large to record positions"
+
+        self.positions[episode, 0] = env.agent_positions
+        self.record_carried_resources(episode, 0, env)
+
+    def record_step(self, episode, t, agent_actions, rewards, env):
+        """
+        Record a step of an episode
+
+        @param episode: Index of the episode
+        @param t: Time step
+        @param agent_actions: Action taken by each agent
+        @param rewards: Reward of each agent
+        @param env: SlopeEnv that has just been stepped with the actions
+        @return:
+        """
+        self.actions[episode, t] = agent_actions
+        self.rewards[episode, t] = rewards
+        self.positions[episode, t + 1] = env.agent_positions
+        self.record_carried_resources(episode, t + 1, env)
+
+    def record_carried_resources(self, episode, t, env):
+        assert env.latest_resource_id <= np.iinfo(np.int16).max, "Too many resources to record their ids"
+
+        for i, resource_id in enumerate(env.has_resource):
+            self.carried_resources[episode, t, i] = -1 if resource_id is None else resource_id
+
+    def save(self, filename, parameter_dictionary, metadata=None):
+        """
+        Save the recorded trajectories
+
+        @param filename: Name of the .npz file
+        @param parameter_dictionary: Dictionary of the experiment parameters
+        @param metadata: Dictionary saved alongside the trajectories
+        @return:
+        """
+        np.savez_compressed(filename, actions=self.actions, positions=self.positions,
+                            carried_resources=self.carried_resources, rewards=self.rewards,
+                            parameters=np.array(json.dumps(parameter_dictionary)),
+                            metadata=np.array(json.dumps(metadata if metadata is not None else {})))
+
+    @staticmethod
+    def load(filename):
+        """
+        Load trajectories saved by a TrajectoryRecorder
+
+        @param filename: Name of the .npz file
+        @return: Dictionary with the arrays described in the class docstring. The parameters and metadata are parsed
+        into dictionaries (the metadata is empty for files saved without any)
+        """
+        with np.load(filename) as trajectory_file:
+            trajectories = {key: trajectory_file[key] for key in trajectory_file.files}
+
+        trajectories["parameters"] = json.loads(str(trajectories["parameters"]))
+        trajectories["metadata"] = json.loads(str(trajectories["metadata"])) if "metadata" in trajectories else {}
+
+        return trajectories
+
+
+class TrajectoryReplay:
+    """
+    Replays the episodes recorded by a TrajectoryRecorder in a SlopeEnv by stepping it with the recorded actions, so
+    the team's behaviour can be rendered and measured without creating any agents. Snapshots of the environment (see
+    SlopeEnv.get_state()) are taken every snapshot_interval steps as episodes are replayed, so seeking to a step only
+    replays the steps since the closest snapshot before it
+    """
+
+    def __init__(self, parameter_filename, trajectories, snapshot_interval=50, backend="python", headless=False):
+        """
+        @param parameter_filename: Name of the file containing the experiment parameters the trajectories were recorded
+        with
+        @param trajectories: Name of a file saved by a TrajectoryRecorder or the dictionary returned by
+        TrajectoryRecorder.load()
+        @param snapshot_interval: Number of steps between snapshots
+        @param backend: Backend of the SlopeEnv ("python" or "numba")
+        @param headless: Boolean indicating whether the SlopeEnv is headless i.e. can't be rendered
+        """
+        if isinstance(trajectories, str):
+            trajectories = TrajectoryRecorder.load(trajectories)
+
+        parameter_dictionary = json.loads(open(parameter_filename).read())
+        recorded_parameters = trajectories["parameters"]
+
+        if parameter_dictionary["environment"] != recorded_parameters["environment"] or \
+                parameter_dictionary["general"]["seed"] != recorded_parameters["general"]["seed"]:
+            raise RuntimeError("Trajectories were recorded with different environment parameters")
+
+        self.env = SlopeEnv(parameter_filename, backend=backend, headless=headless)
+        self.actions = trajectories["actions"]
+        self.positions = trajectories["positions"]
+        self.num_episodes, self.episode_length = self.actions.shape[:2]
+        self.snapshot_interval = snapshot_interval
+        self.snapshots = {}  # Maps (episode, t) to the state of the environment at step t of the episode
+        self.episode = None
+        self.t = None
+
+    def reset(self, episode):
+        """
+        Start replaying an episode. In legacy mode, where an episode depends on the ones before it, the earlier
+        episodes are replayed first
+
+        @param episode: Index of the episode
+        @return: The agents' observations at the start of the episode
+        """
+        if (episode, 0) in self.snapshots:
+            observations = self.env.set_state(self.snapshots[(episode, 0)])
+
+        else:
+            # Same sequence of resets as FitnessCalculator.calculate_fitness()
+            if self.env.rng_streams == "legacy" and episode > 0:
+                self.seek(episode - 1, self.episode_length)
+            else:
+                self.env.reset_rng()
+
+            observations = self.env.reset(episode)
+            self.snapshots[(episode, 0)] = self.env.get_state()
+
+        self.episode = episode
+        self.t = 0
+
+        return observations
+
+    def step(self):
+        """
+        Step the environment with the next recorded actions of the current episode
+
+        @return: The agents' observations and rewards
+        """
+        assert self.t < self.episode_length, "Replayed past the end of the episode"
+
+        observations, rewards = self.env.step(self.actions[self.episode, self.t].tolist())
+        self.t += 1
+
+        if not np.array_equal(self.env.agent_positions, self.positions[self.episode, self.t]):
+            raise RuntimeError(f"Replay diverged from the recording at step {self.t} of episode {self.episode}")
+
+        if self.t % self.snapshot_interval == 0:
+            self.snapshots[(self.episode, self.t)] = self.env.get_state()
+
+        return observations, rewards
+
+    def seek(self, episode, t):
+        """
+        Bring the environment to the state it was in after step t of an episode (t=0 is the start of the episode)
+
+        @param episode: Index of the episode
+        @param t: Number of steps of the episode that have been taken
+        @return: The agents' observations
+        """
+        assert 0 <= t <= self.episode_length, "Time step is outside the episode"
+
+        snapshot_t = t - t % self.snapshot_interval
+
+        while snapshot_t > 0 and (episode, snapshot_t) not in self.snapshots:
+            snapshot_t -= self.snapshot_interval
+
+        # Carry on from the current step if it is closer than the snapshot
+        if episode == self.episode and snapshot_t <= self.t <= t:
+            observations = self.env.get_agent_observations()
+        elif snapshot_t > 0:
+            observations = self.env.set_state(self.snapshots[(episode, snapshot_t)])
+            self.episode = episode
+            self.t = snapshot_t
+        else:
+            observations = self.reset(episode)
+
+        while self.t < t:
+            observations, rewards = self.step()
+
+        return observations